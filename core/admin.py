@@ -6,9 +6,10 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.gis.admin import GISModelAdmin
 from .models import (
     User, Device, InterestTag, UserInterestTag, Place, Partner, Venue,
-    Cluster, Plan, Attendance, JoinRequest, CheckIn, Message, Offer,
-    Boost, RecoSnapshot, RecoItem, PopularityCounter, Report,
-    ModerationAction, BlockList, AuditLog, Subscription, Invoice
+    ClusterGeneration, Cluster, ClusterDirtyCell, MapCluster, Plan, Attendance,
+    JoinRequest, CheckIn, Message, Offer,
+    Boost, RecoSnapshot, RecoItem, RecoDirtyUser, UserProfile, PopularityCounter,
+    Report, ModerationAction, BlockList, AuditLog, Subscription, Invoice
 )
 
 
@@ -42,9 +43,10 @@ class DeviceAdmin(admin.ModelAdmin):
 @admin.register(InterestTag)
 class InterestTagAdmin(admin.ModelAdmin):
     """Admin for InterestTag model."""
-    list_display = ['name', 'slug', 'type']
+    list_display = ['name', 'slug', 'type', 'code']
     search_fields = ['name', 'slug']
     list_filter = ['type']
+    readonly_fields = ['code']
 
 
 @admin.register(Place)
@@ -81,12 +83,38 @@ class VenueAdmin(GISModelAdmin):
     raw_id_fields = ['partner']
 
 
+@admin.register(ClusterGeneration)
+class ClusterGenerationAdmin(admin.ModelAdmin):
+    """Admin for ClusterGeneration model."""
+    list_display = ['scope', 'is_active', 'cluster_count', 'created_at', 'activated_at']
+    list_filter = ['scope', 'is_active']
+    readonly_fields = ['created_at', 'activated_at']
+
+
 @admin.register(Cluster)
 class ClusterAdmin(GISModelAdmin):
     """Admin for Cluster model with GIS support."""
-    list_display = ['label', 'scope', 'plan_count', 'created_at']
+    list_display = ['label', 'scope', 'plan_count', 'generation', 'created_at']
     list_filter = ['scope', 'created_at']
     search_fields = ['label']
+    raw_id_fields = ['generation']
+
+
+@admin.register(MapCluster)
+class MapClusterAdmin(GISModelAdmin):
+    """Admin for MapCluster model with GIS support."""
+    list_display = [
+        'zoom', 'cell_x', 'cell_y', 'count', 'place_count', 'venue_count', 'plan_count',
+        'updated_at'
+    ]
+    list_filter = ['zoom']
+
+
+@admin.register(ClusterDirtyCell)
+class ClusterDirtyCellAdmin(admin.ModelAdmin):
+    """Admin for ClusterDirtyCell model."""
+    list_display = ['scope', 'cell', 'marked_at']
+    list_filter = ['scope']
 
 
 @admin.register(Plan)
@@ -175,6 +203,23 @@ class RecoItemAdmin(admin.ModelAdmin):
     raw_id_fields = ['snapshot', 'plan']
 
 
+@admin.register(UserProfile)
+class UserProfileAdmin(GISModelAdmin):
+    """Admin for UserProfile model."""
+    list_display = ['user', 'last_checkin_at', 'last_active_at', 'updated_at']
+    search_fields = ['user__handle', 'user__email']
+    raw_id_fields = ['user']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(RecoDirtyUser)
+class RecoDirtyUserAdmin(admin.ModelAdmin):
+    """Admin for RecoDirtyUser model."""
+    list_display = ['user', 'marked_at']
+    search_fields = ['user__handle', 'user__email']
+    raw_id_fields = ['user']
+
+
 @admin.register(PopularityCounter)
 class PopularityCounterAdmin(admin.ModelAdmin):
     """Admin for PopularityCounter model."""
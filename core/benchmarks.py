@@ -0,0 +1,249 @@
+"""
+Synthetic-scale benchmarks for the recommendation and clustering pipelines.
+
+`build_dataset` creates a deterministic dataset (same seed, same rows)
+with bulk inserts: users spread over a handful of cities, places and
+venues around them, plans with tags drawn from a fixed vocabulary and a
+check-in history per user. `run_benchmark` then times each pipeline
+stage, recording wall time, queries issued, peak Python memory and
+rows/sec, and `compare` checks a run against a stored baseline.
+"""
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import CheckIn, Partner, Place, Plan, User, Venue
+from .profiles import rebuild_profiles
+from .scoring import ALGO_VERSION, build_user_block, score_block
+from .snapshots import SnapshotWriter
+from .tags import get_codec
+from .tasks import update_clusters
+
+SCALES = {
+    'small': {'users': 1000, 'plans': 10000},
+    'medium': {'users': 10000, 'plans': 100000},
+    'large': {'users': 100000, 'plans': 1000000},
+}
+
+CITIES = [
+    (40.7128, -74.0060),   # New York
+    (34.0522, -118.2437),  # Los Angeles
+    (41.8781, -87.6298),   # Chicago
+    (29.7604, -95.3698),   # Houston
+    (47.6062, -122.3321),  # Seattle
+    (25.7617, -80.1918),   # Miami
+]
+
+TAGS = [
+    'coffee', 'music', 'hiking', 'food', 'art', 'sports', 'tech', 'books',
+    'games', 'film', 'dance', 'yoga', 'running', 'wine', 'beer', 'photo',
+]
+
+INSERT_BATCH = 5000
+
+
+def _uuids(rng, n):
+    rows = rng.integers(0, 256, size=(n, 16), dtype=np.uint8)
+    return [uuid.UUID(bytes=bytes(row), version=4) for row in rows]
+
+
+def _points(rng, n, spread_deg=0.15):
+    """Points scattered around the benchmark cities."""
+    centers = np.array(CITIES)[rng.integers(0, len(CITIES), size=n)]
+    coords = centers + rng.normal(0.0, spread_deg, size=(n, 2))
+    return [Point(float(lon), float(lat), srid=4326) for lat, lon in coords]
+
+
+def build_dataset(users, plans, seed=0, checkins_per_user=5, now=None):
+    """
+    Create a deterministic synthetic dataset and return row counts.
+    Rows go in through bulk_create, so signal-maintained data (tag codes,
+    plan locations, user profiles) is filled in explicitly.
+    """
+    rng = np.random.default_rng(seed)
+    now = now or timezone.now()
+    password = make_password(None)
+    codec = get_codec()
+
+    user_ids = _uuids(rng, users)
+    User.objects.bulk_create(
+        [
+            User(
+                id=user_id, handle=f'bench-{seed}-{i}',
+                email=f'bench-{seed}-{i}@example.com', password=password
+            )
+            for i, user_id in enumerate(user_ids)
+        ],
+        batch_size=INSERT_BATCH
+    )
+
+    n_places = max(1, plans // 4)
+    place_ids = _uuids(rng, n_places)
+    place_points = _points(rng, n_places)
+    Place.objects.bulk_create(
+        [
+            Place(
+                id=place_id, name=f'bench-{seed}-place-{i}', location=location, tags=[]
+            )
+            for i, (place_id, location) in enumerate(zip(place_ids, place_points))
+        ],
+        batch_size=INSERT_BATCH
+    )
+
+    partner = Partner.objects.create(
+        owner_user_id=user_ids[0], legal_name=f'bench-{seed}-partner'
+    )
+    n_venues = max(1, plans // 20)
+    venue_ids = _uuids(rng, n_venues)
+    venue_points = _points(rng, n_venues)
+    Venue.objects.bulk_create(
+        [
+            Venue(
+                id=venue_id, partner=partner, name=f'bench-{seed}-venue-{i}',
+                location=location
+            )
+            for i, (venue_id, location) in enumerate(zip(venue_ids, venue_points))
+        ],
+        batch_size=INSERT_BATCH
+    )
+
+    # A fifth of the plans are in the past, so users have history to check into
+    plan_ids = _uuids(rng, plans)
+    offsets = rng.integers(-7 * 24, 14 * 24, size=plans)
+    offsets[: plans // 5] = -np.abs(offsets[: plans // 5]) - 1
+    at_venue = rng.random(plans) < 0.2
+    hosts = rng.integers(0, users, size=plans)
+    places = rng.integers(0, n_places, size=plans)
+    venues = rng.integers(0, n_venues, size=plans)
+    rows = []
+    for i, plan_id in enumerate(plan_ids):
+        tags = sorted(set(rng.choice(TAGS, size=rng.integers(1, 4)).tolist()))
+        starts_at = now + timedelta(hours=int(offsets[i]))
+        rows.append(Plan(
+            id=plan_id,
+            host_user_id=user_ids[hosts[i]],
+            place_id=None if at_venue[i] else place_ids[places[i]],
+            venue_id=venue_ids[venues[i]] if at_venue[i] else None,
+            location=(
+                venue_points[venues[i]] if at_venue[i] else place_points[places[i]]
+            ),
+            title=f'bench-{seed}-plan-{i}',
+            tags=tags,
+            tag_codes=codec.intern(tags),
+            starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2),
+        ))
+    Plan.objects.bulk_create(rows, batch_size=INSERT_BATCH)
+
+    past_plans = np.flatnonzero(offsets < 0)
+    checkins = []
+    for user_id in user_ids:
+        size = min(checkins_per_user, len(past_plans))
+        for plan_index in rng.choice(past_plans, size=size, replace=False):
+            checkins.append(CheckIn(
+                user_id=user_id, plan_id=plan_ids[plan_index], geo=_points(rng, 1)[0]
+            ))
+    CheckIn.objects.bulk_create(checkins, batch_size=INSERT_BATCH)
+
+    for start in range(0, len(user_ids), INSERT_BATCH):
+        rebuild_profiles(user_ids[start:start + INSERT_BATCH])
+
+    return {
+        'users': users,
+        'places': n_places,
+        'venues': n_venues,
+        'plans': plans,
+        'checkins': len(checkins),
+    }
+
+
+class StageRecorder:
+    """Accumulate wall time, queries, peak memory and rows per stage."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Time one execution of a stage; set `counter['rows']` inside the block."""
+        counter = {'rows': 0}
+        tracemalloc.start()
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            yield counter
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        result = self.stages.setdefault(
+            name, {'seconds': 0.0, 'queries': 0, 'peak_mb': 0.0, 'rows': 0}
+        )
+        result['seconds'] += elapsed
+        result['queries'] += len(queries)
+        result['peak_mb'] = max(result['peak_mb'], peak / 2 ** 20)
+        result['rows'] += counter['rows']
+
+    def results(self):
+        return {
+            name: dict(result, rows_per_sec=(
+                result['rows'] / result['seconds'] if result['seconds'] else 0.0
+            ))
+            for name, result in self.stages.items()
+        }
+
+
+def run_benchmark(block_size=256, batch_size=5000):
+    """Run the recommendation and clustering pipelines stage by stage."""
+    recorder = StageRecorder()
+    user_ids = list(
+        User.objects.filter(is_active=True).order_by('id').values_list('id', flat=True)
+    )
+
+    writer = SnapshotWriter(batch_size=batch_size)
+    for start in range(0, len(user_ids), block_size):
+        with recorder.stage('reco.load') as counter:
+            block, plans = build_user_block(user_ids[start:start + block_size])
+            counter['rows'] = len(block)
+        with recorder.stage('reco.score') as counter:
+            scored = score_block(block, plans)
+            counter['rows'] = sum(len(items) for items in scored.values())
+        with recorder.stage('reco.write') as counter:
+            before = writer.row_count
+            for user_id, items in scored.items():
+                writer.add(user_id, items, algo_version=ALGO_VERSION)
+            counter['rows'] = writer.row_count - before
+    with recorder.stage('reco.write'):
+        writer.flush()
+
+    with recorder.stage('clusters') as counter:
+        update_clusters()
+        counter['rows'] = Place.objects.count() + Venue.objects.count()
+
+    return recorder.results()
+
+
+def compare(results, baseline, threshold):
+    """
+    Return human-readable regressions of `results` against `baseline`:
+    time, queries or peak memory more than `threshold` (a fraction) worse.
+    """
+    regressions = []
+    for name, previous in baseline.items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for metric in ('seconds', 'queries', 'peak_mb'):
+            before, after = previous[metric], current[metric]
+            if before and after > before * (1 + threshold):
+                regressions.append(
+                    f'{name}.{metric}: {after:.2f} vs baseline {before:.2f} '
+                    f'(+{(after / before - 1) * 100:.0f}%)'
+                )
+    return regressions
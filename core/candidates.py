@@ -0,0 +1,116 @@
+"""
+Candidate generation for recommendations.
+
+Instead of scoring every upcoming plan, each user gets a short list of
+candidates: the nearest plans around their latest check-in (KNN within a
+radius on the GiST-indexed Plan.location geography) followed by plans
+sharing their tags (GIN-indexed overlap on Plan.tag_codes).
+Each source is a single query for a whole block of users.
+"""
+import json
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .models import Plan
+
+NEARBY_SQL = f"""
+SELECT u.user_id, c.plan_id
+FROM unnest(%(user_ids)s::uuid[], %(lons)s::float8[], %(lats)s::float8[])
+    AS u(user_id, lon, lat)
+CROSS JOIN LATERAL (
+    SELECT p.id AS plan_id
+    FROM {Plan._meta.db_table} p
+    WHERE ST_DWithin(
+        p.location, ST_SetSRID(ST_MakePoint(u.lon, u.lat), 4326)::geography,
+        %(radius_m)s
+    )
+      AND p.is_active AND p.starts_at >= %(now)s
+    ORDER BY
+        p.location <-> ST_SetSRID(ST_MakePoint(u.lon, u.lat), 4326)::geography, p.id
+    LIMIT %(limit)s
+) c
+"""
+
+TAG_SQL = f"""
+SELECT u.user_id, c.id
+FROM jsonb_to_recordset(%(users)s::jsonb) AS u(user_id uuid, tag_codes integer[])
+CROSS JOIN LATERAL (
+    SELECT p.id FROM {Plan._meta.db_table} p
+    WHERE p.tag_codes && u.tag_codes AND p.is_active AND p.starts_at >= %(now)s
+    ORDER BY p.starts_at, p.id
+    LIMIT %(limit)s
+) c
+"""
+
+
+def nearby_candidates(user_ids, locations, now, radius_m, limit):
+    """Nearest upcoming plans within radius_m of each located user."""
+    located = [
+        (user_id, loc) for user_id, loc in zip(user_ids, locations) if loc is not None
+    ]
+    if not located:
+        return {}
+    params = {
+        'user_ids': [str(user_id) for user_id, _ in located],
+        'lons': [loc.x for _, loc in located],
+        'lats': [loc.y for _, loc in located],
+        'radius_m': float(radius_m),
+        'now': now,
+        'limit': limit,
+    }
+    return _fetch_grouped(NEARBY_SQL, params)
+
+
+def tag_candidates(user_ids, user_tag_codes, now, limit):
+    """Soonest upcoming plans sharing at least one tag code with each user."""
+    users = [
+        {'user_id': str(user_id), 'tag_codes': sorted(codes)}
+        for user_id, codes in zip(user_ids, user_tag_codes) if codes
+    ]
+    if not users:
+        return {}
+    params = {'users': json.dumps(users), 'now': now, 'limit': limit}
+    return _fetch_grouped(TAG_SQL, params)
+
+
+def fallback_candidates(now, limit):
+    """Soonest upcoming plans, for users with neither location nor tags."""
+    return list(
+        Plan.objects.filter(is_active=True, starts_at__gte=now)
+        .order_by('starts_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+
+def generate_candidates(user_ids, locations, user_tag_codes, now=None):
+    """
+    Return a dict mapping each user id to its ordered candidate plan ids:
+    nearby plans first, then tag matches, without duplicates.
+    """
+    now = now or timezone.now()
+    limit = settings.RECO_CANDIDATE_LIMIT
+    nearby = nearby_candidates(
+        user_ids, locations, now, settings.RECO_CANDIDATE_RADIUS_M, limit
+    )
+    tagged = tag_candidates(user_ids, user_tag_codes, now, limit)
+
+    candidates = {}
+    fallback = None
+    for user_id in user_ids:
+        plan_ids = nearby.get(user_id, []) + tagged.get(user_id, [])
+        plan_ids = list(dict.fromkeys(plan_ids))
+        if not plan_ids:
+            if fallback is None:
+                fallback = fallback_candidates(now, limit)
+            plan_ids = fallback
+        candidates[user_id] = plan_ids
+    return candidates
+
+
+def _fetch_grouped(sql, params):
+    grouped = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for user_id, plan_id in cursor.fetchall():
+            grouped.setdefault(user_id, []).append(plan_id)
+    return grouped
@@ -0,0 +1,397 @@
+"""
+Spatial clustering of places and venues.
+
+Coordinates are streamed from the database (server-side cursor,
+`values_list` of ST_Y/ST_X) straight into a NumPy buffer, without building
+model instances. DBSCAN then runs on the sphere: haversine metric over a
+BallTree in radians, with eps expressed in meters. The world is split
+into lat/lon tiles with an eps-wide halo; tiles are clustered in parallel
+and clusters spanning tile borders are merged deterministically.
+Tiles double as change-tracking cells: only cells with place/venue
+changes since the last run, and their neighbours, are re-clustered.
+
+Each cluster keeps its member place/venue ids, so plans are assigned to
+clusters with set-based UPDATEs after a run and kept in sync
+incrementally by the Plan signals in between.
+"""
+import multiprocessing
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.db import connection
+from django.db.models import F, FloatField, Func
+from sklearn.cluster import DBSCAN
+from .geo import EARTH_RADIUS_M
+from .models import Cluster, ClusterDirtyCell, Plan
+
+# Plan column holding the member id for each scope; a plan at a place
+# belongs to the place's cluster even when it also names a venue
+SCOPE_MEMBERS = {
+    'places': ('place_id', ''),
+    'venues': ('venue_id', 'AND p.place_id IS NULL'),
+}
+
+EXTENT_PAD_DEG = 1e-6
+
+_POINTS = np.dtype([('id', 'V16'), ('lat', np.float64), ('lon', np.float64)])
+
+
+def stream_coordinates(queryset, field='location', chunk_size=10000):
+    """
+    Stream ids and coordinates of a point field. Returns (ids, coords):
+    ids as a (n,) array of 16-byte UUIDs and coords as (n, 2) float64
+    [lat, lon] degrees.
+    """
+    rows = queryset.annotate(
+        _lat=Func(F(field), function='ST_Y', output_field=FloatField()),
+        _lon=Func(F(field), function='ST_X', output_field=FloatField()),
+    ).values_list('pk', '_lat', '_lon').iterator(chunk_size=chunk_size)
+    points = np.fromiter(((pk.bytes, lat, lon) for pk, lat, lon in rows), dtype=_POINTS)
+    return points['id'], np.stack([points['lat'], points['lon']], axis=1)
+
+
+def dbscan_haversine(coords, eps_m, min_samples):
+    """DBSCAN labels for [lat, lon] degree coordinates, eps in meters."""
+    return _dbscan_tile(coords, eps_m, min_samples)[0]
+
+
+def _dbscan_tile(coords, eps_m, min_samples):
+    """Labels and core-sample mask for one tile; runs in a worker process."""
+    if len(coords) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=bool)
+    model = DBSCAN(
+        eps=eps_m / EARTH_RADIUS_M,
+        min_samples=min_samples,
+        metric='haversine',
+        algorithm='ball_tree',
+    ).fit(np.radians(coords))
+    core = np.zeros(len(coords), dtype=bool)
+    core[model.core_sample_indices_] = True
+    return model.labels_, core
+
+
+def tile_index(coords, tile_deg):
+    """(row, col, key) of the lat/lon tile containing each [lat, lon] point."""
+    n_rows, n_cols = int(np.ceil(180 / tile_deg)), int(np.ceil(360 / tile_deg))
+    row = np.floor((coords[:, 0] + 90) / tile_deg).astype(np.int64)
+    row = np.minimum(row, n_rows - 1)
+    col = np.floor((coords[:, 1] + 180) / tile_deg).astype(np.int64) % n_cols
+    return row, col, row * n_cols + col
+
+
+def neighbour_tiles(keys, tile_deg):
+    """The given tile keys plus their eight neighbours, wrapping in longitude."""
+    n_rows, n_cols = int(np.ceil(180 / tile_deg)), int(np.ceil(360 / tile_deg))
+    result = set()
+    for key in keys:
+        row, col = divmod(key, n_cols)
+        for d_row in (-1, 0, 1):
+            if 0 <= row + d_row < n_rows:
+                result.update(
+                    (row + d_row) * n_cols + (col + d_col) % n_cols
+                    for d_col in (-1, 0, 1)
+                )
+    return result
+
+
+def tiles_covering(extent, tile_deg):
+    """Tile keys intersecting a (min_lon, min_lat, max_lon, max_lat) box."""
+    corners = np.array([[extent[1], extent[0]], [extent[3], extent[2]]])
+    (row_lo, row_hi), (col_lo, col_hi), _ = tile_index(corners, tile_deg)
+    n_cols = int(np.ceil(360 / tile_deg))
+    return {
+        row * n_cols + col
+        for row in range(row_lo, row_hi + 1)
+        for col in range(col_lo, col_hi + 1)
+    }
+
+
+def tiles_geometry(keys, tile_deg):
+    """MultiPolygon covering the given tiles."""
+    n_cols = int(np.ceil(360 / tile_deg))
+    polygons = []
+    for key in sorted(keys):
+        row, col = divmod(key, n_cols)
+        polygons.append(Polygon.from_bbox((
+            col * tile_deg - 180, row * tile_deg - 90,
+            min((col + 1) * tile_deg - 180, 180), min((row + 1) * tile_deg - 90, 90),
+        )))
+    return MultiPolygon(polygons, srid=4326)
+
+
+def tile_points(coords, tile_deg, eps_m):
+    """
+    Assign points to lat/lon tiles of `tile_deg` degrees with a halo of
+    eps_m around each tile. Returns (owner, tiles), where owner[i] is the
+    tile key owning point i and tiles maps each tile key to the sorted
+    indices of the points it sees (owned points plus its halo).
+    """
+    n_cols = int(np.ceil(360 / tile_deg))
+    lat, lon = coords[:, 0], coords[:, 1]
+    row, col, owner = tile_index(coords, tile_deg)
+
+    # Angular distance from each point to the parallels and meridians
+    # bounding its tile, compared with eps on the sphere
+    eps_rad = eps_m / EARTH_RADIUS_M
+    south = np.radians(lat - (row * tile_deg - 90))
+    north = np.radians((row + 1) * tile_deg - 90 - lat)
+    cos_lat = np.cos(np.radians(lat))
+    west_deg = lon - (col * tile_deg - 180)
+    east_deg = (col + 1) * tile_deg - 180 - lon
+    west = np.arcsin(np.clip(np.sin(np.radians(west_deg)) * cos_lat, -1, 1))
+    east = np.arcsin(np.clip(np.sin(np.radians(east_deg)) * cos_lat, -1, 1))
+    everywhere = np.ones(len(coords), dtype=bool)
+    near_row = {-1: south <= eps_rad, 0: everywhere, 1: north <= eps_rad}
+    near_col = {-1: west <= eps_rad, 0: everywhere, 1: east <= eps_rad}
+
+    keys, indices = [], []
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            mask = np.flatnonzero(near_row[d_row] & near_col[d_col])
+            keys.append((row[mask] + d_row) * n_cols + (col[mask] + d_col) % n_cols)
+            indices.append(mask)
+    keys, indices = np.concatenate(keys), np.concatenate(indices)
+    order = np.lexsort((indices, keys))
+    keys, indices = keys[order], indices[order]
+    split = np.flatnonzero(np.diff(keys)) + 1
+    tiles = {
+        int(group_keys[0]): group
+        for group_keys, group in zip(np.split(keys, split), np.split(indices, split))
+    }
+    return owner, tiles
+
+
+def dbscan_tiled(coords, eps_m, min_samples, tile_deg, workers=1):
+    """
+    DBSCAN over lat/lon tiles in parallel, merged into global labels.
+
+    Every point within eps of a tile is clustered with that tile, so a
+    point's neighbourhood (and its core status) is complete in the tile
+    that owns it. Tile clusters sharing a point that is core in its owning
+    tile are merged; other points keep their owning tile's label (or the
+    first tile's that labels them). Final labels are numbered by the
+    position of each cluster's first point, independent of tile order or
+    scheduling. Raises ValueError if eps isn't narrower than a tile, as
+    neighbours could then lie beyond the adjacent tiles.
+    """
+    if eps_m >= np.radians(tile_deg) * EARTH_RADIUS_M:
+        raise ValueError(
+            f'eps of {eps_m}m must be narrower than a {tile_deg} degree tile'
+        )
+    n = len(coords)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    owner, tiles = tile_points(coords, tile_deg, eps_m)
+    keys = sorted(tiles)
+    results = _map_tiles(
+        [coords[tiles[key]] for key in keys], eps_m, min_samples, workers
+    )
+
+    # Tile clusters become nodes numbered by (tile, local label)
+    point_ids, nodes, owned, core = [], [], [], []
+    offset = 0
+    for key, (labels, is_core) in zip(keys, results):
+        idx = tiles[key]
+        point_ids.append(idx)
+        nodes.append(np.where(labels >= 0, labels + offset, -1))
+        owned.append(owner[idx] == key)
+        core.append(is_core)
+        offset += int(labels.max()) + 1 if len(labels) and labels.max() >= 0 else 0
+    point_ids, nodes = np.concatenate(point_ids), np.concatenate(nodes)
+    owned, core = np.concatenate(owned), np.concatenate(core)
+
+    labelled = nodes >= 0
+    owner_node = np.full(n, -1, dtype=np.int64)
+    owner_node[point_ids[owned]] = nodes[owned]
+    owner_core = np.zeros(n, dtype=bool)
+    owner_core[point_ids[owned & core]] = True
+
+    parent = list(range(offset))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    merge = labelled & ~owned & owner_core[point_ids]
+    for a, b in zip(owner_node[point_ids[merge]].tolist(), nodes[merge].tolist()):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    # Points unlabelled by their owner take the first labelling tile's node
+    fallback = labelled & ~owned
+    fallback_points, first = np.unique(point_ids[fallback], return_index=True)
+    point_node = owner_node.copy()
+    unlabelled = point_node[fallback_points] < 0
+    point_node[fallback_points[unlabelled]] = nodes[fallback][first[unlabelled]]
+
+    roots = np.array(
+        [find(node) if node >= 0 else -1 for node in point_node.tolist()],
+        dtype=np.int64
+    )
+    final = np.full(n, -1, dtype=np.int64)
+    clustered = np.flatnonzero(roots >= 0)
+    _, first_seen, inverse = np.unique(
+        roots[clustered], return_index=True, return_inverse=True
+    )
+    final[clustered] = np.argsort(np.argsort(first_seen))[inverse]
+    return final
+
+
+def _map_tiles(tile_coords, eps_m, min_samples, workers):
+    args = (tile_coords, repeat(eps_m), repeat(min_samples))
+    if workers <= 1 or len(tile_coords) <= 1:
+        return list(map(_dbscan_tile, *args))
+    # Celery's prefork children are daemonic and cannot fork a process
+    # pool; there, fall back to threads (BallTree queries release the GIL)
+    if multiprocessing.current_process().daemon:
+        executor = ThreadPoolExecutor(max_workers=workers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    with executor:
+        chunksize = max(1, len(tile_coords) // (workers * 4))
+        return list(executor.map(_dbscan_tile, *args, chunksize=chunksize))
+
+
+def centroids(coords, labels):
+    """
+    [lat, lon] centroid of each cluster label 0..k-1 (noise is ignored),
+    averaged as unit vectors so clusters near the antimeridian stay put.
+    """
+    mask = labels >= 0
+    n_clusters = int(labels.max()) + 1 if mask.any() else 0
+    lat, lon = np.radians(coords[mask]).T
+    xyz = np.stack(
+        [np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=1
+    )
+    sums = np.zeros((n_clusters, 3))
+    np.add.at(sums, labels[mask], xyz)
+    x, y, z = sums.T
+    return np.degrees(
+        np.stack([np.arctan2(z, np.hypot(x, y)), np.arctan2(y, x)], axis=1)
+    )
+
+
+def extents(coords, labels):
+    """
+    Bounding box polygon of each cluster label 0..k-1. Boxes are padded
+    slightly so clusters of coincident points still have an area.
+    """
+    mask = labels >= 0
+    n_clusters = int(labels.max()) + 1 if mask.any() else 0
+    lower = np.full((n_clusters, 2), np.inf)
+    upper = np.full((n_clusters, 2), -np.inf)
+    np.minimum.at(lower, labels[mask], coords[mask])
+    np.maximum.at(upper, labels[mask], coords[mask])
+    return [
+        Polygon.from_bbox((
+            lo[1] - EXTENT_PAD_DEG, lo[0] - EXTENT_PAD_DEG,
+            hi[1] + EXTENT_PAD_DEG, hi[0] + EXTENT_PAD_DEG
+        ))
+        for lo, hi in zip(lower.tolist(), upper.tolist())
+    ]
+
+
+def members(ids, labels):
+    """Member UUIDs of each cluster label 0..k-1, in a single sort."""
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    n_clusters = int(labels.max()) + 1 if len(labels) and labels.max() >= 0 else 0
+    bounds = np.searchsorted(sorted_labels, np.arange(n_clusters + 1))
+    return [
+        [uuid.UUID(bytes=bytes(pk)) for pk in ids[order[start:end]]]
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def assign_plans(generation, cluster_ids=None):
+    """
+    Point every active plan of the generation's scope at its cluster, in
+    two set-based UPDATEs: assign members, then clear plans still pointing
+    at clusters of other generations of the scope. With `cluster_ids`,
+    only members of those clusters are assigned and nothing is cleared.
+    """
+    member_column, condition = SCOPE_MEMBERS[generation.scope]
+    params = {
+        'generation': generation.pk,
+        'scope': generation.scope,
+        'cluster_ids': [str(pk) for pk in cluster_ids or []],
+    }
+    only = 'AND c.id = ANY(%(cluster_ids)s::uuid[])' if cluster_ids is not None else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {Plan._meta.db_table} p SET cluster_id = m.cluster_id
+            FROM (
+                SELECT c.id AS cluster_id, unnest(c.member_ids) AS member_id
+                FROM {Cluster._meta.db_table} c
+                WHERE c.generation_id = %(generation)s {only}
+            ) m
+            WHERE p.{member_column} = m.member_id AND p.is_active {condition}
+              AND p.cluster_id IS DISTINCT FROM m.cluster_id
+        """, params)
+        assigned = cursor.rowcount
+        if cluster_ids is None:
+            cursor.execute(f"""
+                UPDATE {Plan._meta.db_table} p SET cluster_id = NULL
+                FROM {Cluster._meta.db_table} c
+                WHERE p.cluster_id = c.id AND c.scope = %(scope)s
+                  AND c.generation_id IS DISTINCT FROM %(generation)s
+            """, params)
+    return assigned
+
+
+def count_plans(generation, cluster_ids=None):
+    """
+    Set plan_count of the generation's clusters (or just `cluster_ids`)
+    from one aggregate query.
+    """
+    only = 'AND pc.id = ANY(%(cluster_ids)s::uuid[])' if cluster_ids is not None else ''
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            UPDATE {Cluster._meta.db_table} c SET plan_count = n.plan_count
+            FROM (
+                SELECT p.cluster_id, count(*) AS plan_count
+                FROM {Plan._meta.db_table} p
+                JOIN {Cluster._meta.db_table} pc ON pc.id = p.cluster_id
+                WHERE pc.generation_id = %(generation)s AND p.is_active {only}
+                GROUP BY p.cluster_id
+            ) n
+            WHERE c.id = n.cluster_id
+        """, {
+            'generation': generation.pk,
+            'cluster_ids': [str(pk) for pk in cluster_ids or []],
+        })
+
+
+def cluster_for_plan(plan):
+    """Id of the active cluster containing the plan's place (or venue), if any."""
+    if not plan.is_active:
+        return None
+    if plan.place_id:
+        scope, member_id = 'places', plan.place_id
+    elif plan.venue_id:
+        scope, member_id = 'venues', plan.venue_id
+    else:
+        return None
+    return Cluster.objects.filter(
+        generation__is_active=True, scope=scope, member_ids__contains=[member_id]
+    ).values_list('id', flat=True).first()
+
+
+def adjust_plan_count(cluster_id, delta):
+    """Move a cluster's plan_count by delta without reading it."""
+    if cluster_id:
+        Cluster.objects.filter(pk=cluster_id).update(plan_count=F('plan_count') + delta)
+
+
+def mark_dirty(scope, *locations):
+    """Mark the tile cells of the given points (None is skipped) for re-clustering."""
+    coords = np.array([[point.y, point.x] for point in locations if point is not None])
+    if len(coords):
+        cells = tile_index(coords, settings.CLUSTER_TILE_DEG)[2]
+        ClusterDirtyCell.objects.mark(scope, cells.tolist())
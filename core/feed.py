@@ -0,0 +1,147 @@
+"""
+Online recommendation path for the feed endpoint.
+
+When a user has no snapshot yet, or the latest one is older than
+RECO_FEED_TTL_SECONDS, the feed scores that single user on request. The
+computation runs under a strict time budget, enforced on the database by
+giving each statement the time left as its statement_timeout, and behind
+a per-user single-flight lock, so concurrent requests compute it only
+once. The result is written back as a regular snapshot. A user whose
+computation runs out of budget is served the stale snapshot for
+RECO_FEED_BACKOFF_SECONDS before it is tried again.
+"""
+import logging
+import time
+from datetime import timedelta
+from psycopg2 import errors
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+from .models import RecoDirtyUser, RecoSnapshot
+from .scoring import ALGO_VERSION, build_user_block, score_block
+from .snapshots import SnapshotWriter
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'reco-feed-lock:{user_id}'
+BACKOFF_KEY = 'reco-feed-backoff:{user_id}'
+POLL_INTERVAL = 0.05
+
+
+class BudgetExceeded(Exception):
+    """The online computation ran out of its time budget."""
+
+
+def latest_snapshot(user_id):
+    snapshots = RecoSnapshot.objects.filter(user_id=user_id)
+    return snapshots.order_by('-generated_at').first()
+
+
+def is_stale(snapshot, now=None):
+    return snapshot is None or is_stale_at(snapshot.generated_at, now)
+
+
+def is_stale_at(generated_at, now=None):
+    now = now or timezone.now()
+    ttl = timedelta(seconds=settings.RECO_FEED_TTL_SECONDS)
+    return generated_at is None or generated_at < now - ttl
+
+
+def fresh_snapshot(user_id):
+    """
+    Return the user's latest snapshot, computing a new one online if it is
+    missing or stale. Falls back to the stale snapshot (or None) when the
+    budget runs out or another request is already computing it.
+    """
+    snapshot = latest_snapshot(user_id)
+    if not is_stale(snapshot):
+        return snapshot
+
+    if cache.get(BACKOFF_KEY.format(user_id=user_id)):
+        return snapshot
+
+    budget = settings.RECO_FEED_BUDGET_MS / 1000
+    lock_key = LOCK_KEY.format(user_id=user_id)
+
+    if not cache.add(lock_key, 1, timeout=max(1, int(budget * 2))):
+        return _wait_for_snapshot(user_id, snapshot, budget)
+
+    try:
+        return compute_snapshot(user_id, budget) or snapshot
+    finally:
+        cache.delete(lock_key)
+
+
+def compute_snapshot(user_id, budget):
+    """Score one user within `budget` seconds and persist the snapshot."""
+    started = time.monotonic()
+    deadline = started + budget
+
+    def check_budget():
+        if time.monotonic() > deadline:
+            raise BudgetExceeded()
+
+    try:
+        statement_budget = _statement_budget(deadline)
+        with transaction.atomic(), connection.execute_wrapper(statement_budget):
+            block, plans = build_user_block([user_id], cold_start=True)
+            check_budget()
+            items = score_block(block, plans).get(user_id, [])
+            check_budget()
+
+            writer = SnapshotWriter()
+            snapshot_id = writer.add(user_id, items, algo_version=ALGO_VERSION)
+            writer.flush()
+            RecoDirtyUser.objects.filter(
+                user_id=user_id, marked_at__lte=timezone.now()
+            ).delete()
+    except (BudgetExceeded, DatabaseError) as exc:
+        canceled = isinstance(exc.__cause__, errors.QueryCanceled)
+        if isinstance(exc, DatabaseError) and not canceled:
+            logger.exception('Online recommendations for %s failed', user_id)
+        else:
+            _back_off(user_id, budget)
+        return None
+
+    logger.info(
+        'Computed online recommendations for %s in %.0fms',
+        user_id, (time.monotonic() - started) * 1000
+    )
+    return RecoSnapshot.objects.get(id=snapshot_id)
+
+
+def _wait_for_snapshot(user_id, stale, budget):
+    """Another request holds the lock; wait for its snapshot within budget."""
+    deadline = time.monotonic() + budget
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        snapshot = latest_snapshot(user_id)
+        if snapshot and (stale is None or snapshot.generated_at > stale.generated_at):
+            return snapshot
+    return stale
+
+
+def _back_off(user_id, budget):
+    logger.warning(
+        'Online recommendations for %s exceeded %.0fms budget', user_id, budget * 1000
+    )
+    cache.set(
+        BACKOFF_KEY.format(user_id=user_id), 1,
+        timeout=settings.RECO_FEED_BACKOFF_SECONDS
+    )
+
+
+def _statement_budget(deadline):
+    """execute_wrapper giving each statement the time left before `deadline`."""
+    def execute(execute, sql, params, many, context):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise BudgetExceeded()
+        if context['connection'].vendor == 'postgresql':
+            # On the DB-API cursor, so this doesn't pass through the wrapper again
+            context['cursor'].cursor.execute(
+                'SET LOCAL statement_timeout = %s', [max(1, int(remaining * 1000))]
+            )
+        return execute(sql, params, many, context)
+    return execute
@@ -0,0 +1,48 @@
+"""
+Rendered feed cache.
+
+The fully serialized feed is cached under a key made of the user id and
+the snapshot id. A per-user pointer names the current snapshot; writing a
+new snapshot only swaps that pointer, so readers move to the new payload
+atomically and old payloads simply expire. Entries carry a TTL and rely
+on the cache backend's eviction (LRU culling in locmem, maxmemory-policy
+allkeys-lru in Redis) to bound memory.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+POINTER_KEY = 'reco-feed:{user_id}'
+PAYLOAD_KEY = 'reco-feed:{user_id}:{snapshot_id}'
+
+
+def publish(snapshot_ids):
+    """Point users at their new snapshots. `snapshot_ids` maps user to snapshot id."""
+    if snapshot_ids:
+        cache.set_many(
+            {
+                POINTER_KEY.format(user_id=user_id): str(snapshot_id)
+                for user_id, snapshot_id in snapshot_ids.items()
+            },
+            timeout=settings.RECO_FEED_CACHE_TTL_SECONDS
+        )
+
+
+def get(user_id):
+    """Return the cached rendered feed for the user's current snapshot, if any."""
+    snapshot_id = cache.get(POINTER_KEY.format(user_id=user_id))
+    if snapshot_id is None:
+        return None
+    return cache.get(PAYLOAD_KEY.format(user_id=user_id, snapshot_id=snapshot_id))
+
+
+def store(user_id, snapshot_id, payload):
+    """
+    Cache a rendered feed. The pointer is only created when missing, so a
+    reader rendering an older snapshot never overrides a newer publish.
+    """
+    timeout = settings.RECO_FEED_CACHE_TTL_SECONDS
+    cache.set(
+        PAYLOAD_KEY.format(user_id=user_id, snapshot_id=snapshot_id), payload,
+        timeout=timeout
+    )
+    cache.add(POINTER_KEY.format(user_id=user_id), str(snapshot_id), timeout=timeout)
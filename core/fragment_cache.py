@@ -0,0 +1,103 @@
+"""
+Serialized fragment cache.
+
+Serializers opt in with FragmentCacheMixin and a Meta.fragment_version;
+each object's representation is then cached in the bounded `fragments`
+cache under (model, pk, updated_at, serializer version, field set).
+Nested serializers are part of the fragment, so the key also carries the
+updated_at of every nested object: any save changes the key, entries
+never need invalidating and superseded ones age out. Representations
+with to-many or computed fields aren't cached.
+
+hydrate() fetches every fragment a list page will render, nested ones
+included, with one multi-get.
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import serializers
+
+CACHE_ALIAS = 'fragments'
+
+
+def is_cached(serializer):
+    return getattr(serializer.Meta, 'fragment_version', None) is not None
+
+
+def fragment_key(serializer, instance):
+    """Cache key of an instance's representation, or None if it can't be cached."""
+    if not is_cached(serializer):
+        return None
+    stamps = _stamps(serializer, instance)
+    if stamps is None:
+        return None
+    field_set = hashlib.md5(','.join(serializer.fields).encode()).hexdigest()[:8]
+    return ':'.join([
+        serializer.Meta.model._meta.label_lower, str(serializer.Meta.fragment_version),
+        field_set, str(instance.pk), stamps,
+    ])
+
+
+def _stamps(serializer, instance):
+    updated_at = getattr(instance, 'updated_at', None)
+    if updated_at is None:
+        return None
+    stamps = [str(int(updated_at.timestamp() * 1_000_000))]
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if isinstance(
+            field, (serializers.ListSerializer, serializers.SerializerMethodField)
+        ):
+            return None
+        if isinstance(field, serializers.BaseSerializer):
+            related = field.get_attribute(instance)
+            nested = '-' if related is None else _stamps(field, related)
+            if nested is None:
+                return None
+            stamps.append(nested)
+    return '.'.join(stamps)
+
+
+def get(key):
+    return caches[CACHE_ALIAS].get(key)
+
+
+def store(key, data):
+    caches[CACHE_ALIAS].set(key, data, timeout=settings.FRAGMENT_CACHE_TTL_SECONDS)
+
+
+def hydrate(serializer, instances):
+    """
+    Multi-get the fragments `instances` will render with `serializer` into
+    its context, where FragmentCacheMixin looks before the cache.
+    """
+    keys = set()
+    _collect(getattr(serializer, 'child', serializer), instances, keys)
+    if keys:
+        found = caches[CACHE_ALIAS].get_many(keys)
+        serializer.context.setdefault('fragments', {}).update(
+            {key: found.get(key) for key in keys}
+        )
+
+
+def _collect(serializer, instances, keys):
+    if is_cached(serializer):
+        keys.update(filter(None, (
+            fragment_key(serializer, instance) for instance in instances
+        )))
+    for field in serializer.fields.values():
+        if field.write_only or not isinstance(field, serializers.BaseSerializer):
+            continue
+        related = [field.get_attribute(instance) for instance in instances]
+        if isinstance(field, serializers.ListSerializer):
+            field = field.child
+            related = [
+                item for items in related if items is not None for item in _items(items)
+            ]
+        _collect(field, [item for item in related if item is not None], keys)
+
+
+def _items(value):
+    # Related managers, or plain lists
+    return value.all() if hasattr(value, 'all') else value
@@ -0,0 +1,174 @@
+"""
+Geographic helpers shared by the map, nearby, clustering and scoring code.
+"""
+import math
+import numpy as np
+from django.contrib.gis.geos import MultiPolygon, Polygon
+from django.db import connection
+from .models import Place, Plan, Venue
+
+MAX_MERCATOR_LAT = 85.05112878
+EARTH_RADIUS_M = 6371008.8
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+SYNC_PLAN_LOCATIONS_SQL = f"""
+UPDATE {Plan._meta.db_table} p
+SET location = coalesce(l.location, v.location)::geography
+FROM {Plan._meta.db_table} q
+LEFT JOIN {Place._meta.db_table} l ON l.id = q.place_id
+LEFT JOIN {Venue._meta.db_table} v ON v.id = q.venue_id
+WHERE q.id = p.id AND ({{where}})
+"""
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in meters between coordinates given in degrees.
+    Inputs are broadcast against each other, so a column of user coordinates
+    and a row of plan coordinates produce a full distance matrix.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def parse_bbox(value):
+    """
+    Parse a `min_lon,min_lat,max_lon,max_lat` query parameter.
+    A min_lon greater than max_lon denotes a box crossing the antimeridian.
+    Raises ValueError for malformed or out-of-range boxes.
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except (AttributeError, ValueError):
+        raise ValueError('bbox must be min_lon,min_lat,max_lon,max_lat')
+    if not (
+        -180 <= min_lon <= 180 and -180 <= max_lon <= 180
+        and -90 <= min_lat < max_lat <= 90
+    ):
+        raise ValueError('bbox is out of range')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def bbox_geometry(bbox):
+    """Polygon for a bbox, or a MultiPolygon split at the antimeridian."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        polygon = Polygon.from_bbox(bbox)
+        polygon.srid = 4326
+        return polygon
+    return MultiPolygon(
+        Polygon.from_bbox((min_lon, min_lat, 180, max_lat)),
+        Polygon.from_bbox((-180, min_lat, max_lon, max_lat)),
+        srid=4326,
+    )
+
+
+def bbox_geography(bbox, step=0.5):
+    """
+    bbox_geometry for geography columns, whose edges are great circles:
+    the parallels get a vertex every `step` degrees of longitude, so the
+    box stays within meters of its latitude bounds.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon <= max_lon:
+        spans = [(min_lon, max_lon)]
+    else:
+        spans = [(min_lon, 180), (-180, max_lon)]
+    polygons = []
+    for west, east in spans:
+        count = max(int(math.ceil((east - west) / step)), 1)
+        lons = [west + (east - west) * i / count for i in range(count + 1)]
+        ring = [(lon, min_lat) for lon in lons]
+        ring += [(lon, max_lat) for lon in reversed(lons)]
+        polygons.append(Polygon(ring + ring[:1]))
+    if len(polygons) == 1:
+        polygons[0].srid = 4326
+        return polygons[0]
+    return MultiPolygon(*polygons, srid=4326)
+
+
+def sync_plan_locations(place_ids=(), venue_ids=(), plan_ids=(), everything=False):
+    """
+    Copy the effective location (place first, then venue) onto Plan.location
+    for plans at the given places or venues, or with the given ids, in one
+    UPDATE. Returns the number of plans written.
+    """
+    if everything:
+        where, params = 'TRUE', {}
+    else:
+        where = (
+            'q.place_id = ANY(%(place_ids)s::uuid[]) '
+            'OR q.venue_id = ANY(%(venue_ids)s::uuid[]) '
+            'OR q.id = ANY(%(plan_ids)s::uuid[])'
+        )
+        params = {
+            'place_ids': [str(pk) for pk in place_ids],
+            'venue_ids': [str(pk) for pk in venue_ids],
+            'plan_ids': [str(pk) for pk in plan_ids],
+        }
+        if not any(params.values()):
+            return 0
+    with connection.cursor() as cursor:
+        cursor.execute(SYNC_PLAN_LOCATIONS_SQL.format(where=where), params)
+        return cursor.rowcount
+
+
+def geohash_encode(lat, lon, precision):
+    """Geohash of a point with `precision` characters."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        target, interval = (lon, lon_range) if even else (lat, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if target >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def geohash_size(precision):
+    """(lat, lon) size in degrees of a geohash cell."""
+    n_bits = 5 * precision
+    return 180.0 / 2 ** (n_bits // 2), 360.0 / 2 ** ((n_bits + 1) // 2)
+
+
+def geohash_bounds(geohash):
+    """(min_lon, min_lat, max_lon, max_lat) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            interval[0 if value >> shift & 1 else 1] = middle
+            even = not even
+    return lon_range[0], lat_range[0], lon_range[1], lat_range[1]
+
+
+def geohash_neighbourhood(lat, lon, precision):
+    """The geohash containing a point and its (up to) eight neighbours."""
+    lat_size, lon_size = geohash_size(precision)
+    min_lon, min_lat, _, _ = geohash_bounds(geohash_encode(lat, lon, precision))
+    center_lat, center_lon = min_lat + lat_size / 2, min_lon + lon_size / 2
+    cells = set()
+    for d_lat in (-1, 0, 1):
+        cell_lat = center_lat + d_lat * lat_size
+        if not -90 < cell_lat < 90:
+            continue
+        for d_lon in (-1, 0, 1):
+            cell_lon = (center_lon + d_lon * lon_size + 180) % 360 - 180
+            cells.add(geohash_encode(cell_lat, cell_lon, precision))
+    return cells
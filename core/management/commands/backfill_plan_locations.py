@@ -0,0 +1,13 @@
+"""
+Management command to fill Plan.location from each plan's place or venue.
+"""
+from django.core.management.base import BaseCommand
+from core.geo import sync_plan_locations
+
+
+class Command(BaseCommand):
+    help = 'Copy place/venue locations onto Plan.location for nearby search'
+
+    def handle(self, *args, **options):
+        updated = sync_plan_locations(everything=True)
+        self.stdout.write(self.style.SUCCESS(f'Updated locations for {updated} plans'))
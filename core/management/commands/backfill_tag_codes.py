@@ -0,0 +1,33 @@
+"""
+Management command to intern plan tags and fill Plan.tag_codes.
+"""
+from django.core.management.base import BaseCommand
+from core.models import Plan
+from core.tags import get_codec
+
+
+class Command(BaseCommand):
+    help = 'Intern free-form plan tags as InterestTag codes and store them on each plan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        codec = get_codec()
+
+        batch = []
+        updated = 0
+        plans = Plan.objects.only('id', 'tags', 'tag_codes')
+        for plan in plans.iterator(chunk_size=batch_size):
+            codes = codec.intern(plan.tags)
+            if codes != plan.tag_codes:
+                plan.tag_codes = codes
+                batch.append(plan)
+            if len(batch) >= batch_size:
+                updated += Plan.objects.bulk_update(batch, ['tag_codes'])
+                batch = []
+        if batch:
+            updated += Plan.objects.bulk_update(batch, ['tag_codes'])
+
+        self.stdout.write(self.style.SUCCESS(f'Updated tag codes for {updated} plans'))
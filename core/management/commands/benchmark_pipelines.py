@@ -0,0 +1,106 @@
+"""
+Management command to benchmark the recommendation and clustering pipelines
+on a synthetic dataset.
+"""
+import json
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from core.benchmarks import SCALES, build_dataset, compare, run_benchmark
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic dataset once the benchmark is done."""
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the recommendation and clustering pipelines on a deterministic '
+        'synthetic dataset'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+        parser.add_argument(
+            '--users', type=int, help='Override the number of users of the scale'
+        )
+        parser.add_argument(
+            '--plans', type=int, help='Override the number of plans of the scale'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--baseline',
+            default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'baseline.json'),
+            help='JSON file with stored results, keyed by scale'
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Store this run as the baseline'
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed regression as a fraction of the baseline (default 0.2)'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the synthetic dataset instead of rolling back'
+        )
+
+    def handle(self, *args, **options):
+        scale = dict(SCALES[options['scale']])
+        if options['users']:
+            scale['users'] = options['users']
+        if options['plans']:
+            scale['plans'] = options['plans']
+        key = (
+            f"{options['scale']}:{scale['users']}x{scale['plans']}"
+            f":seed{options['seed']}"
+        )
+
+        try:
+            with transaction.atomic():
+                counts = build_dataset(
+                    scale['users'], scale['plans'], seed=options['seed']
+                )
+                self.stdout.write(f'Dataset {key}: ' + ', '.join(
+                    f'{n} {name}' for name, n in counts.items()
+                ))
+                results = run_benchmark(
+                    block_size=settings.RECO_SCORING_BLOCK_SIZE,
+                    batch_size=settings.RECO_SNAPSHOT_BATCH_SIZE
+                )
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            pass
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<12} {result['seconds']:8.2f}s {result['queries']:7d} queries "
+                f"{result['peak_mb']:8.1f} MB peak "
+                f"{result['rows_per_sec']:10.0f} rows/sec"
+            )
+
+        path = Path(options['baseline'])
+        baselines = json.loads(path.read_text()) if path.exists() else {}
+
+        if options['save_baseline']:
+            baselines[key] = results
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(baselines, indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline {key} to {path}'))
+            return
+
+        if key not in baselines:
+            self.stdout.write(self.style.WARNING(
+                f'No baseline for {key} in {path}; run with --save-baseline'
+            ))
+            return
+
+        regressions = compare(results, baselines[key], options['threshold'])
+        if regressions:
+            raise CommandError('Benchmark regressed:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS(
+            f'No regressions beyond {options["threshold"]:.0%} of baseline {key}'
+        ))
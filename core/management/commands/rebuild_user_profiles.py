@@ -0,0 +1,27 @@
+"""
+Management command to rebuild materialized user profiles from history.
+"""
+from django.core.management.base import BaseCommand
+from core.models import User
+from core.profiles import rebuild_profiles
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild recommendation profiles for all users from their check-ins '
+        'and attendances'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+
+        rebuilt = 0
+        for start in range(0, len(user_ids), batch_size):
+            rebuilt += rebuild_profiles(user_ids[start:start + batch_size])
+            self.stdout.write(f'  Rebuilt {rebuilt}/{len(user_ids)} profiles')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} user profiles'))
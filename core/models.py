@@ -4,8 +4,11 @@ Models for the Spontime application based on domain schema.
 import uuid
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.contrib.gis.db import models as gis_models
-from django.contrib.postgres.fields import CITextField
-from django.db import models
+from django.contrib.postgres.fields import ArrayField, CITextField
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.db import models, transaction
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
 
 
 class UserManager(BaseUserManager):
@@ -88,6 +91,8 @@ class InterestTag(models.Model):
     name = models.TextField()
     slug = CITextField(unique=True, max_length=255)
     type = models.TextField(null=True, blank=True)
+    # Dense id for tag bitsets
+    code = models.IntegerField(unique=True, null=True, blank=True)
 
     class Meta:
         db_table = 'interest_tags'
@@ -180,6 +185,48 @@ class Venue(models.Model):
         return self.name
 
 
+class ClusterGeneration(models.Model):
+    """
+    One complete clustering run for a scope.
+    Clusters are written under a new inactive generation and made visible
+    by flipping `is_active` in a single transaction.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    scope = models.CharField(max_length=20)
+    is_active = models.BooleanField(default=False)
+    cluster_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    activated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'cluster_generations'
+        indexes = [
+            models.Index(fields=['scope', 'created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['scope'], condition=models.Q(is_active=True),
+                name='one_active_generation_per_scope'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} generation {self.created_at:%Y-%m-%d %H:%M}"
+
+    def activate(self):
+        """Make this the active generation of its scope, atomically."""
+        with transaction.atomic():
+            # Lock the scope's generations so concurrent runs flip one at a time
+            generations = ClusterGeneration.objects.filter(scope=self.scope)
+            list(generations.select_for_update().values_list('id', flat=True))
+            generations.filter(is_active=True).exclude(pk=self.pk).update(
+                is_active=False
+            )
+            self.is_active = True
+            self.activated_at = timezone.now()
+            self.save(update_fields=['is_active', 'activated_at'])
+
+
 class Cluster(models.Model):
     """Cluster model for grouping entities."""
     SCOPE_CHOICES = [
@@ -193,6 +240,14 @@ class Cluster(models.Model):
     centroid = gis_models.PointField(srid=4326)
     scope = models.CharField(max_length=20, choices=SCOPE_CHOICES)
     plan_count = models.IntegerField(default=0)
+    generation = models.ForeignKey(
+        ClusterGeneration, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='clusters'
+    )
+    # Places or venues, per scope
+    member_ids = ArrayField(models.UUIDField(), default=list, blank=True)
+    # Bounding box of the members
+    extent = gis_models.PolygonField(srid=4326, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -200,12 +255,80 @@ class Cluster(models.Model):
         indexes = [
             gis_models.Index(fields=['centroid']),
             models.Index(fields=['scope']),
+            GinIndex(fields=['member_ids'], name='clusters_member_ids_gin'),
         ]
 
     def __str__(self):
         return f"{self.label} ({self.scope})"
 
 
+class MapCluster(models.Model):
+    """Precomputed grid cluster of places, venues and active plans for one zoom band."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    zoom = models.SmallIntegerField()
+    cell_x = models.IntegerField()  # Web Mercator tile column at zoom + GRID_SHIFT
+    cell_y = models.IntegerField()
+    centroid = gis_models.PointField(srid=4326)
+    count = models.IntegerField(default=0)
+    place_count = models.IntegerField(default=0)
+    venue_count = models.IntegerField(default=0)
+    plan_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'map_clusters'
+        unique_together = [['zoom', 'cell_x', 'cell_y']]
+        indexes = [
+            models.Index(fields=['zoom']),
+        ]
+
+    def __str__(self):
+        return f"z{self.zoom}/{self.cell_x}/{self.cell_y} ({self.count})"
+
+
+class ClusterDirtyCellManager(models.Manager):
+    """Manager for ClusterDirtyCell."""
+
+    def mark(self, scope, cells, at=None):
+        """Mark tile cells of a scope as needing re-clustering, in one upsert."""
+        at = at or timezone.now()
+        rows = [self.model(scope=scope, cell=cell, marked_at=at) for cell in set(cells)]
+        if rows:
+            self.bulk_create(
+                rows, update_conflicts=True, unique_fields=['scope', 'cell'],
+                update_fields=['marked_at']
+            )
+        return len(rows)
+
+
+class ClusterDirtyCell(models.Model):
+    """Tile cells with place/venue inserts, moves or deletes since the last run."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    scope = models.CharField(max_length=20)
+    cell = models.BigIntegerField()  # tile key at CLUSTER_TILE_DEG
+    marked_at = models.DateTimeField()
+
+    objects = ClusterDirtyCellManager()
+
+    class Meta:
+        db_table = 'cluster_dirty_cells'
+        unique_together = [['scope', 'cell']]
+        indexes = [
+            models.Index(fields=['scope', 'marked_at']),
+        ]
+
+
+class PlanQuerySet(models.QuerySet):
+    """QuerySet for Plan."""
+
+    def with_attendee_count(self):
+        """Annotate `attendee_count`, the joined attendances, with a row subquery."""
+        joined = Attendance.objects.filter(
+            plan=models.OuterRef('pk'), status='joined'
+        ).order_by().values('plan').annotate(count=models.Count('pk')).values('count')
+        return self.annotate(attendee_count=Coalesce(models.Subquery(joined), 0))
+
+
 class Plan(models.Model):
     """Plan model for events."""
     VISIBILITY_CHOICES = [
@@ -221,16 +344,22 @@ class Plan(models.Model):
     title = models.TextField()
     description = models.TextField(null=True, blank=True)
     tags = models.JSONField(default=list)
+    # InterestTag codes, kept in sync with tags
+    tag_codes = ArrayField(models.IntegerField(), default=list, blank=True)
     starts_at = models.DateTimeField()
     ends_at = models.DateTimeField()
     capacity = models.IntegerField(default=10)
     visibility = models.CharField(max_length=20, choices=VISIBILITY_CHOICES, default='public')
     is_active = models.BooleanField(default=True)
     cluster = models.ForeignKey(Cluster, on_delete=models.SET_NULL, null=True, blank=True, related_name='plans')
+    # Place or venue location, kept in sync
+    location = gis_models.PointField(geography=True, srid=4326, null=True, blank=True)
     rules = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = PlanQuerySet.as_manager()
+
     class Meta:
         db_table = 'plans'
         indexes = [
@@ -238,6 +367,12 @@ class Plan(models.Model):
             models.Index(fields=['starts_at']),
             models.Index(fields=['visibility']),
             models.Index(fields=['cluster']),
+            GinIndex(fields=['tag_codes'], name='plans_tag_codes_gin'),
+            # Planar bounding-box lookups (map tiles) on the geography column
+            GistIndex(
+                Cast('location', gis_models.PointField(srid=4326)),
+                name='plans_location_geom_gist'
+            ),
         ]
         constraints = [
             models.CheckConstraint(check=models.Q(capacity__gte=1), name='capacity_positive')
@@ -402,6 +537,65 @@ class RecoItem(models.Model):
         ]
 
 
+class UserProfile(models.Model):
+    """Materialized recommendation profile, kept current as users check in or attend."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='reco_profile'
+    )
+    # {tag: check-ins + joined attendances on plans with it}
+    tag_histogram = models.JSONField(default=dict)
+    # Geo of the latest check-in
+    last_location = gis_models.PointField(srid=4326, null=True, blank=True)
+    last_checkin_at = models.DateTimeField(null=True, blank=True)
+    last_active_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_profiles'
+        indexes = [
+            gis_models.Index(fields=['last_location']),
+            models.Index(fields=['last_active_at']),
+        ]
+
+    @property
+    def tags(self):
+        return {tag for tag, count in self.tag_histogram.items() if count > 0}
+
+
+class RecoDirtyUserManager(models.Manager):
+    """Manager for RecoDirtyUser."""
+
+    def mark(self, user_ids, at=None):
+        """Mark users as needing fresh recommendations, in one upsert."""
+        at = at or timezone.now()
+        rows = [
+            self.model(user_id=user_id, marked_at=at)
+            for user_id in set(user_ids) if user_id
+        ]
+        if rows:
+            self.bulk_create(
+                rows, update_conflicts=True, unique_fields=['user'],
+                update_fields=['marked_at']
+            )
+        return len(rows)
+
+
+class RecoDirtyUser(models.Model):
+    """Users whose inputs changed since their last recommendation snapshot."""
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='reco_dirty'
+    )
+    marked_at = models.DateTimeField()
+
+    objects = RecoDirtyUserManager()
+
+    class Meta:
+        db_table = 'reco_dirty_users'
+        indexes = [
+            models.Index(fields=['marked_at']),
+        ]
+
+
 class PopularityCounter(models.Model):
     """Popularity tracking."""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -0,0 +1,97 @@
+"""
+Nearby plan candidate cache.
+
+A nearby request snaps its radius up to a bucket and its point to the
+geohash cell of that bucket's precision. The cache entry for (bucket,
+cell) holds the ids and coordinates of every active plan within the
+bucket radius of the cell, so any request inside the cell with a smaller
+radius is answered by filtering the entry exactly in memory.
+
+Each precision's cells are at least as wide as its bucket (up to
+MAX_LAT), so a plan can only appear in the entries of its own cell and
+the eight around it; a plan change deletes exactly those keys.
+"""
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.measure import D
+from django.core.cache import cache
+from .geo import (
+    bbox_geometry, geohash_bounds, geohash_encode, geohash_neighbourhood, haversine_m
+)
+from .models import Plan
+
+# (radius bucket in meters, geohash precision)
+BUCKETS = [(400, 6), (1500, 5), (5000, 4), (13000, 4), (50000, 3)]
+MAX_LAT = 70.0
+KEY = 'nearby:{bucket}:{geohash}'
+# Cached for cells over NEARBY_CACHE_MAX_CANDIDATES, so they skip straight to
+# the database
+DENSE = 'dense'
+
+
+def bucket_for(lat, radius):
+    """(bucket, precision) serving a request, or None if it bypasses the cache."""
+    if abs(lat) > MAX_LAT:
+        return None
+    for bucket, precision in BUCKETS:
+        if radius <= bucket:
+            return bucket, precision
+    return None
+
+
+def within(lat, lon, radius):
+    """
+    (distance, plan id) pairs of active plans within radius of the point,
+    nearest first, or None when the request can't be served from the cache.
+    """
+    snapped = bucket_for(lat, radius)
+    if snapped is None:
+        return None
+    bucket, precision = snapped
+    geohash = geohash_encode(lat, lon, precision)
+    key = KEY.format(bucket=bucket, geohash=geohash)
+
+    entry = cache.get(key)
+    if entry is None:
+        limit = settings.NEARBY_CACHE_MAX_CANDIDATES
+        rows = list(
+            Plan.objects.filter(
+                is_active=True,
+                location__dwithin=(bbox_geometry(geohash_bounds(geohash)), D(m=bucket))
+            ).values_list('id', 'location')[:limit + 1]
+        )
+        if len(rows) > limit:
+            entry = DENSE
+        else:
+            entry = (
+                [pk for pk, _ in rows],
+                [loc.y for _, loc in rows],
+                [loc.x for _, loc in rows],
+            )
+        cache.set(key, entry, timeout=settings.NEARBY_CACHE_TTL_SECONDS)
+    if entry == DENSE:
+        return None
+
+    ids, lats, lons = entry
+    distances = haversine_m(
+        lat, lon, np.array(lats, dtype=float), np.array(lons, dtype=float)
+    )
+    return sorted(
+        (distance, pk)
+        for distance, pk in zip(distances.tolist(), ids) if distance <= radius
+    )
+
+
+def invalidate(*locations):
+    """
+    Drop every entry that may contain a plan at one of the locations
+    (None is skipped).
+    """
+    keys = [
+        KEY.format(bucket=bucket, geohash=geohash)
+        for location in locations if location is not None
+        for bucket, precision in BUCKETS
+        for geohash in geohash_neighbourhood(location.y, location.x, precision)
+    ]
+    if keys:
+        cache.delete_many(keys)
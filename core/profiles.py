@@ -0,0 +1,134 @@
+"""
+Materialized user profiles for recommendations.
+
+A UserProfile holds a tag histogram (one count per check-in or joined
+attendance on a plan carrying the tag), the location of the latest
+check-in and activity timestamps. Profiles are updated incrementally as
+check-ins and attendances are written, and rebuilt from history when an
+event is removed or a plan's tags change.
+"""
+from django.db import transaction
+from .models import Attendance, CheckIn, Plan, UserProfile
+
+
+def _tag_list(tags):
+    return tags if isinstance(tags, list) else []
+
+
+def _apply_tags(histogram, tags, delta):
+    for tag in set(_tag_list(tags)):
+        count = histogram.get(tag, 0) + delta
+        if count > 0:
+            histogram[tag] = count
+        else:
+            histogram.pop(tag, None)
+
+
+def record_checkin(checkin):
+    """Add a new check-in to its user's profile."""
+    with transaction.atomic():
+        profile, _ = UserProfile.objects.select_for_update().get_or_create(
+            user_id=checkin.user_id
+        )
+        _apply_tags(profile.tag_histogram, checkin.plan.tags, 1)
+        last_checkin_at = profile.last_checkin_at
+        if last_checkin_at is None or checkin.created_at >= last_checkin_at:
+            profile.last_checkin_at = checkin.created_at
+            profile.last_location = checkin.geo
+        profile.last_active_at = max(
+            filter(None, [profile.last_active_at, checkin.created_at])
+        )
+        profile.save()
+
+
+def record_attendance(attendance, delta):
+    """Add (delta=1) or remove (delta=-1) a user's joined attendance."""
+    with transaction.atomic():
+        profile, _ = UserProfile.objects.select_for_update().get_or_create(
+            user_id=attendance.user_id
+        )
+        _apply_tags(profile.tag_histogram, attendance.plan.tags, delta)
+        if delta > 0:
+            profile.last_active_at = max(
+                filter(None, [profile.last_active_at, attendance.joined_at])
+            )
+        profile.save()
+
+
+def rebuild_profiles(user_ids):
+    """Recompute profiles for the given users from their full history."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return 0
+
+    events = {user_id: [] for user_id in user_ids}
+    checkins = CheckIn.objects.filter(
+        user_id__in=user_ids
+    ).values_list('user_id', 'plan_id', 'created_at')
+    for user_id, plan_id, at in checkins:
+        events[user_id].append((plan_id, at))
+    attendances = Attendance.objects.filter(
+        user_id__in=user_ids,
+        status='joined'
+    ).values_list('user_id', 'plan_id', 'joined_at')
+    for user_id, plan_id, at in attendances:
+        events[user_id].append((plan_id, at))
+
+    plan_ids = {
+        plan_id for user_events in events.values() for plan_id, _ in user_events
+    }
+    plan_tags = dict(Plan.objects.filter(id__in=plan_ids).values_list('id', 'tags'))
+
+    latest = {
+        user_id: (geo, at)
+        for user_id, geo, at in CheckIn.objects.filter(user_id__in=user_ids)
+        .order_by('user_id', '-created_at')
+        .distinct('user_id')
+        .values_list('user_id', 'geo', 'created_at')
+    }
+
+    profiles = []
+    for user_id, user_events in events.items():
+        histogram = {}
+        for plan_id, _ in user_events:
+            _apply_tags(histogram, plan_tags.get(plan_id), 1)
+        geo, checkin_at = latest.get(user_id, (None, None))
+        profiles.append(UserProfile(
+            user_id=user_id,
+            tag_histogram=histogram,
+            last_location=geo,
+            last_checkin_at=checkin_at,
+            last_active_at=max((at for _, at in user_events), default=None),
+        ))
+
+    with transaction.atomic():
+        UserProfile.objects.bulk_create(
+            profiles,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=[
+                'tag_histogram', 'last_location', 'last_checkin_at', 'last_active_at',
+                'updated_at'
+            ]
+        )
+    return len(profiles)
+
+
+def load_profiles(user_ids):
+    """
+    Read profiles for a block of users in one query.
+    Users that never checked in are left out, as in v1.0.
+    Returns (user_ids, user_tags, locations) in the order given.
+    """
+    profiles = {
+        profile.user_id: profile
+        for profile in UserProfile.objects.filter(
+            user_id__in=user_ids, last_checkin_at__isnull=False
+        )
+    }
+    block_user_ids = [user_id for user_id in user_ids if user_id in profiles]
+    return (
+        block_user_ids,
+        [profiles[user_id].tags for user_id in block_user_ids],
+        [profiles[user_id].last_location for user_id in block_user_ids],
+    )
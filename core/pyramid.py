@@ -0,0 +1,103 @@
+"""
+Multi-resolution map cluster pyramid.
+
+Places, venues and active plans are aggregated on a Web Mercator grid for
+each zoom band in CLUSTER_PYRAMID_ZOOMS: at band zoom z the grid is that
+of tiles at z + GRID_SHIFT, so a 256px map tile holds at most 4x4 cells.
+The whole pyramid is rebuilt with one INSERT ... SELECT inside a
+transaction, so map readers always see a complete pyramid, and a
+viewport lookup is a single indexed query on (zoom, centroid).
+"""
+import math
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .geo import MAX_MERCATOR_LAT
+from .models import MapCluster, Place, Plan, Venue
+
+GRID_SHIFT = 2
+
+PYRAMID_SQL = f"""
+WITH points AS (
+    SELECT location, 1 AS places, 0 AS venues, 0 AS plans FROM {Place._meta.db_table}
+    UNION ALL
+    SELECT location, 0, 1, 0 FROM {Venue._meta.db_table}
+    UNION ALL
+    SELECT location::geometry, 0, 0, 1 FROM {Plan._meta.db_table}
+    WHERE is_active AND ends_at >= %(now)s AND location IS NOT NULL
+), projected AS (
+    SELECT ST_X(location) AS lon,
+           greatest(
+               least(ST_Y(location), {MAX_MERCATOR_LAT}), -{MAX_MERCATOR_LAT}
+           ) AS lat,
+           places, venues, plans
+    FROM points
+)
+INSERT INTO {MapCluster._meta.db_table}
+    (id, zoom, cell_x, cell_y, centroid, count, place_count, venue_count, plan_count,
+     updated_at)
+SELECT gen_random_uuid(), z.zoom, c.cell_x, c.cell_y,
+       ST_SetSRID(ST_MakePoint(avg(c.lon), avg(c.lat)), 4326),
+       count(*), sum(c.places), sum(c.venues), sum(c.plans), %(now)s
+FROM unnest(%(zooms)s::int[]) AS z(zoom)
+CROSS JOIN LATERAL (
+    SELECT lon, lat, places, venues, plans,
+           least(
+               floor((lon + 180) / 360 * 2 ^ (z.zoom + {GRID_SHIFT})),
+               2 ^ (z.zoom + {GRID_SHIFT}) - 1
+           )::int AS cell_x,
+           least(greatest(
+               floor(
+                   (1 - ln(tan(radians(lat)) + 1 / cos(radians(lat))) / pi()) / 2
+                   * 2 ^ (z.zoom + {GRID_SHIFT})
+               ),
+               0
+           ), 2 ^ (z.zoom + {GRID_SHIFT}) - 1)::int AS cell_y
+    FROM projected
+) c
+GROUP BY z.zoom, c.cell_x, c.cell_y
+"""
+
+
+def zoom_bands():
+    return sorted(settings.CLUSTER_PYRAMID_ZOOMS)
+
+
+def band_for_zoom(zoom):
+    """The band serving a map zoom: the deepest band not deeper than the zoom."""
+    bands = zoom_bands()
+    return max((band for band in bands if band <= zoom), default=bands[0])
+
+
+def cell_x(lon, zoom):
+    """Grid column of a longitude in a band, as in PYRAMID_SQL."""
+    n = 2 ** (zoom + GRID_SHIFT)
+    return min(math.floor((lon + 180) / 360 * n), n - 1)
+
+
+def cell_y(lat, zoom):
+    """Grid row of a latitude in a band, as in PYRAMID_SQL."""
+    n = 2 ** (zoom + GRID_SHIFT)
+    lat = max(min(lat, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    y = math.floor((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(y, 0), n - 1)
+
+
+def cell_count(bbox, zoom):
+    """Number of grid cells a viewport spans in a band."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    columns = cell_x(max_lon, zoom) - cell_x(min_lon, zoom) + 1
+    if min_lon > max_lon:
+        # Across the antimeridian
+        columns += 2 ** (zoom + GRID_SHIFT)
+    return columns * (cell_y(min_lat, zoom) - cell_y(max_lat, zoom) + 1)
+
+
+def rebuild_pyramid(now=None):
+    """Replace every pyramid level in one transaction; returns the cell count."""
+    params = {'now': now or timezone.now(), 'zooms': zoom_bands()}
+    with transaction.atomic():
+        MapCluster.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(PYRAMID_SQL, params)
+            return cursor.rowcount
@@ -0,0 +1,81 @@
+"""
+Query shapes derived from serializers.
+
+shape() walks the fields a serializer will read: nested forward relations
+become select_related joins, nested to-many relations become Prefetch
+lookups with their own shaped querysets, and plain columns (plus any
+`required_columns` a serializer declares) are collected for only().
+only() is skipped whenever a field reads something that isn't a model
+column (method fields, properties, dotted sources), since deferring its
+inputs would trade one query for one per row.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework import serializers
+
+
+def shape(model, serializer, prefix=''):
+    """
+    (select_related paths, prefetch_related lookups, only() fields or None)
+    for the readable fields of `serializer` over `model`.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    select, prefetch, only = [], [], {prefix + model._meta.pk.name}
+    only.update(prefix + name for name in getattr(serializer, 'required_columns', ()))
+    exact = True
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if len(field.source_attrs) != 1:
+            exact = False
+            continue
+        try:
+            model_field = model._meta.get_field(field.source_attrs[0])
+        except FieldDoesNotExist:
+            exact = False
+            continue
+
+        path = prefix + model_field.name
+        nested = isinstance(field, serializers.BaseSerializer)
+        if not model_field.is_relation:
+            only.add(path)
+        elif model_field.many_to_one or model_field.one_to_one:
+            if model_field.concrete:
+                only.add(path)
+            if nested:
+                select.append(path)
+                sub_select, sub_prefetch, sub_only = shape(
+                    model_field.related_model, field, path + '__'
+                )
+                select.extend(sub_select)
+                prefetch.extend(sub_prefetch)
+                exact = exact and sub_only is not None
+                only.update(sub_only or ())
+            elif not model_field.concrete:
+                select.append(path)
+        elif nested:
+            keep = [model_field.field.name] if model_field.one_to_many else []
+            related = model_field.related_model._default_manager.all()
+            prefetch.append(Prefetch(path, queryset=optimize(related, field, keep)))
+        else:
+            prefetch.append(path)
+    return select, prefetch, sorted(only) if exact else None
+
+
+def optimize(queryset, serializer, keep=()):
+    """
+    `queryset` with the joins, prefetches and columns `serializer` reads.
+    `keep` names columns needed besides, such as the key a prefetch joins on.
+    """
+    select, prefetch, only = shape(queryset.model, serializer)
+    queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+    if only is not None:
+        queryset = queryset.only(*only, *keep)
+    return queryset
+
+
+def prefetch(instances, serializer):
+    """Load what `serializer` reads onto already fetched instances."""
+    if instances:
+        select, lookups, _ = shape(type(instances[0]), serializer)
+        prefetch_related_objects(instances, *select, *lookups)
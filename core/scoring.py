@@ -0,0 +1,239 @@
+"""
+Batch scoring engine for recommendations.
+
+For each block of users a candidate set is generated (see candidates.py),
+the candidate plans are loaded into NumPy arrays and the block's (user,
+candidate) pairs are scored at once, following the v1.0 scoring rules:
+
+- base score of 0.5
+- up to +0.3 for tag overlap with the user's profile tags (bitset popcount
+  over interned tag codes)
+- +0.2 when the plan is within 5 km of the user's latest check-in
+- capped at 1.0, at most 20 items per user
+
+Each user keeps their best scoring candidates, ties broken by candidate
+order (nearest first).
+"""
+import numpy as np
+from .candidates import generate_candidates
+from .geo import haversine_m
+from .models import Attendance, CheckIn, Plan
+from .profiles import load_profiles
+from .tags import get_codec, normalize_tags, pack, paired_overlap_counts
+
+# v1.1: candidates are nearby (KNN) plus tag-matched plans, ties go to candidate order
+ALGO_VERSION = 'v1.1'
+
+BASE_SCORE = 0.5
+TAG_WEIGHT = 0.3
+NEARBY_BOOST = 0.2
+NEARBY_RADIUS_M = 5000
+MAX_ITEMS = 20
+
+
+class PlanMatrix:
+    """Candidate plans laid out as arrays for vectorized scoring."""
+
+    def __init__(self, ids, tag_lists, lats, lons):
+        self.ids = list(ids)
+        self.index = {plan_id: i for i, plan_id in enumerate(self.ids)}
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lon = np.asarray(lons, dtype=np.float64)
+        self.has_location = ~np.isnan(self.lat)
+
+        # Block-local bit positions keep the bitsets as short as the
+        # number of distinct tags among the candidates.
+        self.vocabulary = {}
+        for tags in tag_lists:
+            for tag in tags:
+                self.vocabulary.setdefault(tag, len(self.vocabulary))
+        self.tags = pack(
+            [[self.vocabulary[tag] for tag in tags] for tags in tag_lists],
+            len(self.vocabulary)
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def load_plans(plan_ids):
+    """Load the given plans into a PlanMatrix in one query."""
+    rows = Plan.objects.filter(id__in=plan_ids).order_by('id').values_list(
+        'id', 'tag_codes', 'place__location', 'venue__location'
+    )
+
+    ids, tag_lists, lats, lons = [], [], [], []
+    for plan_id, tag_codes, place_location, venue_location in rows:
+        location = place_location or venue_location
+        ids.append(plan_id)
+        tag_lists.append(set(tag_codes))
+        lats.append(location.y if location else np.nan)
+        lons.append(location.x if location else np.nan)
+
+    return PlanMatrix(ids, tag_lists, lats, lons)
+
+
+class UserBlock:
+    """Profiles and candidate lists for a block of users, aligned with a PlanMatrix."""
+
+    def __init__(
+        self, user_ids, user_tags, locations, involved_plan_ids, candidate_ids, plans,
+        tag_counts=None
+    ):
+        self.user_ids = list(user_ids)
+
+        # Tags outside the plan vocabulary can never overlap, but they still
+        # count towards the size of the user's tag set.
+        if tag_counts is None:
+            tag_counts = [len(tags) for tags in user_tags]
+        self.tag_count = np.asarray(tag_counts, dtype=np.float64)
+        self.tags = pack(
+            [
+                [plans.vocabulary[tag] for tag in tags if tag in plans.vocabulary]
+                for tags in user_tags
+            ],
+            len(plans.vocabulary)
+        )
+
+        self.lat = np.array(
+            [loc.y if loc else np.nan for loc in locations], dtype=np.float64
+        )
+        self.lon = np.array(
+            [loc.x if loc else np.nan for loc in locations], dtype=np.float64
+        )
+        self.has_location = ~np.isnan(self.lat)
+
+        # (row, col, candidate order) of each scored pair; plans that aren't
+        # loaded, or that the user was already involved with, are left out
+        rows, cols, ranks = [], [], []
+        for row, plan_ids in enumerate(candidate_ids):
+            excluded = involved_plan_ids[row]
+            for order, plan_id in enumerate(plan_ids):
+                col = plans.index.get(plan_id)
+                if col is not None and plan_id not in excluded:
+                    rows.append(row)
+                    cols.append(col)
+                    ranks.append(order)
+        self.pair_row = np.array(rows, dtype=np.int64)
+        self.pair_col = np.array(cols, dtype=np.int64)
+        self.pair_rank = np.array(ranks, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+
+def load_involved_plans(user_ids, plan_ids):
+    """
+    Return a dict mapping each user id to the plans among plan_ids they
+    checked into or joined, used to exclude them from recommendations.
+    """
+    involved = {}
+    checkins = CheckIn.objects.filter(
+        user_id__in=user_ids,
+        plan_id__in=plan_ids
+    ).values_list('user_id', 'plan_id')
+    attendances = Attendance.objects.filter(
+        user_id__in=user_ids,
+        plan_id__in=plan_ids,
+        status='joined'
+    ).values_list('user_id', 'plan_id')
+    for user_id, plan_id in list(checkins) + list(attendances):
+        involved.setdefault(user_id, set()).add(plan_id)
+    return involved
+
+
+def build_user_block(user_ids, now=None, cold_start=False):
+    """
+    Read a block of user profiles, generate their candidates and load the
+    candidate plans. Returns (UserBlock, PlanMatrix).
+    With cold_start, users without a profile are scored as having no tags
+    and no location instead of being left out.
+    """
+    if cold_start:
+        loaded = {
+            user_id: (tags, location)
+            for user_id, tags, location in zip(*load_profiles(user_ids))
+        }
+        user_tags, locations = [], []
+        for user_id in user_ids:
+            tags, location = loaded.get(user_id, (set(), None))
+            user_tags.append(tags)
+            locations.append(location)
+    else:
+        user_ids, user_tags, locations = load_profiles(user_ids)
+    codec = get_codec()
+    tag_counts = [len(normalize_tags(tags)) for tags in user_tags]
+    user_tag_codes = [codec.encode(tags) for tags in user_tags]
+
+    candidates = generate_candidates(user_ids, locations, user_tag_codes, now=now)
+    candidate_ids = [candidates.get(user_id, []) for user_id in user_ids]
+
+    all_candidate_ids = set().union(*candidate_ids)
+    involved = load_involved_plans(user_ids, all_candidate_ids)
+    plans = load_plans(all_candidate_ids)
+    block = UserBlock(
+        user_ids,
+        user_tag_codes,
+        locations,
+        [involved.get(user_id, set()) for user_id in user_ids],
+        candidate_ids,
+        plans,
+        tag_counts=tag_counts
+    )
+    return block, plans
+
+
+class ScoredItem:
+    """A single scored plan for a user."""
+    __slots__ = ('plan_id', 'score', 'distance_m', 'shared_tags')
+
+    def __init__(self, plan_id, score, distance_m, shared_tags):
+        self.plan_id = plan_id
+        self.score = score
+        self.distance_m = distance_m
+        self.shared_tags = shared_tags
+
+
+def score_block(users, plans, limit=MAX_ITEMS):
+    """
+    Score every user in the block against their own candidate plans.
+    Returns a dict mapping user id to its list of ScoredItem, best first.
+    Users left without any candidate plan are omitted.
+    """
+    rows, cols = users.pair_row, users.pair_col
+    if not len(rows):
+        return {}
+
+    shared = paired_overlap_counts(users.tags[rows], plans.tags[cols])
+    overlap = np.minimum(shared / np.maximum(users.tag_count[rows], 1.0), 1.0)
+    scores = BASE_SCORE + np.where(shared > 0, TAG_WEIGHT * overlap, 0.0)
+
+    located = users.has_location[rows] & plans.has_location[cols]
+    with np.errstate(invalid='ignore'):
+        distances = haversine_m(
+            users.lat[rows], users.lon[rows], plans.lat[cols], plans.lon[cols]
+        )
+    distances = np.where(located, distances, 0.0).astype(np.int64)
+    scores = np.where(
+        located & (distances < NEARBY_RADIUS_M), scores + NEARBY_BOOST, scores
+    )
+    scores = np.round(np.minimum(scores, 1.0), 3)
+
+    # Grouped by user, best score first, then candidate order; keep the first
+    # `limit` of each group
+    order = np.lexsort((users.pair_rank, -scores, rows))
+    sorted_rows = rows[order]
+    position = np.arange(len(order)) - np.searchsorted(sorted_rows, sorted_rows)
+    order = order[position < limit]
+
+    results = {}
+    for pair in order:
+        results.setdefault(users.user_ids[rows[pair]], []).append(
+            ScoredItem(
+                plans.ids[cols[pair]],
+                float(scores[pair]),
+                int(distances[pair]),
+                int(shared[pair])
+            )
+        )
+    return results
@@ -2,14 +2,92 @@
 DRF serializers for the Spontime application.
 """
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
+from . import fragment_cache
 from .models import (
-    User, Device, InterestTag, Place, Partner, Venue, Cluster, Plan,
+    User, Device, InterestTag, Place, Partner, Venue, Cluster, MapCluster, Plan,
     Attendance, JoinRequest, CheckIn, Message, Offer, RecoSnapshot, RecoItem
 )
 
 
-class UserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """
+    Sparse fieldsets for a top-level serializer.
+
+    On reads, `?fields=a,b` limits the output to those fields, and
+    `?expand=x,y` nests only those of the relations in Meta.expandable. Relations that
+    aren't expanded render as their id (to-many relations are left out).
+    Without `?expand=`, every relation is nested unless the view passes
+    `compact` in the serializer context.
+    """
+
+    @classmethod
+    def expansion(cls, context):
+        """Names of the Meta.expandable relations to nest for a context."""
+        expandable = set(cls.Meta.expandable)
+        expand = _query_list(context, 'expand')
+        if expand is not None:
+            return expandable & expand
+        return set() if context.get('compact') else expandable
+
+    def get_fields(self):
+        fields = super().get_fields()
+        top_level = self.root is self or (
+            self.root is self.parent
+            and isinstance(self.parent, serializers.ListSerializer)
+        )
+        if not top_level:
+            return fields
+
+        for name in set(self.Meta.expandable) - self.expansion(self.context):
+            if isinstance(fields[name], serializers.ListSerializer):
+                del fields[name]
+            else:
+                fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        requested = _query_list(self.context, 'fields')
+        if requested:
+            for name, field in list(fields.items()):
+                if name not in requested and not field.write_only:
+                    del fields[name]
+        return fields
+
+
+class FragmentCacheMixin:
+    """
+    Cache each object's representation (see core.fragment_cache).
+    Opt in by setting Meta.fragment_version; bump it whenever the
+    representation changes.
+    """
+    # Columns the cache key reads, loaded even when not serialized
+    required_columns = ['updated_at']
+
+    def to_representation(self, instance):
+        key = fragment_cache.fragment_key(self, instance)
+        if key is None:
+            return super().to_representation(instance)
+        hydrated = self.context.get('fragments', {})
+        data = hydrated[key] if key in hydrated else fragment_cache.get(key)
+        if data is None:
+            data = super().to_representation(instance)
+            fragment_cache.store(key, data)
+            hydrated[key] = data
+        return data
+
+
+def _query_list(context, param):
+    # Reads only: a write needs every writable field, whatever ?fields= says
+    request = context.get('request')
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    value = request.query_params.get(param)
+    if value is None:
+        return None
+    return {part.strip() for part in value.split(',') if part.strip()}
+
+
+class UserSerializer(FragmentCacheMixin, serializers.ModelSerializer):
     """Serializer for User model."""
     
     class Meta:
@@ -17,6 +95,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'handle', 'display_name', 'email', 'phone', 'photo_url', 'language', 'status', 'created_at']
         read_only_fields = ['id', 'created_at']
         extra_kwargs = {'email': {'write_only': True}}
+        fragment_version = 1
 
 
 class DeviceSerializer(serializers.ModelSerializer):
@@ -37,7 +116,7 @@ class InterestTagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class PlaceSerializer(GeoFeatureModelSerializer):
+class PlaceSerializer(FragmentCacheMixin, GeoFeatureModelSerializer):
     """GeoJSON serializer for Place model."""
     owner_user = UserSerializer(read_only=True)
     
@@ -46,6 +125,7 @@ class PlaceSerializer(GeoFeatureModelSerializer):
         geo_field = 'location'
         fields = ['id', 'name', 'address', 'city', 'country', 'owner_user', 'tags', 'created_at']
         read_only_fields = ['id', 'created_at']
+        fragment_version = 1
 
 
 class PartnerSerializer(serializers.ModelSerializer):
@@ -58,7 +138,7 @@ class PartnerSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
-class VenueSerializer(GeoFeatureModelSerializer):
+class VenueSerializer(FragmentCacheMixin, GeoFeatureModelSerializer):
     """GeoJSON serializer for Venue model."""
     partner = PartnerSerializer(read_only=True)
     partner_id = serializers.UUIDField(write_only=True)
@@ -68,6 +148,7 @@ class VenueSerializer(GeoFeatureModelSerializer):
         geo_field = 'location'
         fields = ['id', 'partner', 'partner_id', 'name', 'address', 'contact', 'categories', 'status', 'created_at']
         read_only_fields = ['id', 'created_at']
+        fragment_version = 1
 
 
 class ClusterSerializer(GeoFeatureModelSerializer):
@@ -80,6 +161,15 @@ class ClusterSerializer(GeoFeatureModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
+class MapClusterSerializer(GeoFeatureModelSerializer):
+    """GeoJSON serializer for MapCluster model."""
+
+    class Meta:
+        model = MapCluster
+        geo_field = 'centroid'
+        fields = ['id', 'zoom', 'count', 'place_count', 'venue_count', 'plan_count']
+
+
 class AttendanceSerializer(serializers.ModelSerializer):
     """Serializer for Attendance model."""
     user = UserSerializer(read_only=True)
@@ -90,13 +180,14 @@ class AttendanceSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'joined_at']
 
 
-class PlanSerializer(serializers.ModelSerializer):
+class PlanSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Plan model."""
     host_user = UserSerializer(read_only=True)
     venue = VenueSerializer(read_only=True)
     place = PlaceSerializer(read_only=True)
     cluster = ClusterSerializer(read_only=True)
     attendances = AttendanceSerializer(many=True, read_only=True)
+    attendee_count = serializers.SerializerMethodField()
     
     venue_id = serializers.UUIDField(write_only=True, required=False, allow_null=True)
     place_id = serializers.UUIDField(write_only=True, required=False, allow_null=True)
@@ -107,9 +198,18 @@ class PlanSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'host_user', 'venue', 'venue_id', 'place', 'place_id', 'title', 'description',
             'tags', 'starts_at', 'ends_at', 'capacity', 'visibility', 'is_active',
-            'cluster', 'cluster_id', 'rules', 'attendances', 'created_at', 'updated_at'
+            'cluster', 'cluster_id', 'rules', 'attendances', 'attendee_count',
+            'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'host_user', 'created_at', 'updated_at']
+        expandable = ['host_user', 'venue', 'place', 'cluster', 'attendances']
+
+    def get_attendee_count(self, plan):
+        if hasattr(plan, 'attendee_count'):
+            return plan.attendee_count
+        return sum(
+            attendance.status == 'joined' for attendance in plan.attendances.all()
+        )
 
 
 class JoinRequestSerializer(serializers.ModelSerializer):
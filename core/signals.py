@@ -0,0 +1,245 @@
+"""
+Signal handlers for the Spontime application.
+"""
+from django.conf import settings
+from django.contrib.gis.measure import D
+from django.db import transaction
+from django.db.models import OuterRef, QuerySet, Subquery
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from . import clustering, geo, nearby_cache, profiles, tasks
+from .models import (
+    Attendance, CheckIn, Place, Plan, RecoDirtyUser, RecoItem, RecoSnapshot, User,
+    UserProfile, Venue
+)
+from .tags import get_codec
+
+CLUSTER_SCOPES = {Place: 'places', Venue: 'venues'}
+PLAN_LOCATION_KEYS = {Place: 'place_ids', Venue: 'venue_ids'}
+
+
+@receiver(post_save, sender=CheckIn)
+@receiver(post_delete, sender=CheckIn)
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def mark_participant_dirty(sender, instance, origin=None, **kwargs):
+    """A user's own history changed, so their profile and exclusions did too."""
+    if not _deleting_user(instance.user_id, origin):
+        RecoDirtyUser.objects.mark([instance.user_id])
+
+
+@receiver(post_save, sender=CheckIn)
+def update_profile_on_checkin(sender, instance, created, **kwargs):
+    if created:
+        profiles.record_checkin(instance)
+    else:
+        profiles.rebuild_profiles([instance.user_id])
+
+
+@receiver(post_delete, sender=CheckIn)
+def rebuild_profile_on_checkin_delete(sender, instance, origin=None, **kwargs):
+    if not _deleting_user(instance.user_id, origin):
+        profiles.rebuild_profiles([instance.user_id])
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_attendance_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if not instance._state.adding:
+        instance._previous_status = Attendance.objects.filter(
+            pk=instance.pk
+        ).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Attendance)
+def update_profile_on_attendance(sender, instance, **kwargs):
+    was_joined = getattr(instance, '_previous_status', None) == 'joined'
+    is_joined = instance.status == 'joined'
+    if is_joined != was_joined:
+        profiles.record_attendance(instance, 1 if is_joined else -1)
+
+
+@receiver(post_delete, sender=Attendance)
+def update_profile_on_attendance_delete(sender, instance, origin=None, **kwargs):
+    if instance.status == 'joined' and not _deleting_user(instance.user_id, origin):
+        profiles.record_attendance(instance, -1)
+
+
+@receiver(pre_save, sender=Place)
+@receiver(pre_save, sender=Venue)
+def remember_location(sender, instance, **kwargs):
+    instance._previous_location = None
+    if not instance._state.adding:
+        instance._previous_location = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('location', flat=True).first()
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=Venue)
+def mark_cluster_cells_on_save(sender, instance, created, **kwargs):
+    """New or moved places/venues dirty the cells they left and entered."""
+    if created or instance._previous_location != instance.location:
+        clustering.mark_dirty(
+            CLUSTER_SCOPES[sender], instance._previous_location, instance.location
+        )
+
+
+@receiver(post_delete, sender=Place)
+@receiver(post_delete, sender=Venue)
+def mark_cluster_cell_on_delete(sender, instance, **kwargs):
+    clustering.mark_dirty(CLUSTER_SCOPES[sender], instance.location)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=Venue)
+def sync_plan_locations_on_move(sender, instance, created, **kwargs):
+    if not created and instance._previous_location != instance.location:
+        geo.sync_plan_locations(**{PLAN_LOCATION_KEYS[sender]: [instance.pk]})
+
+
+@receiver(pre_delete, sender=Place)
+@receiver(pre_delete, sender=Venue)
+def remember_located_plans(sender, instance, **kwargs):
+    # Deleting nulls the plans' foreign key first, so collect them up front
+    instance._plan_ids = list(instance.plans.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Place)
+@receiver(post_delete, sender=Venue)
+def sync_plan_locations_on_delete(sender, instance, **kwargs):
+    plan_ids = getattr(instance, '_plan_ids', [])
+    if plan_ids:
+        geo.sync_plan_locations(plan_ids=plan_ids)
+        locations = Plan.objects.filter(id__in=plan_ids).values_list(
+            'location', flat=True
+        )
+        _invalidate_nearby(instance.location, *locations)
+
+
+@receiver(post_save, sender=Place)
+@receiver(post_save, sender=Venue)
+def invalidate_nearby_on_move(sender, instance, created, **kwargs):
+    """Plans at a moved place or venue moved with it."""
+    if not created and instance._previous_location != instance.location:
+        _invalidate_nearby(instance._previous_location, instance.location)
+
+
+@receiver(pre_save, sender=Plan)
+def encode_plan_tags(sender, instance, **kwargs):
+    instance.tag_codes = get_codec().intern(instance.tags)
+
+
+@receiver(pre_save, sender=Plan)
+def remember_plan_state(sender, instance, **kwargs):
+    instance._previous_tags = None
+    instance._previous_cluster_id = None
+    instance._previous_location = None
+    instance._previous_is_active = None
+    if not instance._state.adding:
+        previous = Plan.objects.filter(pk=instance.pk).values_list(
+            'tags', 'cluster_id', 'location', 'is_active'
+        ).first()
+        if previous:
+            (instance._previous_tags, instance._previous_cluster_id,
+             instance._previous_location, instance._previous_is_active) = previous
+
+
+@receiver(pre_save, sender=Plan)
+def locate_plan(sender, instance, **kwargs):
+    """Denormalize the place (or venue) location onto the plan."""
+    instance.location = _plan_location(instance)
+
+
+@receiver(pre_save, sender=Plan)
+def assign_plan_cluster(sender, instance, **kwargs):
+    """Keep Plan.cluster in line with the active clusters between runs."""
+    instance.cluster_id = clustering.cluster_for_plan(instance)
+
+
+@receiver(post_save, sender=Plan)
+def update_cluster_plan_counts(sender, instance, **kwargs):
+    if instance.cluster_id != instance._previous_cluster_id:
+        clustering.adjust_plan_count(instance._previous_cluster_id, -1)
+        clustering.adjust_plan_count(instance.cluster_id, 1)
+
+
+@receiver(post_delete, sender=Plan)
+def update_cluster_plan_count_on_delete(sender, instance, **kwargs):
+    if instance.is_active:
+        clustering.adjust_plan_count(instance.cluster_id, -1)
+
+
+@receiver(post_save, sender=Plan)
+def invalidate_nearby_plans(sender, instance, created, **kwargs):
+    """Only a plan's location and active flag are held in the nearby cache."""
+    if (created or instance._previous_location != instance.location
+            or instance._previous_is_active != instance.is_active):
+        _invalidate_nearby(instance._previous_location, instance.location)
+
+
+@receiver(post_delete, sender=Plan)
+def invalidate_nearby_on_plan_delete(sender, instance, **kwargs):
+    _invalidate_nearby(instance.location)
+
+
+@receiver(post_save, sender=Plan)
+def mark_plan_audience_dirty(sender, instance, created, **kwargs):
+    """
+    Mark the users a plan change can affect: nearby users for a new, moved
+    or reactivated plan, and participants plus users whose latest snapshot
+    recommends the plan for any change.
+    """
+    user_ids = set()
+    appeared = created or (
+        instance._previous_location != instance.location
+        or instance._previous_is_active != instance.is_active
+    )
+    if appeared and instance.location is not None and instance.is_active:
+        user_ids.update(UserProfile.objects.filter(
+            last_location__distance_lte=(
+                instance.location, D(m=settings.RECO_DIRTY_RADIUS_M)
+            )
+        ).values_list('user_id', flat=True))
+    if not created:
+        participant_ids = set(instance.checkins.values_list('user_id', flat=True))
+        participant_ids.update(instance.attendances.values_list('user_id', flat=True))
+        if instance._previous_tags != instance.tags and participant_ids:
+            # Outside the request, once the new tags are committed
+            ids = [str(user_id) for user_id in participant_ids]
+            transaction.on_commit(lambda: tasks.rebuild_user_profiles.delay(ids))
+        latest = RecoSnapshot.objects.filter(
+            user_id=OuterRef('snapshot__user_id')
+        ).order_by('-generated_at').values('id')[:1]
+        user_ids |= participant_ids | set(
+            RecoItem.objects.filter(plan=instance, snapshot_id=Subquery(latest))
+            .values_list('snapshot__user_id', flat=True)
+        )
+
+    RecoDirtyUser.objects.mark(user_ids)
+
+
+def _deleting_user(user_id, origin):
+    """
+    Whether a delete cascades from deleting the user itself. Its dependent
+    rows (dirty mark, profile) are already gone by then, and writing them
+    again would fail the deferred foreign key at commit.
+    """
+    if isinstance(origin, User):
+        return origin.pk == user_id
+    if isinstance(origin, QuerySet) and origin.model is User:
+        return origin.filter(pk=user_id).exists()
+    return False
+
+
+def _plan_location(plan):
+    if plan.place_id:
+        return plan.place.location
+    if plan.venue_id:
+        return plan.venue.location
+    return None
+
+
+def _invalidate_nearby(*locations):
+    # After commit, so a concurrent read can't re-cache the old rows
+    transaction.on_commit(lambda: nearby_cache.invalidate(*locations))
@@ -0,0 +1,140 @@
+"""
+Buffered writer for recommendation snapshots.
+
+Snapshots and their items are collected across many users and flushed in
+batches, each batch in a single transaction, either with `bulk_create` or
+with PostgreSQL COPY. Once a batch commits, the rendered feed cache is
+pointed at the new snapshots.
+"""
+import csv
+import io
+import json
+import time
+import uuid
+from django.db import connection, transaction
+from django.utils import timezone
+from . import feed_cache
+from .models import RecoItem, RecoSnapshot
+
+
+class SnapshotWriter:
+    """
+    Buffer RecoSnapshot/RecoItem rows and write them in batches.
+
+    Usage:
+        with SnapshotWriter(batch_size=5000) as writer:
+            writer.add(user_id, items, algo_version='v1.0')
+        writer.rows_per_sec
+    """
+    METHODS = ('bulk_create', 'copy')
+
+    def __init__(self, batch_size=5000, method='bulk_create'):
+        if method not in self.METHODS:
+            raise ValueError(f'Unknown snapshot write method: {method}')
+        self.batch_size = batch_size
+        self.method = method
+        self._snapshots = []
+        self._items = []
+        self.snapshot_count = 0
+        self.item_count = 0
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    @property
+    def row_count(self):
+        return self.snapshot_count + self.item_count
+
+    @property
+    def rows_per_sec(self):
+        return self.row_count / self.elapsed if self.elapsed else 0.0
+
+    def add(self, user_id, items, algo_version, explanations=None):
+        """
+        Queue a snapshot for a user. `items` are objects with plan_id, score,
+        distance_m and shared_tags attributes. Returns the new snapshot id.
+        """
+        snapshot = RecoSnapshot(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            algo_version=algo_version,
+            explanations=explanations or []
+        )
+        self._snapshots.append(snapshot)
+        self._items.extend(
+            RecoItem(
+                id=uuid.uuid4(),
+                snapshot_id=snapshot.id,
+                plan_id=item.plan_id,
+                score=item.score,
+                distance_m=item.distance_m,
+                shared_tags=item.shared_tags
+            )
+            for item in items
+        )
+        if len(self._snapshots) + len(self._items) >= self.batch_size:
+            self.flush()
+        return snapshot.id
+
+    def flush(self):
+        """Write everything buffered so far in one transaction."""
+        if not self._snapshots:
+            return
+
+        snapshots, items = self._snapshots, self._items
+        self._snapshots, self._items = [], []
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            if self.method == 'copy':
+                self._copy(snapshots, items)
+            else:
+                RecoSnapshot.objects.bulk_create(snapshots, batch_size=self.batch_size)
+                RecoItem.objects.bulk_create(items, batch_size=self.batch_size)
+            published = {snapshot.user_id: snapshot.id for snapshot in snapshots}
+            transaction.on_commit(lambda: feed_cache.publish(published))
+        self.elapsed += time.perf_counter() - started
+
+        self.snapshot_count += len(snapshots)
+        self.item_count += len(items)
+
+    def _copy(self, snapshots, items):
+        """Stream both tables through COPY FROM STDIN in CSV format."""
+        generated_at = timezone.now().isoformat()
+        self._copy_rows(
+            RecoSnapshot._meta.db_table,
+            ['id', 'user_id', 'generated_at', 'algo_version', 'explanations'],
+            (
+                [
+                    s.id, s.user_id, generated_at, s.algo_version,
+                    json.dumps(s.explanations)
+                ]
+                for s in snapshots
+            )
+        )
+        self._copy_rows(
+            RecoItem._meta.db_table,
+            ['id', 'snapshot_id', 'plan_id', 'score', 'distance_m', 'shared_tags'],
+            (
+                [
+                    i.id, i.snapshot_id, i.plan_id, f'{i.score:.3f}', i.distance_m,
+                    i.shared_tags
+                ]
+                for i in items
+            )
+        )
+
+    def _copy_rows(self, table, columns, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
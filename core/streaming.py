@@ -0,0 +1,61 @@
+"""
+Streaming list responses.
+
+`?stream=json` or `?stream=ndjson` on a list endpoint iterates the
+filtered queryset with a server-side cursor (iterator(chunk_size)),
+serializes one chunk at a time and writes it straight into a
+StreamingHttpResponse, so memory stays flat however many rows match.
+Streams cover the whole list and aren't paginated.
+"""
+from itertools import islice
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_gis.serializers import GeoFeatureModelListSerializer
+
+FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def chunks(queryset, chunk_size):
+    """Lists of up to chunk_size rows, read through one cursor."""
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def render(queryset, get_serializer, mode, chunk_size=None):
+    """
+    Encoded pieces of the list: a JSON array (a FeatureCollection for
+    GeoJSON serializers) or one object per line.
+    """
+    chunk_size = chunk_size or settings.STREAM_CHUNK_SIZE
+    encoder = JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    if mode == 'ndjson':
+        opening, separator, closing = '', '\n', '\n'
+    elif isinstance(get_serializer(many=True), GeoFeatureModelListSerializer):
+        opening = '{"type":"FeatureCollection","features":['
+        separator, closing = ',', ']}'
+    else:
+        opening, separator, closing = '[', ',', ']'
+
+    yield opening
+    first = True
+    for chunk in chunks(queryset, chunk_size):
+        # One serializer per chunk, so its cached fragments are hydrated together
+        child = get_serializer(chunk, many=True).child
+        body = separator.join(
+            encoder.encode(child.to_representation(instance)) for instance in chunk
+        )
+        yield body if first else separator + body
+        first = False
+    if not first or mode != 'ndjson':
+        yield closing
+
+
+def response(queryset, get_serializer, mode):
+    return StreamingHttpResponse(
+        render(queryset, get_serializer, mode), content_type=FORMATS[mode]
+    )
@@ -0,0 +1,161 @@
+"""
+Tag dictionary encoding and bitset operations.
+
+Free-form tags are normalized (trimmed, lowercased) and interned as
+InterestTag rows with a dense integer `code`. Sets of codes can then be
+packed into uint64 bitsets, so tag overlap for whole blocks of rows is a
+vectorized AND + popcount. Plans keep their codes in `Plan.tag_codes`
+(GIN-indexed), which any tag filter can query with `tag_codes__overlap`.
+"""
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Max
+from .models import InterestTag
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def normalize_tag(tag):
+    """Return the canonical form of a tag, or None if it isn't a usable tag."""
+    if not isinstance(tag, str):
+        return None
+    return tag.strip().lower() or None
+
+
+def normalize_tags(tags):
+    """Distinct canonical tags of a JSON tag list, in first-seen order."""
+    if not isinstance(tags, (list, tuple, set, frozenset)):
+        return []
+    return list(dict.fromkeys(filter(None, map(normalize_tag, tags))))
+
+
+class TagCodec:
+    """In-process dictionary from canonical tag to InterestTag code."""
+
+    def __init__(self):
+        self._codes = {}
+
+    def load(self):
+        """Load every interned tag in one query."""
+        self._codes = {
+            slug.lower(): code
+            for slug, code in InterestTag.objects.filter(
+                code__isnull=False
+            ).values_list('slug', 'code')
+        }
+        return self
+
+    def encode(self, tags):
+        """
+        Codes of the known tags among `tags`; unknown tags are dropped.
+        Misses aren't remembered, since another process may intern them.
+        """
+        tags = normalize_tags(tags)
+        missing = [tag for tag in tags if tag not in self._codes]
+        if missing:
+            self._refresh(missing)
+        return [self._codes[tag] for tag in tags if tag in self._codes]
+
+    def intern(self, tags):
+        """Codes for `tags`, creating InterestTag rows for new ones."""
+        tags = normalize_tags(tags)
+        missing = [tag for tag in tags if tag not in self._codes]
+        created = self._create(missing) if missing else {}
+        return [
+            self._codes[tag] if tag in self._codes else created[tag] for tag in tags
+        ]
+
+    def _refresh(self, tags):
+        self._codes.update(
+            (slug.lower(), code)
+            for slug, code in InterestTag.objects.filter(
+                slug__in=tags, code__isnull=False
+            ).values_list('slug', 'code')
+        )
+
+    def _create(self, tags):
+        """
+        Codes for `tags`, assigned under a table lock. They only join the
+        process-wide dictionary once committed, as a rolled back transaction
+        frees them for other tags.
+        """
+        table = InterestTag._meta.db_table
+        codes = {}
+        with transaction.atomic():
+            # Codes are dense, so assignment is serialized on the table
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+
+            existing = {
+                tag.slug.lower(): tag
+                for tag in InterestTag.objects.filter(slug__in=tags)
+            }
+            last_code = InterestTag.objects.aggregate(last=Max('code'))['last']
+            next_code = (last_code or 0) + 1
+
+            to_create, to_update = [], []
+            for tag in tags:
+                row = existing.get(tag)
+                if row is not None and row.code is not None:
+                    codes[tag] = row.code
+                    continue
+                if row is None:
+                    row = InterestTag(name=tag, slug=tag)
+                    to_create.append(row)
+                else:
+                    to_update.append(row)
+                row.code = next_code
+                codes[tag] = next_code
+                next_code += 1
+
+            InterestTag.objects.bulk_create(to_create)
+            InterestTag.objects.bulk_update(to_update, ['code'])
+            transaction.on_commit(lambda: self._codes.update(codes))
+        return codes
+
+
+_codec = None
+
+
+def get_codec():
+    """Process-wide codec, loaded on first use."""
+    global _codec
+    if _codec is None:
+        _codec = TagCodec().load()
+    return _codec
+
+
+def pack(rows, n_bits):
+    """
+    Pack rows of bit positions (each an iterable of ints < n_bits) into a
+    (len(rows), words) uint64 bitset matrix.
+    """
+    n_words = max(1, (n_bits + 63) // 64)
+    bits = np.zeros((len(rows), n_words), dtype=np.uint64)
+    for row, positions in enumerate(rows):
+        for position in positions:
+            bits[row, position >> 6] |= np.uint64(1) << np.uint64(position & 63)
+    return bits
+
+
+def popcount(bits):
+    """Number of set bits in each uint64 element."""
+    counts = _POPCOUNT8[bits.view(np.uint8)].reshape(bits.shape + (8,))
+    return counts.sum(axis=-1, dtype=np.int64)
+
+
+def overlap_counts(a, b):
+    """
+    Pairwise overlap between two bitset matrices: entry (i, j) is the number
+    of bits set in both a[i] and b[j].
+    """
+    counts = np.zeros((a.shape[0], b.shape[0]), dtype=np.int64)
+    for word in range(a.shape[1]):
+        counts += popcount(np.ascontiguousarray(a[:, word, None] & b[None, :, word]))
+    return counts
+
+
+def paired_overlap_counts(a, b):
+    """Overlap between aligned rows: entry i counts bits set in both a[i] and b[i]."""
+    return popcount(np.ascontiguousarray(a & b)).sum(axis=1)
@@ -1,169 +1,339 @@
 """
 Celery tasks for the Spontime application.
 """
+import logging
+import time
+import uuid
 import numpy as np
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
 from django.contrib.gis.geos import Point
+from django.db import transaction
+from django.db.models import F, Func, IntegerField, Max, Value
+from django.db.models.functions import Cast
 from django.utils import timezone
-from sklearn.cluster import DBSCAN
-from .models import Place, Venue, Cluster, CheckIn, RecoSnapshot, RecoItem, Plan, User
+from django.utils.dateparse import parse_datetime
+from .clustering import (
+    assign_plans, centroids, count_plans, dbscan_tiled, extents, members,
+    neighbour_tiles, stream_coordinates, tile_index, tiles_covering, tiles_geometry,
+)
+from .models import (
+    Place, Venue, Cluster, ClusterDirtyCell, ClusterGeneration, RecoDirtyUser, User
+)
+from .profiles import rebuild_profiles
+from .pyramid import rebuild_pyramid
+from .scoring import ALGO_VERSION, build_user_block, score_block
+from .snapshots import SnapshotWriter
+
+logger = logging.getLogger(__name__)
 
 
 @shared_task
-def update_clusters():
+def update_clusters(full=False):
     """
     Update place/venue clusters using DBSCAN algorithm.
     This task runs periodically to group nearby locations.
+    By default only tile cells with place/venue changes since the last
+    run (and their neighbours) are re-clustered; `full=True`, or a scope
+    without clusters yet, rebuilds every cluster.
     """
-    # Cluster places
-    places = Place.objects.all()
-    if places.count() >= 2:
-        _cluster_entities(places, 'places')
-    
-    # Cluster venues
-    venues = Venue.objects.all()
-    if venues.count() >= 2:
-        _cluster_entities(venues, 'venues')
-    
+    scopes = ((Place.objects.all(), 'places'), (Venue.objects.all(), 'venues'))
+    for queryset, scope in scopes:
+        dirty_before = timezone.now()
+        dirty = ClusterDirtyCell.objects.filter(
+            scope=scope, marked_at__lte=dirty_before
+        )
+        active = ClusterGeneration.objects.filter(scope=scope, is_active=True).first()
+        if full or active is None:
+            _cluster_entities(queryset, scope)
+        else:
+            cells = set(dirty.values_list('cell', flat=True))
+            if cells:
+                _recluster_cells(queryset, active, cells)
+        dirty.delete()
+
     return "Clustering completed"
 
 
 def _cluster_entities(queryset, scope):
-    """Helper function to cluster entities with location field."""
-    # Extract coordinates
-    coordinates = []
-    entity_ids = []
-    
-    for entity in queryset:
-        lon = entity.location.x
-        lat = entity.location.y
-        coordinates.append([lat, lon])
-        entity_ids.append(entity.id)
-    
-    # Convert to numpy array
-    X = np.array(coordinates)
-    
-    # Apply DBSCAN clustering
-    db = DBSCAN(eps=0.01, min_samples=2).fit(X)
-    labels = db.labels_
-    
-    # Clear existing clusters for this scope
-    Cluster.objects.filter(scope=scope).delete()
-    
-    # Create new clusters
-    unique_labels = set(labels)
-    cluster_count = 0
-    
-    for label in unique_labels:
-        if label == -1:  # Noise points
+    """
+    Cluster entities with a location field.
+    Coordinates are streamed into a NumPy buffer and clustered with
+    haversine DBSCAN, eps in meters (CLUSTER_EPS_M), tile by tile across
+    CLUSTER_WORKERS processes. The clusters are written as a new
+    generation in one bulk insert; plans are assigned and counted, and the
+    scope's active generation flipped, in one transaction. Older
+    generations are garbage-collected afterwards.
+    """
+    ids, coords = stream_coordinates(
+        queryset, chunk_size=settings.CLUSTER_STREAM_CHUNK_SIZE
+    )
+    labels = _dbscan(coords)
+
+    generation = ClusterGeneration.objects.create(scope=scope)
+    clusters = Cluster.objects.bulk_create(
+        _build_clusters(generation, ids, coords, labels),
+        batch_size=settings.CLUSTER_STREAM_CHUNK_SIZE
+    )
+    generation.cluster_count = len(clusters)
+    generation.save(update_fields=['cluster_count'])
+
+    with transaction.atomic():
+        assign_plans(generation)
+        count_plans(generation)
+        generation.activate()
+    transaction.on_commit(lambda: gc_cluster_generations.delay(scope))
+    return len(clusters)
+
+
+def _recluster_cells(queryset, generation, cells):
+    """
+    Re-cluster the dirty cells of the active generation and their
+    neighbours, leaving clusters elsewhere untouched.
+
+    The region grows until it is closed: it covers every existing cluster
+    that overlaps it, and no new cluster found in it reaches into the ring
+    of tiles around it. Points in the ring are loaded too, so core status
+    at the region's edge is exact. The region's clusters are then replaced
+    in place, in one transaction. Regions over CLUSTER_INCREMENTAL_MAX_TILES
+    fall back to a full rebuild.
+    """
+    tile_deg = settings.CLUSTER_TILE_DEG
+    region = neighbour_tiles(cells, tile_deg)
+    while True:
+        if len(region) > settings.CLUSTER_INCREMENTAL_MAX_TILES:
+            return _cluster_entities(queryset, generation.scope)
+
+        replaced = Cluster.objects.filter(
+            generation=generation,
+            extent__intersects=tiles_geometry(region, tile_deg)
+        )
+        covering = set().union(*(
+            tiles_covering(extent.extent, tile_deg)
+            for extent in replaced.values_list('extent', flat=True) if extent
+        ))
+        if not covering <= region:
+            region |= covering
             continue
-        
-        # Get entities in this cluster
-        cluster_mask = labels == label
-        cluster_coords = X[cluster_mask]
-        
-        # Calculate centroid
-        centroid_lat = float(np.mean(cluster_coords[:, 0]))
-        centroid_lon = float(np.mean(cluster_coords[:, 1]))
-        centroid = Point(centroid_lon, centroid_lat, srid=4326)
-        
-        # Create cluster
-        cluster = Cluster.objects.create(
-            label=f"{scope.capitalize()} Cluster {label}",
-            centroid=centroid,
-            scope=scope,
-            plan_count=0  # Will be updated separately
+
+        ids, coords = stream_coordinates(
+            queryset.filter(location__intersects=tiles_geometry(
+                neighbour_tiles(region, tile_deg), tile_deg
+            )),
+            chunk_size=settings.CLUSTER_STREAM_CHUNK_SIZE
         )
-        cluster_count += 1
-    
-    return cluster_count
+        labels = _dbscan(coords)
+        keys = tile_index(coords, tile_deg)[2]
+        inside = np.isin(keys, list(region))
+        found = np.unique(labels[inside & (labels >= 0)])
+        spill = ~inside & np.isin(labels, found)
+        if not spill.any():
+            break
+        region |= set(keys[spill].tolist())
+
+    # Renumber the region's clusters 0..k-1 and drop everything else
+    labels = np.where(np.isin(labels, found), np.searchsorted(found, labels), -1)
+    with transaction.atomic():
+        removed = replaced.delete()[1].get(Cluster._meta.label, 0)
+        clusters = Cluster.objects.bulk_create(
+            _build_clusters(
+                generation, ids, coords, labels, first_label=_next_label(generation)
+            ),
+            batch_size=settings.CLUSTER_STREAM_CHUNK_SIZE
+        )
+        cluster_ids = [cluster.pk for cluster in clusters]
+        assign_plans(generation, cluster_ids)
+        count_plans(generation, cluster_ids)
+        ClusterGeneration.objects.filter(pk=generation.pk).update(
+            cluster_count=F('cluster_count') + len(clusters) - removed
+        )
+    return len(clusters)
+
+
+def _next_label(generation):
+    """
+    First free label number in a generation. Incremental runs replace
+    clusters in place, so the count of clusters isn't one.
+    """
+    last = Cluster.objects.filter(generation=generation).aggregate(
+        last=Max(Cast(
+            Func(F('label'), Value(r'(\d+)$'), function='substring'), IntegerField()
+        ))
+    )['last']
+    return 0 if last is None else last + 1
+
+
+def _dbscan(coords):
+    return dbscan_tiled(
+        coords, settings.CLUSTER_EPS_M, settings.CLUSTER_MIN_SAMPLES,
+        tile_deg=settings.CLUSTER_TILE_DEG, workers=settings.CLUSTER_WORKERS
+    )
+
+
+def _build_clusters(generation, ids, coords, labels, first_label=0):
+    """Unsaved Cluster rows for labels 0..k-1 of a clustering run."""
+    return [
+        Cluster(
+            label=f"{generation.scope.capitalize()} Cluster {first_label + label}",
+            centroid=Point(float(centroid_lon), float(centroid_lat), srid=4326),
+            scope=generation.scope,
+            generation=generation,
+            member_ids=member_ids,
+            extent=extent,
+        )
+        for label, ((centroid_lat, centroid_lon), member_ids, extent) in enumerate(
+            zip(
+                centroids(coords, labels), members(ids, labels), extents(coords, labels)
+            )
+        )
+    ]
 
 
 @shared_task
-def generate_recommendations():
+def update_map_pyramid():
+    """Rebuild the per-zoom-band map cluster pyramid."""
+    cells = rebuild_pyramid()
+    return f"Built {cells} map clusters"
+
+
+@shared_task
+def gc_cluster_generations(scope):
+    """
+    Delete generations of a scope that are older than its active one.
+    Generations created later are left alone; they may still be building.
+    """
+    active = ClusterGeneration.objects.filter(scope=scope, is_active=True).first()
+    if active is None:
+        return 0
+    stale = ClusterGeneration.objects.filter(
+        scope=scope, is_active=False, created_at__lt=active.created_at
+    )
+    deleted = 0
+    for generation in stale:
+        # One generation per transaction keeps each delete bounded
+        generation.delete()
+        deleted += 1
+    return deleted
+
+
+@shared_task
+def generate_recommendations(full=False):
     """
-    Generate personalized recommendations for all users.
+    Generate personalized recommendations.
     This task runs periodically to update the recommendation feed.
+    By default only users marked dirty since their last snapshot are
+    recomputed; `full=True` rebuilds every active user.
+    Users are partitioned into id ranges and scored by a chord of chunk
+    tasks; the callback aggregates counts and timings.
     """
+    dirty_before = timezone.now()
     users = User.objects.filter(is_active=True)
-    snapshot_count = 0
-    
-    for user in users:
-        # Get user's check-in history
-        user_checkins = CheckIn.objects.filter(user=user).select_related('plan')
-        
-        if user_checkins.count() == 0:
-            continue
-        
-        # Get plans the user has participated in
-        participated_plan_ids = set(checkin.plan_id for checkin in user_checkins)
-        
-        # Get plans from user's attendances
-        from .models import Attendance
-        user_attendances = Attendance.objects.filter(user=user, status='joined')
-        attended_plan_ids = set(att.plan_id for att in user_attendances)
-        
-        # Combine all plan IDs the user has been involved with
-        all_user_plan_ids = participated_plan_ids | attended_plan_ids
-        
-        # Get tags from plans user has attended
-        user_tags = set()
-        for plan in Plan.objects.filter(id__in=all_user_plan_ids):
-            if isinstance(plan.tags, list):
-                user_tags.update(plan.tags)
-        
-        # Find upcoming plans that the user hasn't joined
-        upcoming_plans = Plan.objects.filter(
-            is_active=True,
-            starts_at__gte=timezone.now()
-        ).exclude(
-            id__in=all_user_plan_ids
-        ).select_related('host_user', 'place', 'venue')[:50]
-        
-        if upcoming_plans.count() == 0:
-            continue
-        
-        # Create recommendation snapshot
-        snapshot = RecoSnapshot.objects.create(
-            user=user,
-            algo_version='v1.0',
-            explanations=[]
+    if not full:
+        users = users.filter(reco_dirty__marked_at__lte=dirty_before)
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+    chunk_size = settings.RECO_CHUNK_SIZE
+
+    ranges = [
+        (str(user_ids[i]), str(user_ids[min(i + chunk_size, len(user_ids)) - 1]))
+        for i in range(0, len(user_ids), chunk_size)
+    ]
+    if not ranges:
+        return "No users need new recommendations"
+
+    chord([
+        generate_recommendations_chunk.s(
+            first_user_id, last_user_id,
+            dirty_before=dirty_before.isoformat(),
+            full=full
         )
-        
-        # Score and create recommendation items
-        for plan in upcoming_plans[:20]:  # Limit to top 20
-            # Calculate score based on tag overlap
-            score = 0.5  # Base score
-            
-            plan_tags = set(plan.tags) if isinstance(plan.tags, list) else set()
-            shared_tags = len(user_tags & plan_tags)
-            
-            if shared_tags > 0:
-                score += 0.3 * min(shared_tags / max(len(user_tags), 1), 1.0)
-            
-            # Calculate distance if user has a location from checkins
-            distance_m = 0
-            latest_checkin = user_checkins.order_by('-created_at').first()
-            if latest_checkin and latest_checkin.geo and (plan.place or plan.venue):
-                target_location = plan.place.location if plan.place else plan.venue.location
-                distance_m = int(latest_checkin.geo.distance(target_location) * 111000)  # degrees to meters
-                
-                # Boost score for nearby plans
-                if distance_m < 5000:  # Within 5km
-                    score += 0.2
-            
-            # Cap score at 1.0
-            score = min(score, 1.0)
-            
-            # Create recommendation item
-            RecoItem.objects.create(
-                snapshot=snapshot,
-                plan=plan,
-                score=score,
-                distance_m=distance_m,
-                shared_tags=shared_tags
-            )
-        
-        snapshot_count += 1
-    
-    return f"Generated {snapshot_count} recommendation snapshots for {users.count()} users"
+        for first_user_id, last_user_id in ranges
+    ])(summarize_recommendations.s(started_at=time.time()))
+
+    mode = 'full' if full else 'incremental'
+    return (
+        f"Dispatched {len(ranges)} {mode} recommendation chunks "
+        f"for {len(user_ids)} users"
+    )
+
+
+@shared_task
+def generate_recommendations_chunk(
+    first_user_id, last_user_id, dirty_before=None, full=True
+):
+    """
+    Score and persist recommendations for active users whose id falls in
+    [first_user_id, last_user_id], limited to dirty users unless `full`.
+    Dirty markers older than `dirty_before` are cleared for the range, so
+    users touched while the run was in progress stay dirty.
+    Returns counts and timings for the chord callback.
+    """
+    started = time.perf_counter()
+    dirty_before = parse_datetime(dirty_before) if dirty_before else timezone.now()
+    users = User.objects.filter(
+        is_active=True, id__gte=first_user_id, id__lte=last_user_id
+    )
+    if not full:
+        users = users.filter(reco_dirty__marked_at__lte=dirty_before)
+    user_ids = list(users.order_by('id').values_list('id', flat=True))
+
+    writer = _generate_for_users(user_ids)
+    RecoDirtyUser.objects.filter(
+        user_id__in=user_ids, marked_at__lte=dirty_before
+    ).delete()
+
+    return {
+        'users': len(user_ids),
+        'snapshots': writer.snapshot_count,
+        'items': writer.item_count,
+        'write_seconds': writer.elapsed,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+@shared_task
+def summarize_recommendations(results, started_at):
+    """Chord callback aggregating the results of all chunks."""
+    totals = {
+        key: sum(result[key] for result in results)
+        for key in ('users', 'snapshots', 'items')
+    }
+    write_seconds = sum(result['write_seconds'] for result in results)
+    rows = totals['snapshots'] + totals['items']
+    rows_per_sec = rows / write_seconds if write_seconds else 0.0
+    wall_seconds = time.time() - started_at
+
+    logger.info(
+        'Recommendations: %d chunks, %d snapshots, %d items for %d users in %.2fs '
+        '(slowest chunk %.2fs, %.0f rows/sec)',
+        len(results), totals['snapshots'], totals['items'], totals['users'],
+        wall_seconds, max((result['seconds'] for result in results), default=0.0),
+        rows_per_sec
+    )
+    return (
+        f"Generated {totals['snapshots']} recommendation snapshots "
+        f"for {totals['users']} users in {len(results)} chunks "
+        f"({rows_per_sec:.0f} rows/sec)"
+    )
+
+
+@shared_task
+def rebuild_user_profiles(user_ids):
+    """Rebuild the profiles of users whose history changed, e.g. plan tag edits."""
+    return rebuild_profiles([uuid.UUID(user_id) for user_id in user_ids])
+
+
+def _generate_for_users(user_ids):
+    """Score the given users in blocks and write their snapshots."""
+    now = timezone.now()
+    block_size = settings.RECO_SCORING_BLOCK_SIZE
+
+    with SnapshotWriter(
+        batch_size=settings.RECO_SNAPSHOT_BATCH_SIZE,
+        method=settings.RECO_SNAPSHOT_WRITE_METHOD
+    ) as writer:
+        for start in range(0, len(user_ids), block_size):
+            block, plans = build_user_block(user_ids[start:start + block_size], now=now)
+            for user_id, items in score_block(block, plans).items():
+                writer.add(user_id, items, algo_version=ALGO_VERSION)
+
+    return writer
@@ -0,0 +1,86 @@
+"""
+Unit tests for the synthetic pipeline benchmarks.
+"""
+import json
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from core.benchmarks import StageRecorder, build_dataset, compare
+from core.models import Place, Plan, User
+
+
+class TestCompare:
+    """Test baseline regression detection."""
+
+    BASELINE = {
+        'reco.load': {
+            'seconds': 1.0, 'queries': 10, 'peak_mb': 5.0, 'rows': 100,
+            'rows_per_sec': 100.0,
+        }
+    }
+
+    def test_within_threshold(self):
+        results = {'reco.load': dict(self.BASELINE['reco.load'], seconds=1.15)}
+        assert compare(results, self.BASELINE, 0.2) == []
+
+    def test_reports_each_regressed_metric(self):
+        results = {
+            'reco.load': dict(self.BASELINE['reco.load'], seconds=2.0, queries=30)
+        }
+        regressions = compare(results, self.BASELINE, 0.2)
+        assert len(regressions) == 2
+        assert regressions[0].startswith('reco.load.seconds')
+        assert regressions[1].startswith('reco.load.queries')
+
+    def test_ignores_stages_missing_from_run(self):
+        assert compare({}, self.BASELINE, 0.2) == []
+
+
+@pytest.mark.django_db
+class TestBenchmarkCommand:
+    """Test dataset generation and the benchmark command."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_codec(self, monkeypatch):
+        monkeypatch.setattr('core.tags._codec', None)
+
+    def test_recorder_accumulates_stages(self):
+        recorder = StageRecorder()
+        for _ in range(2):
+            with recorder.stage('score') as counter:
+                counter['rows'] = 5
+        result = recorder.results()['score']
+        assert result['rows'] == 10
+        assert result['queries'] == 0
+        assert result['peak_mb'] >= 0
+        assert result['rows_per_sec'] > 0
+
+    def test_dataset_is_deterministic(self):
+        counts = build_dataset(5, 20, seed=3)
+        assert counts['plans'] == Plan.objects.count() == 20
+        ids = sorted(User.objects.values_list('id', flat=True))
+        User.objects.all().delete()
+        Place.objects.all().delete()
+        build_dataset(5, 20, seed=3)
+        assert sorted(User.objects.values_list('id', flat=True)) == ids
+
+    def test_saves_then_checks_baseline(self, tmp_path):
+        path = tmp_path / 'baseline.json'
+        args = [
+            'benchmark_pipelines', '--users', '5', '--plans', '20',
+            '--baseline', str(path)
+        ]
+        call_command(*args, '--save-baseline')
+        assert User.objects.count() == 0  # the dataset is rolled back
+
+        baselines = json.loads(path.read_text())
+        (key,) = baselines
+        stages = {'reco.load', 'reco.score', 'reco.write', 'clusters'}
+        assert stages <= set(baselines[key])
+
+        for stage in baselines[key].values():
+            stage['queries'] = 1
+            stage['seconds'] = 1e-6
+        path.write_text(json.dumps(baselines))
+        with pytest.raises(CommandError, match='Benchmark regressed'):
+            call_command(*args)
@@ -0,0 +1,257 @@
+"""
+Unit tests for place/venue clustering.
+"""
+import numpy as np
+import pytest
+from datetime import timedelta
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from core.clustering import (
+    centroids, dbscan_haversine, dbscan_tiled, members, neighbour_tiles,
+    stream_coordinates, tile_index, tile_points, tiles_covering,
+)
+from core.models import Cluster, ClusterDirtyCell, ClusterGeneration, Place, Plan, User
+from core.tasks import gc_cluster_generations, update_clusters
+
+
+class TestHaversineDbscan:
+    """Test DBSCAN over haversine distances in meters."""
+
+    def test_eps_is_meters_at_any_latitude(self):
+        # 0.01 degrees of longitude is ~1.1 km at the equator but ~190 m at 80N
+        coords = np.array([[0.0, 0.0], [0.0, 0.01], [80.0, 0.0], [80.0, 0.01]])
+        labels = dbscan_haversine(coords, eps_m=500, min_samples=2)
+        assert labels[0] == labels[1] == -1
+        assert labels[2] == labels[3] != -1
+
+    def test_members_group_ids_by_label(self):
+        ids = np.array([bytes([i]) * 16 for i in range(4)], dtype='V16')
+        grouped = members(ids, np.array([1, -1, 0, 1]))
+        assert [[pk.bytes[0] for pk in group] for group in grouped] == [[2], [0, 3]]
+
+    def test_halo_points_join_neighbouring_tiles(self):
+        coords = np.array([[0.5, 0.999], [0.5, 0.5], [0.5, -179.999]])
+        owner, tiles = tile_points(coords, tile_deg=1.0, eps_m=500)
+        assert owner[0] == owner[1]
+        # The first point is also in its eastern neighbour's halo, the third
+        # in its western neighbour's across the antimeridian
+        assert sum(0 in idx for idx in tiles.values()) == 2
+        assert sum(2 in idx for idx in tiles.values()) == 2
+        assert sum(1 in idx for idx in tiles.values()) == 1
+
+    def test_tiled_matches_global_dbscan(self):
+        rng = np.random.default_rng(11)
+        # Clusters centred on tile corners and on the antimeridian
+        centers = np.array([[10.0, 20.0], [-33.0, 151.0], [51.5, 0.0], [0.0, 179.999]])
+        coords = np.concatenate(
+            [c + rng.normal(0, 0.005, size=(40, 2)) for c in centers]
+        )
+        coords[:, 1] = (coords[:, 1] + 180) % 360 - 180
+        expected = dbscan_haversine(coords, eps_m=800, min_samples=4)
+        labels = dbscan_tiled(coords, eps_m=800, min_samples=4, tile_deg=1.0, workers=2)
+        assert len(set(labels) - {-1}) == len(set(expected) - {-1}) == 4
+        assert ((labels >= 0) == (expected >= 0)).all()
+        assert len(set(zip(labels, expected))) == len(set(expected))
+        serial = dbscan_tiled(coords, eps_m=800, min_samples=4, tile_deg=1.0)
+        assert serial.tolist() == labels.tolist()
+
+    def test_tiled_rejects_eps_wider_than_a_tile(self):
+        coords = np.array([[0.5, 0.5]])
+        with pytest.raises(ValueError):
+            dbscan_tiled(coords, eps_m=20000, min_samples=2, tile_deg=0.1)
+
+    def test_neighbour_tiles_wrap_longitude(self):
+        (key,) = tile_index(np.array([[0.5, 179.5]]), 1.0)[2]
+        neighbours = neighbour_tiles([key], 1.0)
+        assert len(neighbours) == 9
+        assert tile_index(np.array([[0.5, -179.5]]), 1.0)[2][0] in neighbours
+        assert tiles_covering((10.2, 20.5, 11.7, 20.9), 1.0) == set(
+            tile_index(np.array([[20.5, 10.2], [20.5, 11.7]]), 1.0)[2].tolist()
+        )
+
+    def test_empty_input(self):
+        assert len(dbscan_haversine(np.empty((0, 2)), eps_m=500, min_samples=2)) == 0
+
+    def test_centroid_across_antimeridian(self):
+        coords = np.array([[10.0, 179.999], [10.0, -179.999], [0.0, 0.0]])
+        (lat, lon), = centroids(coords, np.array([0, 0, -1]))
+        assert lat == pytest.approx(10.0)
+        assert abs(lon) == pytest.approx(180.0)
+
+
+@pytest.mark.django_db
+class TestUpdateClusters:
+    """Test the clustering task end to end."""
+
+    def test_streams_coordinates(self):
+        place = Place.objects.create(
+            name='A', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        ids, coords = stream_coordinates(Place.objects.all(), chunk_size=1)
+        assert coords.tolist() == [[40.7128, -74.0060]]
+        assert members(ids, np.array([0])) == [[place.id]]
+
+    def test_clusters_nearby_places(self, settings):
+        settings.CLUSTER_EPS_M = 1000
+        for i, lon in enumerate([-74.0060, -74.0050, -74.0040, -73.5000]):
+            Place.objects.create(
+                name=f'Place {i}', location=Point(lon, 40.7128, srid=4326)
+            )
+
+        update_clusters()
+
+        (cluster,) = Cluster.objects.filter(scope='places')
+        assert cluster.centroid.x == pytest.approx(-74.0050, abs=1e-6)
+        assert cluster.centroid.y == pytest.approx(40.7128, abs=1e-6)
+        assert cluster.generation.is_active
+        assert cluster.generation.cluster_count == 1
+
+    def test_new_generation_replaces_active_one(self):
+        for i, lon in enumerate([-74.0060, -74.0050]):
+            Place.objects.create(
+                name=f'Place {i}', location=Point(lon, 40.7128, srid=4326)
+            )
+        update_clusters()
+        first = ClusterGeneration.objects.get(scope='places', is_active=True)
+
+        update_clusters(full=True)
+
+        second = ClusterGeneration.objects.get(scope='places', is_active=True)
+        assert second.pk != first.pk
+        first.refresh_from_db()
+        assert not first.is_active
+        active = Cluster.objects.filter(generation__is_active=True, scope='places')
+        assert active.count() == 1
+
+        assert gc_cluster_generations('places') == 1
+        assert not ClusterGeneration.objects.filter(pk=first.pk).exists()
+        assert Cluster.objects.filter(scope='places').count() == 1
+
+
+@pytest.mark.django_db
+class TestPlanAssignment:
+    """Test plan-to-cluster assignment and plan counts."""
+
+    @pytest.fixture
+    def places(self):
+        return [
+            Place.objects.create(
+                name=f'Place {i}', location=Point(lon, 40.7128, srid=4326)
+            )
+            for i, lon in enumerate([-74.0060, -74.0050, -73.5000])
+        ]
+
+    def make_plan(self, host, place, **kwargs):
+        starts_at = timezone.now() + timedelta(days=1)
+        return Plan.objects.create(
+            host_user=host, place=place, title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2), **kwargs
+        )
+
+    def test_run_assigns_plans_and_counts(self, places):
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        clustered = [self.make_plan(host, places[0]), self.make_plan(host, places[1])]
+        lone = self.make_plan(host, places[2])
+        self.make_plan(host, places[0], is_active=False)
+
+        update_clusters()
+
+        (cluster,) = Cluster.objects.filter(generation__is_active=True, scope='places')
+        assert cluster.plan_count == 2
+        plan_ids = set(cluster.plans.values_list('id', flat=True))
+        assert plan_ids == {plan.id for plan in clustered}
+        lone.refresh_from_db()
+        assert lone.cluster_id is None
+
+    def test_plan_changes_keep_counts_in_sync(self, places):
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        update_clusters()
+        cluster = Cluster.objects.get(generation__is_active=True, scope='places')
+
+        plan = self.make_plan(host, places[0])
+        assert plan.cluster_id == cluster.id
+        cluster.refresh_from_db()
+        assert cluster.plan_count == 1
+
+        plan.is_active = False
+        plan.save()
+        assert plan.cluster_id is None
+        cluster.refresh_from_db()
+        assert cluster.plan_count == 0
+
+        plan.is_active = True
+        plan.save()
+        plan.delete()
+        cluster.refresh_from_db()
+        assert cluster.plan_count == 0
+
+
+@pytest.mark.django_db
+class TestIncrementalClustering:
+    """Test re-clustering only the cells that changed."""
+
+    def add_places(self, lons, lat=40.7128):
+        return [
+            Place.objects.create(
+                name=f'Place {lon}', location=Point(lon, lat, srid=4326)
+            )
+            for lon in lons
+        ]
+
+    def test_marks_cells_on_change(self):
+        (place,) = self.add_places([-74.0060])
+        assert ClusterDirtyCell.objects.filter(scope='places').count() == 1
+        ClusterDirtyCell.objects.all().delete()
+
+        place.name = 'Renamed'
+        place.save()
+        assert not ClusterDirtyCell.objects.exists()
+
+        place.location = Point(-70.0, 40.7128, srid=4326)
+        place.save()
+        assert ClusterDirtyCell.objects.filter(scope='places').count() == 2
+
+    def test_quiet_run_leaves_clusters_alone(self):
+        self.add_places([-74.0060, -74.0050])
+        update_clusters()
+        before = list(Cluster.objects.values_list('id', flat=True))
+        assert not ClusterDirtyCell.objects.exists()
+
+        update_clusters()
+
+        assert list(Cluster.objects.values_list('id', flat=True)) == before
+
+    def test_only_changed_region_is_reclustered(self):
+        self.add_places([-74.0060, -74.0050])
+        far = self.add_places([2.3522, 2.3532], lat=48.8566)
+        update_clusters()
+        generation = ClusterGeneration.objects.get(scope='places', is_active=True)
+        paris = Cluster.objects.get(member_ids__contains=[far[0].id])
+
+        (added,) = self.add_places([-74.0040])
+        update_clusters()
+
+        active = ClusterGeneration.objects.get(scope='places', is_active=True)
+        assert active == generation
+        assert Cluster.objects.filter(pk=paris.pk).exists()
+        new_york = Cluster.objects.get(member_ids__contains=[added.id])
+        assert len(new_york.member_ids) == 3
+        assert Cluster.objects.filter(scope='places').count() == 2
+        generation.refresh_from_db()
+        assert generation.cluster_count == 2
+
+    def test_incremental_labels_stay_unique(self):
+        self.add_places([-74.0060, -74.0050])
+        self.add_places([2.3522, 2.3532], lat=48.8566)
+        self.add_places([139.6917, 139.6927], lat=35.6895)
+        update_clusters()
+
+        self.add_places([-74.0040])
+        update_clusters()
+        self.add_places([2.3542], lat=48.8566)
+        update_clusters()
+
+        labels = list(
+            Cluster.objects.filter(scope='places').values_list('label', flat=True)
+        )
+        assert len(labels) == len(set(labels)) == 3
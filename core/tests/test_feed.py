@@ -0,0 +1,146 @@
+"""
+Unit tests for the recommendation feed endpoint.
+"""
+import pytest
+from unittest import mock
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.utils import timezone
+from datetime import timedelta
+from rest_framework.test import APIClient
+from core.feed import BACKOFF_KEY, LOCK_KEY, fresh_snapshot, is_stale
+from core.models import User, Place, Plan, CheckIn, RecoSnapshot
+from core.snapshots import SnapshotWriter
+
+
+def test_missing_snapshot_is_stale():
+    assert is_stale(None)
+
+
+@pytest.mark.django_db
+class TestFeed:
+    """Test online computation for missing or stale snapshots."""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        cache.clear()
+
+    @pytest.fixture
+    def user(self):
+        return User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+
+    @pytest.fixture
+    def upcoming(self, user):
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        past = Plan.objects.create(
+            title='Past Coffee',
+            host_user=host,
+            place=place,
+            tags=['coffee'],
+            starts_at=timezone.now() - timedelta(days=1),
+            ends_at=timezone.now() - timedelta(hours=22)
+        )
+        CheckIn.objects.create(
+            user=user, plan=past, geo=Point(-74.0060, 40.7128, srid=4326)
+        )
+        return Plan.objects.create(
+            title='Coffee Hangout',
+            host_user=host,
+            place=place,
+            tags=['coffee'],
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+
+    def _feed(self, user):
+        client = APIClient()
+        client.force_authenticate(user=user)
+        return client.get('/api/recs/feed/')
+
+    def test_requires_authentication(self):
+        assert APIClient().get('/api/recs/feed/').status_code == 401
+
+    def test_computes_snapshot_for_new_user(self, user, upcoming):
+        response = self._feed(user)
+
+        assert response.status_code == 200
+        plan_ids = [item['plan']['id'] for item in response.data['items']]
+        assert plan_ids == [str(upcoming.id)]
+        assert RecoSnapshot.objects.filter(user=user).count() == 1
+
+    def test_fresh_snapshot_is_served_as_is(self, user, upcoming):
+        snapshot = RecoSnapshot.objects.create(user=user, algo_version='v1.0')
+        response = self._feed(user)
+        assert response.data['id'] == str(snapshot.id)
+        assert RecoSnapshot.objects.filter(user=user).count() == 1
+
+    def test_stale_snapshot_is_recomputed(self, user, upcoming, settings):
+        settings.RECO_FEED_TTL_SECONDS = 60
+        stale = RecoSnapshot.objects.create(user=user, algo_version='v1.0')
+        RecoSnapshot.objects.filter(id=stale.id).update(
+            generated_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        snapshot = fresh_snapshot(user.id)
+        assert snapshot.id != stale.id
+        assert snapshot.items.count() == 1
+
+    def test_concurrent_request_falls_back_to_stale(self, user, upcoming, settings):
+        settings.RECO_FEED_BUDGET_MS = 100
+        stale = RecoSnapshot.objects.create(user=user, algo_version='v1.0')
+        RecoSnapshot.objects.filter(id=stale.id).update(
+            generated_at=timezone.now() - timedelta(days=1)
+        )
+        cache.add(LOCK_KEY.format(user_id=user.id), 1)
+
+        assert fresh_snapshot(user.id).id == stale.id
+        assert RecoSnapshot.objects.filter(user=user).count() == 1
+
+    def test_budget_overrun_backs_off(self, user, upcoming, settings):
+        settings.RECO_FEED_BUDGET_MS = 0
+        assert fresh_snapshot(user.id) is None
+        assert cache.get(BACKOFF_KEY.format(user_id=user.id))
+
+        # Served stale (here, nothing) until the back-off expires
+        settings.RECO_FEED_BUDGET_MS = 300
+        with mock.patch('core.feed.compute_snapshot') as compute:
+            assert fresh_snapshot(user.id) is None
+        compute.assert_not_called()
+
+    def test_database_errors_are_not_budget_overruns(self, user, upcoming, caplog):
+        error = DatabaseError('boom')
+        with mock.patch('core.feed.build_user_block', side_effect=error):
+            assert fresh_snapshot(user.id) is None
+        assert not cache.get(BACKOFF_KEY.format(user_id=user.id))
+        assert 'failed' in caplog.text
+
+    def test_repeated_requests_hit_the_rendered_cache(
+        self, user, upcoming, django_assert_num_queries
+    ):
+        first = self._feed(user)
+
+        with django_assert_num_queries(0):
+            second = self._feed(user)
+        assert second.data == first.data
+
+    def test_new_snapshot_replaces_cached_feed(
+        self, user, upcoming, django_capture_on_commit_callbacks
+    ):
+        first = self._feed(user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            writer = SnapshotWriter()
+            snapshot_id = writer.add(user.id, [], algo_version='v1.0')
+            writer.flush()
+
+        second = self._feed(user)
+        assert second.data['id'] == str(snapshot_id) != first.data['id']
+        assert second.data['items'] == []
@@ -0,0 +1,79 @@
+"""
+Unit tests for the serialized fragment cache.
+"""
+import uuid
+import pytest
+from datetime import datetime, timedelta, timezone
+from django.contrib.gis.geos import Point
+from django.core.cache import caches
+from core.fragment_cache import fragment_key, hydrate
+from core.models import Place, Plan, User
+from core.serializers import PlaceSerializer, PlanSerializer, UserSerializer
+
+UPDATED_AT = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def clear_fragments():
+    caches['fragments'].clear()
+
+
+def make_user(**kwargs):
+    return User(
+        id=uuid.uuid4(), handle='host', email='host@example.com', updated_at=UPDATED_AT,
+        **kwargs
+    )
+
+
+def make_place(owner):
+    return Place(
+        id=uuid.uuid4(), name='Cafe', location=Point(-74.0, 40.7, srid=4326),
+        owner_user=owner, updated_at=UPDATED_AT
+    )
+
+
+def test_key_follows_updated_at_of_nested_objects():
+    owner = make_user()
+    place = make_place(owner)
+    key = fragment_key(PlaceSerializer(), place)
+    assert key.startswith('core.place:1:') and str(place.pk) in key
+
+    owner.updated_at += timedelta(seconds=1)
+    assert fragment_key(PlaceSerializer(), place) != key
+
+    place.owner_user = None
+    assert fragment_key(PlaceSerializer(), place) is not None
+
+
+def test_only_opted_in_self_contained_serializers_are_cached():
+    plan = Plan(
+        id=uuid.uuid4(), host_user=make_user(), title='Plan', updated_at=UPDATED_AT
+    )
+    # Attendances and attendee_count don't touch Plan.updated_at
+    assert fragment_key(PlanSerializer(), plan) is None
+
+
+def test_cached_representation_until_updated():
+    user = make_user(display_name='Before')
+    assert UserSerializer(user).data['display_name'] == 'Before'
+
+    user.display_name = 'After'
+    assert UserSerializer(user).data['display_name'] == 'Before'
+
+    user.updated_at += timedelta(seconds=1)
+    assert UserSerializer(user).data['display_name'] == 'After'
+
+
+def test_hydrate_fetches_nested_fragments():
+    owner = make_user()
+    places = [make_place(owner) for _ in range(3)]
+    PlaceSerializer(places[0]).data
+
+    serializer = PlaceSerializer(places, many=True)
+    hydrate(serializer, places)
+
+    fragments = serializer.context['fragments']
+    assert len(fragments) == 4  # three places and their shared owner
+    assert fragments[fragment_key(PlaceSerializer(), places[0])] is not None
+    assert fragments[fragment_key(PlaceSerializer(), places[1])] is None
+    assert len(serializer.data['features']) == 3
@@ -0,0 +1,333 @@
+"""
+Unit tests for denormalized plan locations and nearby search.
+"""
+import numpy as np
+import pytest
+from datetime import timedelta
+from unittest import mock
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core import nearby_cache
+from core.geo import (
+    bbox_geography, geohash_bounds, geohash_encode, geohash_neighbourhood, haversine_m
+)
+from core.models import Partner, Place, Plan, User, Venue
+
+
+class TestHaversine:
+    """Test vectorized haversine distance."""
+
+    def test_known_distance(self):
+        # One degree of latitude is roughly 111.2 km
+        assert haversine_m(0.0, 0.0, 1.0, 0.0) == pytest.approx(111195, rel=1e-3)
+
+    def test_broadcasts_to_matrix(self):
+        users_lat = np.array([[40.7128], [40.7306]])
+        users_lon = np.array([[-74.0060], [-73.9352]])
+        plans_lat = np.array([[40.7128, 40.7580, 40.6782]])
+        plans_lon = np.array([[-74.0060, -73.9855, -73.9442]])
+        distances = haversine_m(users_lat, users_lon, plans_lat, plans_lon)
+        assert distances.shape == (2, 3)
+        assert distances[0, 0] == pytest.approx(0.0)
+
+
+def test_geohash_round_trip():
+    assert geohash_encode(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+    min_lon, min_lat, max_lon, max_lat = geohash_bounds('u4pruydqqvj')
+    assert min_lon <= 10.40744 <= max_lon and min_lat <= 57.64911 <= max_lat
+
+
+def test_geohash_neighbourhood_wraps_antimeridian():
+    cells = geohash_neighbourhood(0.1, 179.99, 4)
+    assert len(cells) == 9
+    assert geohash_encode(0.1, -179.99, 4) in cells
+
+
+def test_bbox_geography_follows_parallels():
+    polygon = bbox_geography((-10.0, 40.0, 10.0, 50.0), step=0.5)
+    assert polygon.extent == (-10.0, 40.0, 10.0, 50.0)
+    assert len(polygon.exterior_ring) == 2 * 41 + 1
+
+    split = bbox_geography((179.0, -1.0, -179.0, 1.0))
+    assert len(split) == 2
+
+
+def test_nearby_cache_buckets():
+    assert nearby_cache.bucket_for(40.7, 300) == (400, 6)
+    assert nearby_cache.bucket_for(40.7, 5000) == (5000, 4)
+    # Too wide, or too close to the poles for the cells to cover the bucket
+    assert nearby_cache.bucket_for(40.7, 60000) is None
+    assert nearby_cache.bucket_for(75.0, 300) is None
+
+
+@pytest.mark.django_db
+class TestPlanLocation:
+    """Test keeping Plan.location in sync with its place or venue."""
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        cache.clear()
+
+    @pytest.fixture
+    def host(self):
+        return User.objects.create_user(email='host@example.com', handle='host')
+
+    def make_plan(self, host, **kwargs):
+        starts_at = timezone.now() + timedelta(days=1)
+        return Plan.objects.create(
+            host_user=host, title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2), **kwargs
+        )
+
+    def test_copied_from_place_then_venue(self, host):
+        place = Place.objects.create(
+            name='Place', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        partner = Partner.objects.create(owner_user=host, legal_name='Partner')
+        venue = Venue.objects.create(
+            partner=partner, name='Venue', location=Point(-73.9855, 40.7580, srid=4326)
+        )
+
+        plan = self.make_plan(host, place=place, venue=venue)
+        assert plan.location.coords == pytest.approx((-74.0060, 40.7128))
+
+        place.delete()
+        plan.refresh_from_db()
+        assert plan.location.coords == pytest.approx((-73.9855, 40.7580))
+
+        venue.location = Point(-73.9000, 40.7000, srid=4326)
+        venue.save()
+        plan.refresh_from_db()
+        assert plan.location.coords == pytest.approx((-73.9000, 40.7000))
+
+    def test_nearby_uses_meters(self, host):
+        here = Place.objects.create(
+            name='Here', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        # ~4.2 km east at this latitude, and ~6 km east
+        close = Place.objects.create(
+            name='Close', location=Point(-73.9560, 40.7128, srid=4326)
+        )
+        far = Place.objects.create(
+            name='Far', location=Point(-73.9350, 40.7128, srid=4326)
+        )
+        plans = [self.make_plan(host, place=place) for place in (here, close, far)]
+
+        response = APIClient().get(
+            '/api/plans/nearby/', {'lat': 40.7128, 'lon': -74.0060, 'radius': 5000}
+        )
+
+        assert response.status_code == 200
+        ids = [item['id'] for item in response.data['results']]
+        assert ids == [str(plans[0].id), str(plans[1].id)]
+        assert response.data['results'][0]['distance'] == 0
+        assert response.data['results'][1]['distance'] == pytest.approx(4210, rel=0.01)
+        assert response.data['next'] is None
+
+    def test_nearby_pages_by_distance_cursor(self, host):
+        place = Place.objects.create(
+            name='Here', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        # Equal distances exercise the id tie-breaker
+        plans = sorted(
+            (self.make_plan(host, place=place) for _ in range(3)),
+            key=lambda plan: str(plan.id)
+        )
+        farther = Place.objects.create(
+            name='East', location=Point(-74.0000, 40.7128, srid=4326)
+        )
+        plans.append(self.make_plan(host, place=farther))
+
+        client = APIClient()
+        seen = []
+        url = '/api/plans/nearby/'
+        params = {'lat': 40.7128, 'lon': -74.0060, 'limit': 2}
+        while url:
+            response = client.get(url, params)
+            assert response.status_code == 200
+            seen.extend(item['id'] for item in response.data['results'])
+            url, params = response.data['next'], None
+
+        assert seen == [str(plan.id) for plan in plans]
+
+        response = client.get(
+            '/api/plans/nearby/', {'lat': 40.7128, 'lon': -74.0060, 'cursor': 'garbage'}
+        )
+        assert response.status_code == 400
+
+    def test_nearby_cursor_resumes_on_the_path_that_issued_it(self, host, settings):
+        places = [
+            Place.objects.create(
+                name=f'Place {i}',
+                location=Point(-74.0060 + i * 0.002, 40.7128, srid=4326)
+            )
+            for i in range(3)
+        ]
+        plans = [self.make_plan(host, place=place) for place in places]
+        client = APIClient()
+        params = {'lat': 40.7128, 'lon': -74.0060, 'radius': 1000, 'limit': 1}
+
+        # Issued by the database while the cell is over the candidate cap
+        settings.NEARBY_CACHE_MAX_CANDIDATES = 0
+        response = client.get('/api/plans/nearby/', params)
+        settings.NEARBY_CACHE_MAX_CANDIDATES = 5000
+        seen = [item['id'] for item in response.data['results']]
+        with mock.patch('core.views.nearby_cache.within') as within:
+            while response.data['next']:
+                response = client.get(response.data['next'])
+                seen.extend(item['id'] for item in response.data['results'])
+        within.assert_not_called()
+        assert seen == [str(plan.id) for plan in plans]
+
+        # Issued by the cache, which can no longer serve the cell
+        response = client.get('/api/plans/nearby/', params)
+        cache.clear()
+        settings.NEARBY_CACHE_MAX_CANDIDATES = 0
+        assert client.get(response.data['next']).status_code == 400
+
+    def test_dense_cells_go_straight_to_the_database(
+        self, host, settings, django_assert_num_queries
+    ):
+        settings.NEARBY_CACHE_MAX_CANDIDATES = 1
+        place = Place.objects.create(
+            name='Here', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        plans = [self.make_plan(host, place=place) for _ in range(2)]
+        client = APIClient()
+        params = {'lat': 40.7128, 'lon': -74.0060, 'radius': 1000}
+
+        first = client.get('/api/plans/nearby/', params)
+        # The cell is remembered as dense: no candidate query, only the nearby one
+        with django_assert_num_queries(1):
+            second = client.get('/api/plans/nearby/', params)
+
+        assert len(first.data['results']) == len(second.data['results']) == len(plans)
+
+    def test_nearby_cache_is_invalidated_by_plan_changes(
+        self, host, django_capture_on_commit_callbacks
+    ):
+        place = Place.objects.create(
+            name='Here', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        elsewhere = Place.objects.create(
+            name='Elsewhere', location=Point(-73.0000, 41.5000, srid=4326)
+        )
+        client = APIClient()
+        params = {'lat': 40.7128, 'lon': -74.0060, 'radius': 1000}
+
+        def nearby_ids():
+            response = client.get('/api/plans/nearby/', params)
+            assert response.status_code == 200
+            return [item['id'] for item in response.data['results']]
+
+        with django_capture_on_commit_callbacks(execute=True):
+            plan = self.make_plan(host, place=place)
+        assert nearby_ids() == [str(plan.id)]
+
+        # Created: the cached entry for the cell is dropped
+        with django_capture_on_commit_callbacks(execute=True):
+            other = self.make_plan(host, place=place)
+        assert sorted(nearby_ids()) == sorted([str(plan.id), str(other.id)])
+
+        # Deactivated
+        with django_capture_on_commit_callbacks(execute=True):
+            other.is_active = False
+            other.save()
+        assert nearby_ids() == [str(plan.id)]
+
+        # Moved away, and its place moved back in
+        with django_capture_on_commit_callbacks(execute=True):
+            plan.place = elsewhere
+            plan.save()
+        assert nearby_ids() == []
+        with django_capture_on_commit_callbacks(execute=True):
+            elsewhere.location = Point(-74.0050, 40.7128, srid=4326)
+            elsewhere.save()
+        assert nearby_ids() == [str(plan.id)]
+
+    def test_nearby_cache_matches_database(self, host):
+        places = [
+            Place.objects.create(
+                name=f'Place {i}',
+                location=Point(-74.0060 + i * 0.004, 40.7128, srid=4326)
+            )
+            for i in range(5)
+        ]
+        for place in places:
+            self.make_plan(host, place=place)
+
+        client = APIClient()
+        params = {'lat': 40.7128, 'lon': -74.0060}
+        cached = client.get('/api/plans/nearby/', dict(params, radius=1000))
+        # Wider than every bucket, so served by the database
+        queried = client.get('/api/plans/nearby/', dict(params, radius=100000))
+
+        assert [item['id'] for item in cached.data['results']] == [
+            item['id'] for item in queried.data['results'] if item['distance'] <= 1000
+        ]
+        for a, b in zip(cached.data['results'], queried.data['results']):
+            assert a['distance'] == pytest.approx(b['distance'], abs=0.5)
+
+
+@pytest.mark.django_db
+class TestViewport:
+    """Test capped bounding-box queries."""
+
+    BBOX = '-74.02,40.70,-73.99,40.72'
+
+    @pytest.fixture
+    def places(self):
+        inside = [
+            Place.objects.create(
+                name=f'Place {i}',
+                location=Point(-74.0100 + i * 0.001, 40.7128, srid=4326)
+            )
+            for i in range(3)
+        ]
+        outside = Place.objects.create(
+            name='Outside', location=Point(-73.9000, 40.7128, srid=4326)
+        )
+        return inside + [outside]
+
+    def test_places_in_bbox(self, places):
+        response = APIClient().get('/api/places/in_bbox/', {'bbox': self.BBOX})
+
+        assert response.status_code == 200
+        assert response.data['count'] == 3
+        assert response.data['truncated'] is False
+        assert {feature['id'] for feature in response.data['results']['features']} == {
+            str(place.id) for place in places[:3]
+        }
+
+    def test_truncated_results_report_count(self, places, settings):
+        settings.VIEWPORT_MAX_FEATURES = 2
+        response = APIClient().get('/api/places/in_bbox/', {'bbox': self.BBOX})
+
+        assert len(response.data['results']['features']) == 2
+        assert response.data['truncated'] is True
+        assert response.data['count'] == 3
+
+    def test_active_plans_in_bbox(self, places):
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        starts_at = timezone.now() + timedelta(days=1)
+        plans = [
+            Plan.objects.create(
+                host_user=host, place=place, title='Plan', starts_at=starts_at,
+                ends_at=starts_at + timedelta(hours=2)
+            )
+            for place in places
+        ]
+        plans[1].is_active = False
+        plans[1].save()
+
+        response = APIClient().get('/api/plans/in_bbox/', {'bbox': self.BBOX})
+
+        assert response.status_code == 200
+        ids = {item['id'] for item in response.data['results']}
+        assert ids == {str(plans[0].id), str(plans[2].id)}
+
+    def test_invalid_bbox(self):
+        response = APIClient().get('/api/venues/in_bbox/', {'bbox': '1,2,3'})
+        assert response.status_code == 400
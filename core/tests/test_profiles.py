@@ -0,0 +1,106 @@
+"""
+Unit tests for materialized user profiles.
+"""
+import pytest
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from datetime import timedelta
+from unittest import mock
+from core.models import User, Place, Plan, CheckIn, Attendance, UserProfile
+from core.profiles import load_profiles, rebuild_profiles
+from core.tasks import rebuild_user_profiles
+
+
+@pytest.mark.django_db
+class TestUserProfile:
+    """Test incremental profile maintenance."""
+
+    @pytest.fixture
+    def user(self):
+        return User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+
+    @pytest.fixture
+    def plans(self, user):
+        place = Place.objects.create(
+            name='Test Place', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        return [
+            Plan.objects.create(
+                title=f'Plan {i}',
+                host_user=user,
+                place=place,
+                tags=tags,
+                starts_at=timezone.now() - timedelta(days=1),
+                ends_at=timezone.now() - timedelta(hours=22)
+            )
+            for i, tags in enumerate([['coffee', 'music'], ['coffee']])
+        ]
+
+    def test_checkins_update_histogram_and_location(self, user, plans):
+        CheckIn.objects.create(user=user, plan=plans[0])
+        CheckIn.objects.create(
+            user=user, plan=plans[1], geo=Point(-73.9857, 40.7484, srid=4326)
+        )
+
+        profile = UserProfile.objects.get(user=user)
+        assert profile.tag_histogram == {'coffee': 2, 'music': 1}
+        assert profile.last_location.x == pytest.approx(-73.9857)
+        assert profile.last_checkin_at is not None
+
+    def test_attendance_join_and_leave(self, user, plans):
+        attendance = Attendance.objects.create(
+            user=user, plan=plans[0], status='joined'
+        )
+        assert UserProfile.objects.get(user=user).tags == {'coffee', 'music'}
+
+        attendance.status = 'left'
+        attendance.save()
+        assert UserProfile.objects.get(user=user).tags == set()
+
+    def test_checkin_delete_rebuilds(self, user, plans):
+        CheckIn.objects.create(user=user, plan=plans[0])
+        latest = CheckIn.objects.create(
+            user=user, plan=plans[1], geo=Point(-73.9857, 40.7484, srid=4326)
+        )
+        latest.delete()
+
+        profile = UserProfile.objects.get(user=user)
+        assert profile.tag_histogram == {'coffee': 1, 'music': 1}
+        assert profile.last_location is None
+
+    def test_plan_tag_change_rebuilds_after_commit(
+        self, user, plans, django_capture_on_commit_callbacks
+    ):
+        CheckIn.objects.create(user=user, plan=plans[1])
+        with mock.patch('core.tasks.rebuild_user_profiles.delay') as delay:
+            with django_capture_on_commit_callbacks(execute=True):
+                plans[1].tags = ['hiking']
+                plans[1].save()
+                delay.assert_not_called()
+        assert UserProfile.objects.get(user=user).tag_histogram == {'coffee': 1}
+
+        rebuild_user_profiles(*delay.call_args.args)
+        assert UserProfile.objects.get(user=user).tag_histogram == {'hiking': 1}
+
+    def test_rebuild_matches_incremental(self, user, plans):
+        CheckIn.objects.create(user=user, plan=plans[0])
+        Attendance.objects.create(user=user, plan=plans[1], status='joined')
+        incremental = UserProfile.objects.get(user=user).tag_histogram
+
+        UserProfile.objects.all().delete()
+        rebuild_profiles([user.id])
+        assert UserProfile.objects.get(user=user).tag_histogram == incremental
+
+    def test_load_profiles_skips_users_without_checkins(self, user, plans):
+        other = User.objects.create_user(
+            handle='other', email='other@example.com', password='test'
+        )
+        Attendance.objects.create(user=other, plan=plans[0], status='joined')
+        CheckIn.objects.create(user=user, plan=plans[0])
+
+        user_ids, user_tags, locations = load_profiles([other.id, user.id])
+        assert user_ids == [user.id]
+        assert user_tags == [{'coffee', 'music'}]
+        assert locations == [None]
@@ -0,0 +1,98 @@
+"""
+Unit tests for the map cluster pyramid and viewport endpoint.
+"""
+import pytest
+from datetime import timedelta
+from django.contrib.gis.geos import MultiPolygon, Point
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.geo import bbox_geometry, parse_bbox
+from core.models import MapCluster, Place, Plan, User
+from core.pyramid import band_for_zoom, cell_count, cell_y, rebuild_pyramid
+
+
+class TestViewportHelpers:
+    """Test bbox parsing and zoom band selection."""
+
+    def test_parse_bbox(self):
+        assert parse_bbox('-74.1,40.6,-73.9,40.8') == (-74.1, 40.6, -73.9, 40.8)
+        for value in [None, '1,2,3', 'a,b,c,d', '-74,41,-73,40', '-190,0,0,10']:
+            with pytest.raises(ValueError):
+                parse_bbox(value)
+
+    def test_bbox_across_antimeridian(self):
+        geometry = bbox_geometry((170.0, -10.0, -170.0, 10.0))
+        assert isinstance(geometry, MultiPolygon)
+        assert geometry.contains(Point(175.0, 0.0))
+        assert geometry.contains(Point(-175.0, 0.0))
+        assert not geometry.contains(Point(0.0, 0.0))
+
+    def test_band_for_zoom(self, settings):
+        settings.CLUSTER_PYRAMID_ZOOMS = [2, 5, 8]
+        assert band_for_zoom(0) == 2
+        assert band_for_zoom(5) == 5
+        assert band_for_zoom(7) == 5
+        assert band_for_zoom(20) == 8
+
+    def test_cells(self):
+        assert cell_y(-85.0511, 0) == 3
+        assert cell_y(85.0511, 0) == 0
+        assert cell_count((-180.0, -85.0, 180.0, 85.0), 0) == 16
+        assert cell_count((170.0, -10.0, -170.0, 10.0), 0) == 2 * 2
+
+
+@pytest.mark.django_db
+class TestPyramid:
+    """Test rebuilding the pyramid and querying viewports."""
+
+    @pytest.fixture
+    def data(self, settings):
+        settings.CLUSTER_PYRAMID_ZOOMS = [2, 14]
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        places = [
+            Place.objects.create(
+                name=f'Place {i}', location=Point(lon, 40.7128, srid=4326)
+            )
+            for i, lon in enumerate([-74.0060, -74.0059, -73.9000])
+        ]
+        starts_at = timezone.now() + timedelta(days=1)
+        Plan.objects.create(
+            host_user=host, place=places[0], title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2)
+        )
+        return places
+
+    def test_counts_per_band(self, data):
+        rebuild_pyramid()
+
+        (coarse,) = MapCluster.objects.filter(zoom=2)
+        assert (coarse.count, coarse.place_count, coarse.plan_count) == (4, 3, 1)
+        fine = MapCluster.objects.filter(zoom=14).order_by('-count')
+        assert [cell.count for cell in fine] == [3, 1]
+
+    def test_rebuild_replaces_pyramid(self, data):
+        rebuild_pyramid()
+        rebuild_pyramid()
+        assert MapCluster.objects.filter(zoom=2).count() == 1
+
+    def test_viewport_endpoint(self, data):
+        rebuild_pyramid()
+        client = APIClient()
+
+        response = client.get(
+            '/api/clusters/viewport/', {'bbox': '-74.01,40.70,-74.00,40.72', 'zoom': 15}
+        )
+        assert response.status_code == 200
+        (feature,) = response.data['features']
+        assert feature['properties']['zoom'] == 14
+        assert feature['properties']['count'] == 3
+
+        response = client.get(
+            '/api/clusters/viewport/', {'bbox': '-180,-85,180,85', 'zoom': 14}
+        )
+        assert response.status_code == 400
+
+        response = client.get(
+            '/api/clusters/viewport/', {'bbox': '-74.01,40.70,-74.00,40.72'}
+        )
+        assert response.status_code == 400
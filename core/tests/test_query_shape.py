@@ -0,0 +1,117 @@
+"""
+Unit tests for serializer-derived query shapes and endpoint query budgets.
+"""
+import pytest
+from datetime import timedelta
+from django.contrib.gis.geos import Point
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.models import (
+    Attendance, CheckIn, Message, Partner, Place, Plan, RecoItem, RecoSnapshot, User,
+    Venue
+)
+from core.query_shape import shape
+from core.serializers import CheckInSerializer, PlaceSerializer, RecoSnapshotSerializer
+
+
+class TestShape:
+    """Test deriving joins, prefetches and columns from serializers."""
+
+    def test_nested_forward_relations_are_joined(self):
+        select, prefetch, only = shape(Place, PlaceSerializer(many=True))
+
+        assert select == ['owner_user']
+        assert prefetch == []
+        assert {'id', 'location', 'owner_user', 'owner_user__handle'} <= set(only)
+        # Write-only fields aren't read
+        assert 'owner_user__email' not in only
+
+    def test_nested_to_many_relations_are_prefetched(self):
+        select, prefetch, only = shape(RecoSnapshot, RecoSnapshotSerializer())
+
+        assert select == []
+        assert [lookup.prefetch_through for lookup in prefetch] == ['items']
+        items = prefetch[0].queryset
+        assert 'owner_user' in items.query.select_related['plan']['venue']['partner']
+        assert 'user' in only
+
+    def test_method_fields_disable_only(self):
+        select, prefetch, only = shape(CheckIn, CheckInSerializer())
+
+        assert {
+            'user', 'plan', 'plan__host_user', 'plan__venue__partner__owner_user'
+        } <= set(select)
+        assert [lookup.prefetch_through for lookup in prefetch] == ['plan__attendances']
+        # PlanSerializer.attendee_count isn't a column
+        assert only is None
+
+
+# endpoint -> queries it may take, for any page size
+QUERY_BUDGETS = {
+    '/api/users/': 2,
+    '/api/places/': 2,
+    '/api/venues/': 2,
+    '/api/plans/': 2,
+    '/api/plans/?expand=host_user,venue,place,cluster,attendances': 3,
+    '/api/attendances/': 2,
+    '/api/join-requests/': 2,
+    '/api/checkins/': 3,
+    '/api/messages/': 2,
+    '/api/offers/': 2,
+    '/api/clusters/': 2,
+    '/api/recs/': 4,
+}
+
+
+@pytest.mark.django_db
+class TestQueryBudgets:
+    """Test that list endpoints take a constant number of queries."""
+
+    def seed(self, count):
+        now = timezone.now()
+        for i in range(count):
+            n = User.objects.count()
+            user = User.objects.create_user(
+                email=f'user{n}@example.com', handle=f'user{n}'
+            )
+            place = Place.objects.create(
+                name='Place', owner_user=user, location=Point(-74.0, 40.7, srid=4326)
+            )
+            partner = Partner.objects.create(owner_user=user, legal_name='Partner')
+            venue = Venue.objects.create(
+                partner=partner, name='Venue', location=Point(-74.0, 40.7, srid=4326)
+            )
+            venue.offers.create(
+                title='Offer', valid_from=now, valid_to=now + timedelta(days=1)
+            )
+            plan = Plan.objects.create(
+                host_user=user, place=place, venue=venue, title='Plan',
+                starts_at=now + timedelta(days=1),
+                ends_at=now + timedelta(days=1, hours=2)
+            )
+            Attendance.objects.create(plan=plan, user=user)
+            plan.join_requests.create(user=user)
+            CheckIn.objects.create(
+                plan=plan, user=user, geo=Point(-74.0, 40.7, srid=4326)
+            )
+            Message.objects.create(plan=plan, user=user, content='Hi')
+            snapshot = RecoSnapshot.objects.create(user=user, algo_version='test')
+            RecoItem.objects.create(snapshot=snapshot, plan=plan, score=1, distance_m=0)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url)
+        assert response.status_code == 200
+        return len(queries)
+
+    def test_list_endpoints_stay_within_budget(self):
+        self.seed(1)
+        few = {url: self.count_queries(url) for url in QUERY_BUDGETS}
+        self.seed(4)
+        many = {url: self.count_queries(url) for url in QUERY_BUDGETS}
+
+        assert many == few
+        for url, budget in QUERY_BUDGETS.items():
+            assert many[url] <= budget, url
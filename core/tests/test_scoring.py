@@ -0,0 +1,414 @@
+"""
+Unit tests for the batch recommendation scoring engine.
+"""
+import numpy as np
+import pytest
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from datetime import timedelta
+from unittest import mock
+from rest_framework.test import APIClient
+from core.models import (
+    User, Place, Plan, CheckIn, Attendance, RecoDirtyUser, RecoSnapshot, RecoItem,
+    UserProfile
+)
+from core.candidates import generate_candidates
+from core.scoring import PlanMatrix, UserBlock, score_block
+from core.tags import get_codec
+from core.tasks import (
+    generate_recommendations, generate_recommendations_chunk, summarize_recommendations
+)
+
+
+class TestScoreBlock:
+    """Test block scoring follows the v1.0 rules."""
+
+    def _plans(self):
+        return PlanMatrix(
+            ids=['near', 'far', 'unlocated', 'joined'],
+            tag_lists=[{'coffee'}, {'coffee', 'music'}, set(), {'coffee'}],
+            lats=[40.7130, 41.8781, np.nan, 40.7128],
+            lons=[-74.0070, -87.6298, np.nan, -74.0060]
+        )
+
+    def test_scores(self):
+        plans = self._plans()
+        users = UserBlock(
+            user_ids=['u1'],
+            user_tags=[{'coffee', 'hiking'}],
+            locations=[Point(-74.0060, 40.7128, srid=4326)],
+            involved_plan_ids=[{'joined'}],
+            candidate_ids=[['unlocated', 'far', 'near', 'joined']],
+            plans=plans
+        )
+        scored = score_block(users, plans)['u1']
+        items = {item.plan_id: item for item in scored}
+
+        assert [item.plan_id for item in scored] == ['near', 'far', 'unlocated']
+        # base + tag overlap (1 of 2 user tags) + nearby boost
+        assert items['near'].score == pytest.approx(0.5 + 0.3 * 0.5 + 0.2)
+        assert items['near'].shared_tags == 1
+        assert items['near'].distance_m < 5000
+        assert items['far'].score == pytest.approx(0.65)
+        assert items['far'].distance_m > 1000000
+        assert items['unlocated'].score == pytest.approx(0.5)
+        assert items['unlocated'].distance_m == 0
+
+    def test_user_without_location_gets_no_distance(self):
+        plans = self._plans()
+        users = UserBlock(['u1'], [set()], [None], [set()], [plans.ids], plans)
+        items = score_block(users, plans)['u1']
+        assert all(item.distance_m == 0 for item in items)
+        assert all(item.score == pytest.approx(0.5) for item in items)
+
+    def test_ties_keep_candidate_order(self):
+        plans = self._plans()
+        users = UserBlock(
+            ['u1'], [set()], [None], [set()], [['joined', 'unlocated', 'far']], plans
+        )
+        results = score_block(users, plans, limit=2)
+        assert [item.plan_id for item in results['u1']] == ['joined', 'unlocated']
+
+    def test_only_candidates_are_scored(self):
+        plans = self._plans()
+        users = UserBlock(
+            ['u1', 'u2', 'u3'],
+            [set(), set(), set()],
+            [None, None, None],
+            [set(), {'near', 'far'}, set()],
+            [['far'], ['near', 'far'], []],
+            plans
+        )
+        results = score_block(users, plans)
+        assert [item.plan_id for item in results['u1']] == ['far']
+        assert 'u2' not in results
+        assert 'u3' not in results
+
+
+@pytest.mark.django_db
+class TestGenerateRecommendations:
+    """Test the generate_recommendations task end to end."""
+
+    def test_generates_snapshot_for_users_with_checkins(self):
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        idle = User.objects.create_user(
+            handle='idle', email='idle@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        past = Plan.objects.create(
+            title='Past Coffee',
+            host_user=user,
+            place=place,
+            tags=['coffee'],
+            starts_at=timezone.now() - timedelta(days=1),
+            ends_at=timezone.now() - timedelta(hours=22)
+        )
+        upcoming = Plan.objects.create(
+            title='Coffee Hangout',
+            host_user=idle,
+            place=place,
+            tags=['coffee'],
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        CheckIn.objects.create(
+            user=user, plan=past, geo=Point(-74.0060, 40.7128, srid=4326)
+        )
+
+        result = generate_recommendations_chunk(
+            str(min(user.id, idle.id)), str(max(user.id, idle.id))
+        )
+
+        assert result['users'] == 2
+        assert result['snapshots'] == 1
+        snapshot = RecoSnapshot.objects.get(user=user)
+        assert snapshot.algo_version == 'v1.1'
+        item = RecoItem.objects.get(snapshot=snapshot)
+        assert item.plan == upcoming
+        assert item.shared_tags == 1
+        assert float(item.score) == pytest.approx(1.0)
+        assert not RecoSnapshot.objects.filter(user=idle).exists()
+
+    def test_coordinator_partitions_users_into_chunks(self, settings):
+        settings.RECO_CHUNK_SIZE = 2
+        users = [
+            User.objects.create_user(
+                handle=f'user{i}', email=f'user{i}@example.com', password='test'
+            )
+            for i in range(5)
+        ]
+        ids = sorted(str(user.id) for user in users)
+
+        with mock.patch('core.tasks.chord') as chord:
+            generate_recommendations(full=True)
+
+        header = chord.call_args.args[0]
+        assert [tuple(signature.args) for signature in header] == [
+            (ids[0], ids[1]), (ids[2], ids[3]), (ids[4], ids[4])
+        ]
+
+    def test_incremental_run_only_recomputes_dirty_users(self):
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        other = User.objects.create_user(
+            handle='other', email='other@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        plan = Plan.objects.create(
+            title='Coffee Hangout',
+            host_user=other,
+            place=place,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        Plan.objects.create(
+            title='Coffee Again',
+            host_user=other,
+            place=place,
+            starts_at=timezone.now() + timedelta(days=2),
+            ends_at=timezone.now() + timedelta(days=2, hours=2)
+        )
+        CheckIn.objects.create(user=user, plan=plan)
+        CheckIn.objects.create(user=other, plan=plan)
+        RecoDirtyUser.objects.filter(user=other).delete()
+
+        first, last = sorted([str(user.id), str(other.id)])
+        result = generate_recommendations_chunk(first, last, full=False)
+
+        assert result['users'] == 1
+        assert RecoSnapshot.objects.filter(user=user).exists()
+        assert not RecoSnapshot.objects.filter(user=other).exists()
+        assert not RecoDirtyUser.objects.exists()
+
+
+@pytest.mark.django_db
+class TestCandidates:
+    """Test spatial and tag-matched candidate generation."""
+
+    def test_nearby_then_tag_matches(self, settings):
+        settings.RECO_CANDIDATE_RADIUS_M = 5000
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        near = Place.objects.create(
+            name='Near', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        far = Place.objects.create(
+            name='Far', location=Point(-87.6298, 41.8781, srid=4326)
+        )
+
+        def plan(title, place, tags):
+            return Plan.objects.create(
+                title=title,
+                host_user=host,
+                place=place,
+                tags=tags,
+                starts_at=timezone.now() + timedelta(days=1),
+                ends_at=timezone.now() + timedelta(days=1, hours=2)
+            )
+
+        nearby_plan = plan('Nearby', near, [])
+        tagged_plan = plan('Far Coffee', far, ['coffee'])
+        plan('Far Other', far, ['music'])
+
+        candidates = generate_candidates(
+            [user.id], [Point(-74.0060, 40.7128, srid=4326)],
+            [set(get_codec().encode(['coffee']))]
+        )
+        assert candidates[user.id] == [nearby_plan.id, tagged_plan.id]
+
+    def test_fallback_for_users_without_signals(self):
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        upcoming = Plan.objects.create(
+            title='Anything',
+            host_user=host,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        candidates = generate_candidates([user.id], [None], [set()])
+        assert candidates == {user.id: [upcoming.id]}
+
+
+@pytest.mark.django_db
+class TestDirtyTracking:
+    """Test signals that mark users for recomputation."""
+
+    def test_new_plan_marks_nearby_users(self):
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        far_place = Place.objects.create(
+            name='Far Away', location=Point(-87.6298, 41.8781, srid=4326)
+        )
+        plan = Plan.objects.create(
+            title='Past Coffee',
+            host_user=host,
+            place=place,
+            starts_at=timezone.now() - timedelta(days=1),
+            ends_at=timezone.now() - timedelta(hours=22)
+        )
+        CheckIn.objects.create(
+            user=user, plan=plan, geo=Point(-74.0060, 40.7128, srid=4326)
+        )
+        RecoDirtyUser.objects.all().delete()
+
+        Plan.objects.create(
+            title='Chicago Plan',
+            host_user=host,
+            place=far_place,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        assert not RecoDirtyUser.objects.exists()
+
+        Plan.objects.create(
+            title='Coffee Hangout',
+            host_user=host,
+            place=place,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        dirty = RecoDirtyUser.objects.values_list('user_id', flat=True)
+        assert list(dirty) == [user.id]
+
+    def test_plan_update_marks_current_audience(self):
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        current = User.objects.create_user(
+            handle='current', email='current@example.com', password='test'
+        )
+        former = User.objects.create_user(
+            handle='former', email='former@example.com', password='test'
+        )
+        nearby = User.objects.create_user(
+            handle='nearby', email='nearby@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        far_place = Place.objects.create(
+            name='Far Away', location=Point(-87.6298, 41.8781, srid=4326)
+        )
+        past = Plan.objects.create(
+            title='Past Coffee',
+            host_user=host,
+            place=far_place,
+            starts_at=timezone.now() - timedelta(days=1),
+            ends_at=timezone.now() - timedelta(hours=22)
+        )
+        CheckIn.objects.create(
+            user=nearby, plan=past, geo=Point(-74.0060, 40.7128, srid=4326)
+        )
+        plan = Plan.objects.create(
+            title='Chicago Plan',
+            host_user=host,
+            place=far_place,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        for user in (current, former):
+            snapshot = RecoSnapshot.objects.create(user=user, algo_version='test')
+            RecoItem.objects.create(snapshot=snapshot, plan=plan, score=1, distance_m=0)
+        # The former audience has a newer snapshot without the plan
+        RecoSnapshot.objects.filter(user=former).update(
+            generated_at=timezone.now() - timedelta(hours=1)
+        )
+        RecoSnapshot.objects.create(user=former, algo_version='test')
+        RecoDirtyUser.objects.all().delete()
+
+        plan.place = place
+        plan.save()
+        dirty = RecoDirtyUser.objects.values_list('user_id', flat=True)
+        assert set(dirty) == {current.id, nearby.id}
+
+    def test_mark_refreshes_timestamp(self):
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        earlier = timezone.now() - timedelta(hours=1)
+        RecoDirtyUser.objects.mark([user.id], at=earlier)
+        RecoDirtyUser.objects.mark([user.id])
+        assert RecoDirtyUser.objects.get(user=user).marked_at > earlier
+
+
+@pytest.mark.django_db(transaction=True)
+class TestUserDeletion:
+    """Test deleting users with history; deferred foreign keys are checked at commit."""
+
+    def make_participant(self, handle, plan):
+        user = User.objects.create_user(
+            handle=handle, email=f'{handle}@example.com', password='test'
+        )
+        CheckIn.objects.create(
+            user=user, plan=plan, geo=Point(-74.0060, 40.7128, srid=4326)
+        )
+        Attendance.objects.create(user=user, plan=plan, status='joined')
+        return user
+
+    def test_delete_user_with_checkins_and_attendances(self):
+        host = User.objects.create_user(
+            handle='host', email='host@example.com', password='test'
+        )
+        place = Place.objects.create(
+            name='Coffee Shop', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        plan = Plan.objects.create(
+            title='Coffee Hangout',
+            host_user=host,
+            place=place,
+            tags=['coffee'],
+            starts_at=timezone.now() - timedelta(hours=1),
+            ends_at=timezone.now() + timedelta(hours=1)
+        )
+        first = self.make_participant('first', plan)
+        second = self.make_participant('second', plan)
+        third = self.make_participant('third', plan)
+
+        first.delete()
+        User.objects.filter(pk=second.pk).delete()
+        assert APIClient().delete(f'/api/users/{third.pk}/').status_code == 204
+
+        assert not User.objects.filter(pk__in=[first.pk, second.pk, third.pk]).exists()
+        assert not RecoDirtyUser.objects.exclude(user=host).exists()
+        assert not UserProfile.objects.exclude(user=host).exists()
+        assert not CheckIn.objects.exists() and not Attendance.objects.exists()
+
+
+def test_summarize_recommendations():
+    results = [
+        {
+            'users': 10, 'snapshots': 4, 'items': 40,
+            'write_seconds': 0.5, 'seconds': 1.0,
+        },
+        {
+            'users': 12, 'snapshots': 6, 'items': 60,
+            'write_seconds': 0.5, 'seconds': 2.0,
+        },
+    ]
+    message = summarize_recommendations(results, started_at=0)
+    assert message.startswith(
+        'Generated 10 recommendation snapshots for 22 users in 2 chunks'
+    )
+    assert '(110 rows/sec)' in message
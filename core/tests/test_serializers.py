@@ -0,0 +1,112 @@
+"""
+Unit tests for sparse fieldsets and compact plan lists.
+"""
+import pytest
+from datetime import timedelta
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from core.models import Attendance, Place, Plan, User
+from core.serializers import PlanSerializer
+
+
+def context(query='', **extra):
+    return {'request': Request(APIRequestFactory().get(f'/api/plans/{query}')), **extra}
+
+
+class TestSparseFields:
+    """Test field selection from query params and context."""
+
+    def test_nested_by_default(self):
+        fields = PlanSerializer(context=context()).fields
+        assert isinstance(fields['host_user'], serializers.ModelSerializer)
+        assert 'attendances' in fields
+
+    def test_compact(self):
+        fields = PlanSerializer(context=context(compact=True)).fields
+        assert isinstance(fields['host_user'], serializers.PrimaryKeyRelatedField)
+        assert isinstance(fields['venue'], serializers.PrimaryKeyRelatedField)
+        assert 'attendances' not in fields
+        assert 'attendee_count' in fields
+
+    def test_expand_and_fields(self):
+        fields = PlanSerializer(context=context(
+            '?expand=venue,bogus&fields=id,title,venue', compact=True
+        )).fields
+        readable = [name for name, field in fields.items() if not field.write_only]
+        assert readable == ['id', 'venue', 'title']
+        assert isinstance(fields['venue'], serializers.ModelSerializer)
+
+    def test_only_top_level(self):
+        serializer = PlanSerializer(many=True, context=context('?fields=id'))
+        list_fields = serializer.child.fields
+        readable = [
+            name for name, field in list_fields.items() if not field.write_only
+        ]
+        assert readable == ['id']
+
+        class Wrapper(serializers.Serializer):
+            plan = PlanSerializer()
+
+        nested = Wrapper(context=context('?fields=id')).fields['plan'].fields
+        assert 'title' in nested
+
+
+@pytest.mark.django_db
+class TestPlanList:
+    """Test compact plan lists over the API."""
+
+    @pytest.fixture
+    def plan(self):
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        place = Place.objects.create(
+            name='Here', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        starts_at = timezone.now() + timedelta(days=1)
+        plan = Plan.objects.create(
+            host_user=host, place=place, title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2)
+        )
+        for i, status in enumerate(['joined', 'joined', 'left']):
+            user = User.objects.create_user(
+                email=f'user{i}@example.com', handle=f'user{i}'
+            )
+            Attendance.objects.create(plan=plan, user=user, status=status)
+        return plan
+
+    def test_list_is_compact(self, plan):
+        item = APIClient().get('/api/plans/').data['results'][0]
+
+        assert item['host_user'] == plan.host_user_id
+        assert item['place'] == plan.place_id
+        assert item['attendee_count'] == 2
+        assert 'attendances' not in item
+
+    def test_list_expand(self, plan):
+        response = APIClient().get('/api/plans/', {
+            'expand': 'host_user,attendances',
+            'fields': 'id,host_user,attendances',
+        })
+        item = response.data['results'][0]
+
+        assert set(item) == {'id', 'host_user', 'attendances'}
+        assert item['host_user']['handle'] == 'host'
+        assert len(item['attendances']) == 3
+
+    def test_detail_is_nested(self, plan):
+        item = APIClient().get(f'/api/plans/{plan.id}/').data
+
+        assert item['place']['id'] == str(plan.place_id)
+        assert item['attendee_count'] == 2
+
+    def test_fields_do_not_limit_writes(self, plan):
+        response = APIClient().patch(
+            f'/api/plans/{plan.id}/?fields=id,title',
+            {'title': 'Renamed', 'capacity': 5}, format='json'
+        )
+
+        assert response.status_code == 200
+        plan.refresh_from_db()
+        assert (plan.title, plan.capacity) == ('Renamed', 5)
@@ -0,0 +1,58 @@
+"""
+Unit tests for the buffered snapshot writer.
+"""
+import pytest
+from django.contrib.gis.geos import Point
+from django.utils import timezone
+from datetime import timedelta
+from core.models import User, Place, Plan, RecoSnapshot, RecoItem
+from core.scoring import ScoredItem
+from core.snapshots import SnapshotWriter
+
+
+def test_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        SnapshotWriter(method='insert')
+
+
+@pytest.mark.django_db
+class TestSnapshotWriter:
+    """Test batching and persistence of snapshots."""
+
+    def _plan(self, user):
+        place = Place.objects.create(
+            name='Test Place', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+        return Plan.objects.create(
+            title='Test Plan',
+            host_user=user,
+            place=place,
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+
+    @pytest.mark.parametrize('method', ['bulk_create', 'copy'])
+    def test_flushes_in_batches(self, method):
+        users = [
+            User.objects.create_user(
+                handle=f'user{i}', email=f'user{i}@example.com', password='test'
+            )
+            for i in range(3)
+        ]
+        plan = self._plan(users[0])
+        items = [ScoredItem(plan.id, 0.85, 1200, 2)]
+
+        with SnapshotWriter(batch_size=4, method=method) as writer:
+            for user in users:
+                writer.add(user.id, items, algo_version='v1.0')
+            # Two rows per user, so the first two users were flushed already
+            assert RecoSnapshot.objects.count() == 2
+
+        assert writer.snapshot_count == 3
+        assert writer.item_count == 3
+        assert writer.rows_per_sec > 0
+        item = RecoItem.objects.get(snapshot__user=users[2])
+        assert float(item.score) == pytest.approx(0.85)
+        assert item.distance_m == 1200
+        assert item.shared_tags == 2
+        assert item.snapshot.generated_at is not None
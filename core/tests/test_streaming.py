@@ -0,0 +1,84 @@
+"""
+Unit tests for streaming list responses.
+"""
+import json
+import uuid
+import pytest
+from datetime import datetime, timezone
+from django.contrib.gis.geos import Point
+from rest_framework.test import APIClient
+from core.models import Place, User
+from core.serializers import PlaceSerializer, UserSerializer
+from core.streaming import render
+
+
+class Rows(list):
+    """A list standing in for a queryset."""
+
+    def iterator(self, chunk_size):
+        return iter(self)
+
+
+def make_users(count):
+    updated_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return Rows(
+        User(id=uuid.uuid4(), handle=f'user{i}', updated_at=updated_at)
+        for i in range(count)
+    )
+
+
+def test_json_array_across_chunks():
+    users = make_users(5)
+    body = ''.join(render(users, UserSerializer, 'json', chunk_size=2))
+
+    handles = [item['handle'] for item in json.loads(body)]
+    assert handles == [user.handle for user in users]
+
+
+def test_ndjson_lines():
+    users = make_users(3)
+    body = ''.join(render(users, UserSerializer, 'ndjson', chunk_size=2))
+
+    assert body.endswith('\n')
+    handles = [json.loads(line)['handle'] for line in body.splitlines()]
+    assert handles == ['user0', 'user1', 'user2']
+    assert ''.join(render(Rows(), UserSerializer, 'ndjson')) == ''
+    assert ''.join(render(Rows(), UserSerializer, 'json')) == '[]'
+
+
+def test_geojson_feature_collection():
+    places = Rows(
+        Place(
+            id=uuid.uuid4(), name=f'Place {i}', location=Point(-74.0, 40.7, srid=4326)
+        )
+        for i in range(3)
+    )
+    body = ''.join(render(places, PlaceSerializer, 'json', chunk_size=2))
+    collection = json.loads(body)
+
+    assert collection['type'] == 'FeatureCollection'
+    names = [feature['properties']['name'] for feature in collection['features']]
+    assert names == ['Place 0', 'Place 1', 'Place 2']
+
+
+@pytest.mark.django_db
+class TestStreamingEndpoints:
+    """Test ?stream= on list endpoints."""
+
+    def test_stream_modes(self):
+        for i in range(3):
+            User.objects.create_user(email=f'user{i}@example.com', handle=f'user{i}')
+        client = APIClient()
+
+        response = client.get('/api/users/', {'stream': 'ndjson'})
+        assert response.status_code == 200
+        assert response.streaming
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        handles = sorted(json.loads(line)['handle'] for line in lines)
+        assert handles == ['user0', 'user1', 'user2']
+
+        response = client.get('/api/users/', {'stream': 'json'})
+        assert len(json.loads(b''.join(response.streaming_content))) == 3
+
+        assert client.get('/api/users/', {'stream': 'xml'}).status_code == 400
@@ -0,0 +1,106 @@
+"""
+Unit tests for tag interning and bitset overlap.
+"""
+import numpy as np
+import pytest
+from django.db import transaction
+from django.utils import timezone
+from datetime import timedelta
+from core.models import User, Plan, InterestTag
+from core.tags import (
+    TagCodec, normalize_tags, overlap_counts, pack, paired_overlap_counts, popcount
+)
+
+
+class TestBitsets:
+    """Test packing and popcount overlap."""
+
+    def test_normalize_tags(self):
+        tags = normalize_tags([' Coffee', 'coffee', 'Music', 3, ''])
+        assert tags == ['coffee', 'music']
+        assert normalize_tags('coffee') == []
+
+    def test_pack_spans_words(self):
+        bits = pack([[0, 63, 64], []], 130)
+        assert bits.shape == (2, 3)
+        assert popcount(bits).tolist() == [[2, 1, 0], [0, 0, 0]]
+
+    def test_overlap_matches_set_intersection(self):
+        rng = np.random.default_rng(7)
+        a = [set(rng.choice(200, size=10, replace=False).tolist()) for _ in range(5)]
+        b = [set(rng.choice(200, size=30, replace=False).tolist()) for _ in range(8)]
+        counts = overlap_counts(pack(a, 200), pack(b, 200))
+        expected = [[len(x & y) for y in b] for x in a]
+        assert counts.tolist() == expected
+        paired = paired_overlap_counts(pack(a, 200), pack(b[:5], 200))
+        assert paired.tolist() == [len(x & y) for x, y in zip(a, b)]
+
+
+@pytest.mark.django_db
+class TestTagCodec:
+    """Test interning tags as InterestTag codes."""
+
+    @pytest.fixture(autouse=True)
+    def fresh_codec(self, monkeypatch):
+        # The process-wide codec may hold codes from rolled back tests
+        monkeypatch.setattr('core.tags._codec', None)
+
+    def test_intern_assigns_dense_codes(self):
+        codec = TagCodec().load()
+        first = codec.intern(['Coffee', 'music'])
+        again = TagCodec().load().intern(['music', 'coffee', 'hiking'])
+
+        assert sorted(first) == [1, 2]
+        assert again[:2] == [first[1], first[0]]
+        assert again[2] == 3
+        assert InterestTag.objects.get(code=first[0]).slug == 'coffee'
+
+    def test_encode_drops_unknown_tags(self):
+        codec = TagCodec().load()
+        codes = codec.intern(['coffee'])
+        assert TagCodec().load().encode(['COFFEE', 'unknown']) == codes
+
+    def test_encode_finds_tags_interned_elsewhere(self):
+        codec = TagCodec().load()
+        assert codec.encode(['coffee']) == []
+
+        codes = TagCodec().load().intern(['coffee'])
+        assert codec.encode(['coffee']) == codes
+
+    def test_codes_are_cached_once_committed(
+        self, django_capture_on_commit_callbacks, django_assert_num_queries
+    ):
+        codec = TagCodec().load()
+        with pytest.raises(RuntimeError):
+            with django_capture_on_commit_callbacks(execute=True), transaction.atomic():
+                codec.intern(['coffee'])
+                raise RuntimeError
+        assert codec.encode(['coffee']) == []
+
+        with django_capture_on_commit_callbacks(execute=True):
+            codes = codec.intern(['coffee'])
+        with django_assert_num_queries(0):
+            assert codec.encode(['coffee']) == codes
+
+    def test_existing_tags_get_a_code(self):
+        InterestTag.objects.create(name='Coffee', slug='coffee')
+        codes = TagCodec().load().intern(['coffee'])
+        assert InterestTag.objects.get(slug='coffee').code == codes[0]
+        assert InterestTag.objects.count() == 1
+
+    def test_plan_save_keeps_codes_in_sync(self):
+        user = User.objects.create_user(
+            handle='testuser', email='test@example.com', password='test'
+        )
+        plan = Plan.objects.create(
+            title='Test Plan',
+            host_user=user,
+            tags=['coffee', 'Music'],
+            starts_at=timezone.now() + timedelta(days=1),
+            ends_at=timezone.now() + timedelta(days=1, hours=2)
+        )
+        codes = set(InterestTag.objects.filter(
+            slug__in=['coffee', 'music']
+        ).values_list('code', flat=True))
+        assert set(plan.tag_codes) == codes
+        assert Plan.objects.filter(tag_codes__overlap=list(codes)).get() == plan
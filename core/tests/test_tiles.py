@@ -0,0 +1,108 @@
+"""
+Unit tests for the vector tile endpoints.
+"""
+import math
+import pytest
+from datetime import timedelta
+from django.contrib.gis.geos import Point
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework.test import APIClient
+from core.models import Place, Plan, User
+from core.tiles import parse_filters, valid_tile
+
+
+def tile_for(lon, lat, z):
+    n = 2 ** z
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+
+def test_valid_tile():
+    assert valid_tile(0, 0, 0)
+    assert valid_tile(3, 7, 7)
+    assert not valid_tile(3, 8, 0)
+    assert not valid_tile(-1, 0, 0)
+    assert not valid_tile(23, 0, 0)
+
+
+def test_parse_filters_only_accepts_layer_filters():
+    conditions, params = parse_filters(
+        'places', QueryDict('city=Bogota&tags=coffee,,music&status=active')
+    )
+    assert conditions == ['t.city = %(city)s', 't.tags ?| %(tags)s']
+    assert params == {'city': 'Bogota', 'tags': ['coffee', 'music']}
+
+    with pytest.raises(ValueError):
+        parse_filters('plans', QueryDict('starts_after=tomorrow'))
+
+
+@pytest.mark.django_db
+class TestTiles:
+    """Test rendering and caching of vector tiles."""
+
+    @pytest.fixture
+    def place(self):
+        return Place.objects.create(
+            name='Cafe', city='New York', location=Point(-74.0060, 40.7128, srid=4326)
+        )
+
+    def test_place_tile(self, place):
+        x, y = tile_for(-74.0060, 40.7128, 12)
+        client = APIClient()
+
+        response = client.get(f'/api/tiles/places/12/{x}/{y}.mvt')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/vnd.mapbox-vector-tile'
+        assert 'max-age' in response['Cache-Control']
+        assert response.content
+
+        cached = client.get(
+            f'/api/tiles/places/12/{x}/{y}.mvt', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        assert cached.status_code == 304
+
+        filtered = client.get(f'/api/tiles/places/12/{x}/{y}.mvt', {'city': 'Boston'})
+        assert filtered.status_code == 200
+        assert filtered.content == b''
+
+        empty = client.get(f'/api/tiles/places/12/{x + 2}/{y}.mvt')
+        assert empty.content == b''
+
+    def test_plan_tile_has_active_plans_only(self, place):
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        starts_at = timezone.now() + timedelta(days=1)
+        plan = Plan.objects.create(
+            host_user=host, place=place, title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2)
+        )
+        x, y = tile_for(-74.0060, 40.7128, 12)
+        client = APIClient()
+
+        assert client.get(f'/api/tiles/plans/12/{x}/{y}.mvt').content
+        plan.is_active = False
+        plan.save()
+        assert client.get(f'/api/tiles/plans/12/{x}/{y}.mvt').content == b''
+
+    def test_low_zoom_plan_tile_edges_follow_parallels(self):
+        # Tile 2/0/0 ends at 66.51°N; as a great circle its edge would bulge to ~73°N
+        host = User.objects.create_user(email='host@example.com', handle='host')
+        north = Place.objects.create(
+            name='North', location=Point(-135.0, 68.0, srid=4326)
+        )
+        starts_at = timezone.now() + timedelta(days=1)
+        Plan.objects.create(
+            host_user=host, place=north, title='Plan', starts_at=starts_at,
+            ends_at=starts_at + timedelta(hours=2)
+        )
+        assert tile_for(-135.0, 68.0, 2) == (0, 0)
+        client = APIClient()
+
+        assert client.get('/api/tiles/plans/2/0/0.mvt').content
+        assert client.get('/api/tiles/plans/2/0/1.mvt').content == b''
+
+    def test_unknown_layer_or_tile(self):
+        client = APIClient()
+        assert client.get('/api/tiles/users/0/0/0.mvt').status_code == 404
+        assert client.get('/api/tiles/places/2/4/0.mvt').status_code == 404
@@ -0,0 +1,163 @@
+"""
+Mapbox Vector Tiles for the map layers.
+
+Each tile is a single ST_AsMVT query: rows are picked with `&&` against
+the tile envelope (plus the render buffer) as an EPSG:4326 geometry, so
+the GiST index on the location column is used, then projected into tile
+coordinates with ST_AsMVTGeom. Plans compare their geography location
+cast to geometry (backed by an expression index): as a geography the
+envelope's edges would be great circles rather than parallels, and
+low-zoom tiles would gain or lose plans near their edges. Filters are a
+fixed set per layer, bound as query parameters.
+"""
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Cluster, ClusterGeneration, Place, Plan, Venue
+from .tags import get_codec
+
+MAX_ZOOM = 22
+EXTENT = 4096
+BUFFER = 64
+
+
+def _csv(value):
+    return [part for part in value.split(',') if part]
+
+
+def _datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+    return parsed
+
+
+def _tag_codes(value):
+    return get_codec().encode(_csv(value))
+
+
+# name -> table (aliased t), geometry column (and its indexed geometry expression if
+# different), attribute columns, fixed condition, and the filters accepted as query
+# params: param -> (condition, parser)
+LAYERS = {
+    'places': {
+        'table': f'{Place._meta.db_table} t',
+        'geometry': 't.location',
+        'columns': 't.id::text AS id, t.name, t.city, t.country',
+        'where': 'TRUE',
+        'filters': {
+            'city': ('t.city = %(city)s', str),
+            'country': ('t.country = %(country)s', str),
+            'tags': ('t.tags ?| %(tags)s', _csv),
+        },
+    },
+    'venues': {
+        'table': f'{Venue._meta.db_table} t',
+        'geometry': 't.location',
+        'columns': (
+            't.id::text AS id, t.name, t.partner_id::text AS partner_id, t.status'
+        ),
+        'where': 'TRUE',
+        'filters': {
+            'status': ('t.status = %(status)s', str),
+            'partner': ('t.partner_id::text = %(partner)s', str),
+            'categories': ('t.categories ?| %(categories)s', _csv),
+        },
+    },
+    'plans': {
+        'table': f'{Plan._meta.db_table} t',
+        'geometry': 't.location',
+        'indexed': 't.location::geometry(Point,4326)',  # plans_location_geom_gist
+        'columns': (
+            't.id::text AS id, t.title, t.capacity, t.visibility, '
+            't.cluster_id::text AS cluster_id, '
+            'extract(epoch FROM t.starts_at)::bigint AS starts_at, '
+            'extract(epoch FROM t.ends_at)::bigint AS ends_at'
+        ),
+        'where': 't.is_active AND t.ends_at >= %(now)s',
+        'filters': {
+            'visibility': ('t.visibility = %(visibility)s', str),
+            'tags': ('t.tag_codes && %(tags)s::int[]', _tag_codes),
+            'starts_after': ('t.starts_at >= %(starts_after)s', _datetime),
+            'starts_before': ('t.starts_at < %(starts_before)s', _datetime),
+        },
+    },
+    'clusters': {
+        'table': (
+            f'{Cluster._meta.db_table} t JOIN {ClusterGeneration._meta.db_table} g '
+            'ON g.id = t.generation_id AND g.is_active'
+        ),
+        'geometry': 't.centroid',
+        'columns': (
+            't.id::text AS id, t.label, t.scope, t.plan_count, '
+            'cardinality(t.member_ids) AS size'
+        ),
+        'where': 'TRUE',
+        'filters': {
+            'scope': ('t.scope = %(scope)s', str),
+        },
+    },
+}
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS tile,
+           ST_Transform(
+               ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326
+           ) AS area
+), features AS (
+    SELECT {columns},
+           ST_AsMVTGeom(
+               ST_Transform({geometry}::geometry, 3857), bounds.tile,
+               %(extent)s, %(buffer)s
+           ) AS geom
+    FROM {table}, bounds
+    WHERE {indexed} && bounds.area AND {where}
+    LIMIT %(limit)s
+)
+SELECT ST_AsMVT(features, %(layer)s, %(extent)s, 'geom') FROM features
+"""
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def parse_filters(layer, query_params):
+    """
+    SQL conditions and params for the layer filters present in the query.
+    Raises ValueError for malformed filter values.
+    """
+    conditions, params = [], {}
+    for name, (condition, parse) in LAYERS[layer]['filters'].items():
+        value = query_params.get(name)
+        if value:
+            conditions.append(condition)
+            params[name] = parse(value)
+    return conditions, params
+
+
+def render_tile(layer, z, x, y, conditions=(), params=None, now=None):
+    """The MVT bytes of one tile of a layer (empty when it has no features)."""
+    spec = LAYERS[layer]
+    sql = TILE_SQL.format(
+        columns=spec['columns'],
+        geometry=spec['geometry'],
+        table=spec['table'],
+        indexed=spec.get('indexed', spec['geometry']),
+        where=' AND '.join([spec['where'], *conditions]),
+    )
+    params = {
+        **(params or {}),
+        'z': z, 'x': x, 'y': y,
+        'margin': BUFFER / EXTENT,
+        'extent': EXTENT,
+        'buffer': BUFFER,
+        'limit': settings.TILE_MAX_FEATURES,
+        'layer': layer,
+        'now': now or timezone.now(),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return bytes(cursor.fetchone()[0] or b'')
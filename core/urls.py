@@ -6,7 +6,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserViewSet, PlaceViewSet, VenueViewSet, PlanViewSet,
     AttendanceViewSet, JoinRequestViewSet, CheckInViewSet,
-    MessageViewSet, ClusterViewSet, OfferViewSet, RecoSnapshotViewSet
+    MessageViewSet, ClusterViewSet, OfferViewSet, RecoSnapshotViewSet, TileView
 )
 
 router = DefaultRouter()
@@ -24,4 +24,8 @@ router.register(r'recs', RecoSnapshotViewSet, basename='recommendation')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path(
+        'tiles/<str:layer>/<int:z>/<int:x>/<int:y>.mvt', TileView.as_view(),
+        name='tile'
+    ),
 ]
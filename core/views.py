@@ -1,46 +1,174 @@
 """
 DRF views for the Spontime application.
 """
+import binascii
+import hashlib
+import json
+import uuid
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.conf import settings
+from django.contrib.gis.db import models as gis_models
+from django.contrib.gis.db.models.functions import GeometryDistance
 from django.contrib.gis.geos import Point
 from django.contrib.gis.measure import D
-from django.db import models
+from django.db.models import Q, Value
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework.utils.urls import replace_query_param
+from . import feed_cache, fragment_cache, nearby_cache, query_shape, streaming, tiles
+from .feed import fresh_snapshot, is_stale_at
+from .geo import bbox_geography, bbox_geometry, parse_bbox
+from .pyramid import band_for_zoom, cell_count
 from .models import (
-    User, Place, Venue, Plan, CheckIn, Cluster, Attendance,
+    User, Place, Venue, Plan, CheckIn, Cluster, MapCluster, Attendance,
     JoinRequest, Message, Offer, RecoSnapshot
 )
 from .serializers import (
     UserSerializer, PlaceSerializer, VenueSerializer, PlanSerializer,
-    CheckInSerializer, ClusterSerializer, AttendanceSerializer,
+    CheckInSerializer, ClusterSerializer, MapClusterSerializer, AttendanceSerializer,
     JoinRequestSerializer, MessageSerializer, OfferSerializer,
     RecoSnapshotSerializer
 )
 
+NEARBY_LIMIT = 20
+NEARBY_MAX_LIMIT = 100
+# Which nearby path issued a cursor
+NEARBY_CACHE = 'cache'
+NEARBY_DB = 'db'
 
-class UserViewSet(viewsets.ModelViewSet):
+
+class QueryShapeMixin:
+    """
+    Reads get the select_related/prefetch_related/only() plan derived
+    from the view's serializer, so lists take a fixed number of queries.
+    """
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS:
+            queryset = query_shape.optimize(queryset, self.get_serializer())
+        return queryset
+
+
+class FragmentHydrationMixin:
+    """List pages multi-get their cached serializer fragments up front."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        if args and kwargs.get('many'):
+            fragment_cache.hydrate(serializer, list(args[0]))
+        return serializer
+
+
+class StreamingListMixin:
+    """`?stream=json|ndjson` streams the whole filtered list instead of a page."""
+
+    def list(self, request, *args, **kwargs):
+        mode = request.query_params.get('stream')
+        if mode is None:
+            return super().list(request, *args, **kwargs)
+        if mode not in streaming.FORMATS:
+            return Response(
+                {'error': f"stream must be one of {', '.join(streaming.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return streaming.response(
+            self.filter_queryset(self.get_queryset()), self.get_serializer, mode
+        )
+
+
+class UserViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for User model."""
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
-class PlaceViewSet(viewsets.ModelViewSet):
+class ViewportMixin:
+    """Adds a capped `in_bbox` viewport query on the model's GiST-indexed location."""
+    viewport_geography = False
+
+    def get_viewport_queryset(self):
+        return self.get_queryset()
+
+    @action(detail=False, methods=['get'])
+    def in_bbox(self, request):
+        """
+        Get the features inside a viewport, at most VIEWPORT_MAX_FEATURES.
+        Query params:
+        - bbox: min_lon,min_lat,max_lon,max_lat
+        Returns `results`, `truncated` and `count`, the total number of matches.
+        """
+        try:
+            bbox = parse_bbox(request.query_params.get('bbox'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        area = bbox_geography(bbox) if self.viewport_geography else bbox_geometry(bbox)
+        features = self.filter_queryset(self.get_viewport_queryset()).filter(
+            location__intersects=area
+        ).order_by()
+        limit = settings.VIEWPORT_MAX_FEATURES
+        page = list(features[:limit + 1])
+        truncated = len(page) > limit
+        if truncated:
+            page = page[:limit]
+        serializer = self.get_serializer(page, many=True)
+        return Response({
+            'count': features.count() if truncated else len(page),
+            'truncated': truncated,
+            'results': serializer.data,
+        })
+
+
+class PlaceViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin,
+    ViewportMixin, viewsets.ModelViewSet
+):
     """ViewSet for Place model."""
     queryset = Place.objects.all()
     serializer_class = PlaceSerializer
 
 
-class VenueViewSet(viewsets.ModelViewSet):
+class VenueViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin,
+    ViewportMixin, viewsets.ModelViewSet
+):
     """ViewSet for Venue model."""
     queryset = Venue.objects.all()
     serializer_class = VenueSerializer
 
 
-class PlanViewSet(viewsets.ModelViewSet):
-    """ViewSet for Plan model with nearby search."""
+class PlanViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin,
+    ViewportMixin, viewsets.ModelViewSet
+):
+    """ViewSet for Plan model with nearby and viewport search."""
     queryset = Plan.objects.all()
     serializer_class = PlanSerializer
+    viewport_geography = True
+    # Actions answering with plan lists, compact unless `?expand=` asks for nesting
+    compact_actions = ['list', 'nearby', 'in_bbox']
+
+    def get_queryset(self):
+        return super().get_queryset().with_attendee_count()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['compact'] = self.action in self.compact_actions
+        return context
+
+    def get_viewport_queryset(self):
+        return self.get_queryset().filter(is_active=True, ends_at__gte=timezone.now())
 
     def perform_create(self, serializer):
         serializer.save(host_user=self.request.user)
@@ -48,15 +176,17 @@ class PlanViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def nearby(self, request):
         """
-        Get plans near a specific location.
+        Get plans near a specific location, nearest first.
         Query params:
         - lat: latitude
         - lon: longitude
         - radius: radius in meters (default: 5000)
+        - limit: page size (default: 20, max: 100)
+        - cursor: continuation token from a previous page's `next`
+        Each result carries its `distance` in meters.
         """
         lat = request.query_params.get('lat')
         lon = request.query_params.get('lon')
-        radius = int(request.query_params.get('radius', 5000))
 
         if not lat or not lon:
             return Response(
@@ -67,26 +197,115 @@ class PlanViewSet(viewsets.ModelViewSet):
         try:
             lat = float(lat)
             lon = float(lon)
+            radius = int(request.query_params.get('radius', 5000))
+            limit = int(request.query_params.get('limit', NEARBY_LIMIT))
+            limit = min(max(limit, 1), NEARBY_MAX_LIMIT)
         except ValueError:
             return Response(
-                {'error': 'Invalid lat or lon values'},
+                {'error': 'Invalid lat, lon, radius or limit values'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create a point from coordinates
-        point = Point(lon, lat, srid=4326)
-
-        # Find plans with places or venues near the point
-        nearby_plans = Plan.objects.filter(
-            models.Q(place__location__distance_lte=(point, D(m=radius))) |
-            models.Q(venue__location__distance_lte=(point, D(m=radius)))
-        ).select_related('host_user', 'place', 'venue', 'cluster').prefetch_related('attendances')
-
-        serializer = self.get_serializer(nearby_plans, many=True)
-        return Response(serializer.data)
+        cursor = request.query_params.get('cursor')
+        source, after = None, None
+        if cursor:
+            try:
+                source, after = _decode_cursor(cursor)
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST
+                )
+
+        # Small radii are filtered from the geohash-bucketed candidate cache. Its
+        # haversine distances differ slightly from PostGIS ones, so a cursor
+        # resumes on the path that issued it
+        candidates = None
+        if source != NEARBY_DB:
+            candidates = nearby_cache.within(lat, lon, radius)
+        if candidates is not None:
+            source = NEARBY_CACHE
+            page = self._nearby_from_candidates(candidates, after, limit)
+        elif source == NEARBY_CACHE:
+            return Response(
+                {'error': 'Expired cursor'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        else:
+            source = NEARBY_DB
+            page = self._nearby_from_db(lat, lon, radius, after, limit)
+
+        next_url = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_url = replace_query_param(
+                request.build_absolute_uri(), 'cursor',
+                _encode_cursor(source, page[-1].distance, page[-1].id)
+            )
 
+        serializer = self.get_serializer(page, many=True)
+        results = serializer.data
+        for item, plan in zip(results, page):
+            item['distance'] = round(plan.distance, 1)
+        return Response({'next': next_url, 'results': results})
 
-class AttendanceViewSet(viewsets.ModelViewSet):
+    def _nearby_from_db(self, lat, lon, radius, after, limit):
+        point = Point(lon, lat, srid=4326)
+        origin = Value(
+            point, output_field=gis_models.PointField(geography=True, srid=4326)
+        )
+
+        # Single ST_DWithin on the plan's own GiST-indexed geography,
+        # ordered by KNN distance with the id as tie-breaker
+        nearby_plans = self.filter_queryset(self.get_queryset()).filter(
+            is_active=True, location__dwithin=(point, D(m=radius))
+        ).annotate(
+            distance=GeometryDistance('location', origin)
+        ).order_by('distance', 'id')
+        if after:
+            distance, plan_id = after
+            nearby_plans = nearby_plans.filter(
+                Q(distance__gt=distance) | Q(distance=distance, id__gt=plan_id)
+            )
+        return list(nearby_plans[:limit + 1])
+
+    def _nearby_from_candidates(self, candidates, after, limit):
+        if after:
+            candidates = [candidate for candidate in candidates if candidate > after]
+        candidates = candidates[:limit + 1]
+        plans = self.filter_queryset(self.get_queryset()).in_bulk(
+            [pk for _, pk in candidates]
+        )
+        page = []
+        for distance, pk in candidates:
+            # Cached entries may briefly lag a deletion
+            if pk in plans:
+                plans[pk].distance = distance
+                page.append(plans[pk])
+        return page
+
+
+def _encode_cursor(source, distance, plan_id):
+    # repr() round-trips the float exactly, so the keyset comparison is stable
+    payload = json.dumps([source, repr(distance), str(plan_id)])
+    return urlsafe_b64encode(payload.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """(source, (distance, plan id)) of a nearby cursor."""
+    try:
+        source, distance, plan_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        if source not in (NEARBY_CACHE, NEARBY_DB):
+            raise ValueError('Invalid cursor')
+        return source, (float(distance), uuid.UUID(plan_id))
+    except (
+        TypeError, binascii.Error, json.JSONDecodeError, UnicodeDecodeError,
+        AttributeError
+    ) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+class AttendanceViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for Attendance model."""
     queryset = Attendance.objects.all()
     serializer_class = AttendanceSerializer
@@ -100,10 +319,12 @@ class AttendanceViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(plan_id=plan_id)
         if user_id:
             queryset = queryset.filter(user_id=user_id)
-        return queryset.select_related('user', 'plan')
+        return queryset
 
 
-class JoinRequestViewSet(viewsets.ModelViewSet):
+class JoinRequestViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for JoinRequest model."""
     queryset = JoinRequest.objects.all()
     serializer_class = JoinRequestSerializer
@@ -120,10 +341,12 @@ class JoinRequestViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(plan_id=plan_id)
         if user_id:
             queryset = queryset.filter(user_id=user_id)
-        return queryset.select_related('user', 'plan')
+        return queryset
 
 
-class CheckInViewSet(viewsets.ModelViewSet):
+class CheckInViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for CheckIn model."""
     queryset = CheckIn.objects.all()
     serializer_class = CheckInSerializer
@@ -140,10 +363,12 @@ class CheckInViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(user_id=user_id)
         if plan_id:
             queryset = queryset.filter(plan_id=plan_id)
-        return queryset.select_related('user', 'plan')
+        return queryset
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for Message model."""
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
@@ -157,16 +382,87 @@ class MessageViewSet(viewsets.ModelViewSet):
         plan_id = self.request.query_params.get('plan_id')
         if plan_id:
             queryset = queryset.filter(plan_id=plan_id)
-        return queryset.select_related('user', 'plan').order_by('created_at')
+        return queryset.order_by('created_at')
 
 
-class ClusterViewSet(viewsets.ReadOnlyModelViewSet):
-    """Read-only ViewSet for Cluster model."""
-    queryset = Cluster.objects.all()
+class ClusterViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin,
+    viewsets.ReadOnlyModelViewSet
+):
+    """Read-only ViewSet for Cluster model, serving active generations only."""
+    queryset = Cluster.objects.filter(generation__is_active=True)
     serializer_class = ClusterSerializer
 
+    @action(detail=False, methods=['get'])
+    def viewport(self, request):
+        """
+        Get precomputed map clusters inside a viewport.
+        Query params:
+        - bbox: min_lon,min_lat,max_lon,max_lat
+        - zoom: map zoom level; served from the nearest precomputed band
+        Viewports spanning more than MAP_VIEWPORT_MAX_CELLS cells of the band
+        are rejected.
+        """
+        try:
+            bbox = parse_bbox(request.query_params.get('bbox'))
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            zoom = int(request.query_params.get('zoom', ''))
+        except ValueError:
+            return Response(
+                {'error': 'zoom must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-class OfferViewSet(viewsets.ModelViewSet):
+        band = band_for_zoom(zoom)
+        if cell_count(bbox, band) > settings.MAP_VIEWPORT_MAX_CELLS:
+            return Response(
+                {'error': 'Viewport spans too many cells at this zoom'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        clusters = MapCluster.objects.filter(
+            zoom=band, centroid__intersects=bbox_geometry(bbox)
+        ).order_by('cell_y', 'cell_x')
+        serializer = MapClusterSerializer(clusters, many=True)
+        return Response(serializer.data)
+
+
+class TileView(APIView):
+    """Mapbox Vector Tiles of places, venues, active plans and clusters."""
+
+    def get(self, request, layer, z, x, y):
+        """
+        Get one tile of a layer, filtered by the layer's query params:
+        - places: city, country, tags (comma-separated, any)
+        - venues: status, partner, categories (comma-separated, any)
+        - plans: visibility, tags (comma-separated, any), starts_after, starts_before
+        - clusters: scope
+        Tiles carry an ETag and are cacheable for TILE_CACHE_SECONDS.
+        """
+        if layer not in tiles.LAYERS or not tiles.valid_tile(z, x, y):
+            return Response(
+                {'error': 'Unknown layer or tile'}, status=status.HTTP_404_NOT_FOUND
+            )
+        try:
+            conditions, params = tiles.parse_filters(layer, request.query_params)
+        except ValueError as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = tiles.render_tile(layer, z, x, y, conditions, params)
+        etag = quote_etag(hashlib.md5(data).hexdigest())
+        response = get_conditional_response(request, etag=etag) or HttpResponse(
+            data, content_type='application/vnd.mapbox-vector-tile'
+        )
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=settings.TILE_CACHE_SECONDS)
+        return response
+
+
+class OfferViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin, viewsets.ModelViewSet
+):
     """ViewSet for Offer model."""
     queryset = Offer.objects.all()
     serializer_class = OfferSerializer
@@ -177,10 +473,13 @@ class OfferViewSet(viewsets.ModelViewSet):
         venue_id = self.request.query_params.get('venue_id')
         if venue_id:
             queryset = queryset.filter(venue_id=venue_id)
-        return queryset.select_related('venue')
+        return queryset
 
 
-class RecoSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
+class RecoSnapshotViewSet(
+    StreamingListMixin, QueryShapeMixin, FragmentHydrationMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     """Read-only ViewSet for Recommendation snapshots."""
     queryset = RecoSnapshot.objects.all()
     serializer_class = RecoSnapshotSerializer
@@ -189,7 +488,9 @@ class RecoSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
     def feed(self, request):
         """
         Get personalized recommendation feed for the current user.
-        Returns the latest recommendation snapshot.
+        Returns the latest recommendation snapshot, computing a fresh one
+        within a time budget when none exists or it is older than
+        RECO_FEED_TTL_SECONDS.
         """
         if not request.user.is_authenticated:
             return Response(
@@ -197,10 +498,15 @@ class RecoSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_401_UNAUTHORIZED
             )
 
-        # Get the latest snapshot for the user
-        snapshot = RecoSnapshot.objects.filter(
-            user=request.user
-        ).select_related('user').prefetch_related('items__plan').order_by('-generated_at').first()
+        # Rendered feed for the current snapshot, unless it went stale
+        cached = feed_cache.get(request.user.id)
+        if cached is not None and not is_stale_at(
+            parse_datetime(cached['generated_at'])
+        ):
+            return Response(cached)
+
+        # Latest snapshot, recomputed online when missing or stale
+        snapshot = fresh_snapshot(request.user.id)
 
         if not snapshot:
             return Response(
@@ -209,5 +515,6 @@ class RecoSnapshotViewSet(viewsets.ReadOnlyModelViewSet):
             )
 
         serializer = self.get_serializer(snapshot)
+        query_shape.prefetch([snapshot], serializer)
+        feed_cache.store(request.user.id, snapshot.id, serializer.data)
         return Response(serializer.data)
-
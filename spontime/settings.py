@@ -95,6 +95,42 @@ DATABASES = {
 }
 
 
+# Cache
+# Redis when REDIS_URL is set, an in-process LRU-culled cache otherwise.
+# `fragments` holds serialized objects (core.fragment_cache), bounded by
+# FRAGMENT_CACHE_MAX_ENTRIES in process or the Redis maxmemory policy. That
+# Redis evicts keys, so it must not be the Celery broker's instance.
+
+REDIS_URL = os.getenv('REDIS_URL')
+FRAGMENT_CACHE_TTL_SECONDS = int(os.getenv('FRAGMENT_CACHE_TTL_SECONDS', '3600'))
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', '20000'))
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+        'fragments': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'fragments',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'fragments': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'fragments',
+            'OPTIONS': {'MAX_ENTRIES': FRAGMENT_CACHE_MAX_ENTRIES},
+        },
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -150,6 +186,8 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser',
     ],
 }
+# Rows per cursor fetch for ?stream= lists
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '2000'))
 
 # CORS
 CORS_ALLOW_ALL_ORIGINS = DEBUG
@@ -168,11 +206,74 @@ CELERY_TIMEZONE = 'UTC'
 CELERY_BEAT_SCHEDULE = {
     'update-clusters-every-hour': {
         'task': 'core.tasks.update_clusters',
-        'schedule': 3600.0,  # Run every hour
+        'schedule': 3600.0,  # Run every hour, changed cells only
+    },
+    'rebuild-clusters-daily': {
+        'task': 'core.tasks.update_clusters',
+        'schedule': 86400.0,  # Run once a day over every place and venue
+        'kwargs': {'full': True},
+    },
+    'update-map-pyramid-every-15-minutes': {
+        'task': 'core.tasks.update_map_pyramid',
+        'schedule': 900.0,  # Run every 15 minutes
     },
     'generate-recommendations-every-30-minutes': {
         'task': 'core.tasks.generate_recommendations',
-        'schedule': 1800.0,  # Run every 30 minutes
+        'schedule': 1800.0,  # Run every 30 minutes, dirty users only
+    },
+    'rebuild-recommendations-daily': {
+        'task': 'core.tasks.generate_recommendations',
+        'schedule': 86400.0,  # Run once a day for every active user
+        'kwargs': {'full': True},
     },
 }
 
+
+# Recommendations
+RECO_CHUNK_SIZE = int(os.getenv('RECO_CHUNK_SIZE', '2000'))
+RECO_SCORING_BLOCK_SIZE = int(os.getenv('RECO_SCORING_BLOCK_SIZE', '256'))
+RECO_SNAPSHOT_BATCH_SIZE = int(os.getenv('RECO_SNAPSHOT_BATCH_SIZE', '5000'))
+# bulk_create or copy
+RECO_SNAPSHOT_WRITE_METHOD = os.getenv('RECO_SNAPSHOT_WRITE_METHOD', 'bulk_create')
+RECO_CANDIDATE_RADIUS_M = int(os.getenv('RECO_CANDIDATE_RADIUS_M', '25000'))
+# Per source, per user
+RECO_CANDIDATE_LIMIT = int(os.getenv('RECO_CANDIDATE_LIMIT', '50'))
+# New plans mark users within this radius
+RECO_DIRTY_RADIUS_M = int(os.getenv('RECO_DIRTY_RADIUS_M', '10000'))
+# Older snapshots are recomputed on request
+RECO_FEED_TTL_SECONDS = int(os.getenv('RECO_FEED_TTL_SECONDS', '3600'))
+RECO_FEED_BUDGET_MS = int(os.getenv('RECO_FEED_BUDGET_MS', '300'))
+# Stale feed served after a budget overrun
+RECO_FEED_BACKOFF_SECONDS = int(os.getenv('RECO_FEED_BACKOFF_SECONDS', '60'))
+RECO_FEED_CACHE_TTL_SECONDS = int(os.getenv('RECO_FEED_CACHE_TTL_SECONDS', '86400'))
+
+
+# Clustering
+# DBSCAN neighbourhood radius, haversine meters
+CLUSTER_EPS_M = float(os.getenv('CLUSTER_EPS_M', '1000'))
+CLUSTER_MIN_SAMPLES = int(os.getenv('CLUSTER_MIN_SAMPLES', '2'))
+# Server-side cursor fetch size
+CLUSTER_STREAM_CHUNK_SIZE = int(os.getenv('CLUSTER_STREAM_CHUNK_SIZE', '10000'))
+# Tiles clustered in parallel, with an eps-wide halo
+CLUSTER_TILE_DEG = float(os.getenv('CLUSTER_TILE_DEG', '1.0'))
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))
+# Larger changed regions rebuild fully
+CLUSTER_INCREMENTAL_MAX_TILES = int(os.getenv('CLUSTER_INCREMENTAL_MAX_TILES', '400'))
+CLUSTER_PYRAMID_ZOOMS = [
+    int(zoom) for zoom in os.getenv('CLUSTER_PYRAMID_ZOOMS', '2,5,8,11,14').split(',')
+]
+# Per clusters/viewport request
+MAP_VIEWPORT_MAX_CELLS = int(os.getenv('MAP_VIEWPORT_MAX_CELLS', '4096'))
+
+
+# Nearby and viewport search
+NEARBY_CACHE_TTL_SECONDS = int(os.getenv('NEARBY_CACHE_TTL_SECONDS', '30'))
+# Denser cells always query
+NEARBY_CACHE_MAX_CANDIDATES = int(os.getenv('NEARBY_CACHE_MAX_CANDIDATES', '5000'))
+# Per in_bbox response
+VIEWPORT_MAX_FEATURES = int(os.getenv('VIEWPORT_MAX_FEATURES', '500'))
+
+
+# Vector tiles
+TILE_MAX_FEATURES = int(os.getenv('TILE_MAX_FEATURES', '10000'))  # per tile and layer
+TILE_CACHE_SECONDS = int(os.getenv('TILE_CACHE_SECONDS', '300'))